@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Workflow benchmarks
+- Generates synthetic raw data for both workflows at the requested sizes
+- Times and memory-profiles every stage function (ingest, process,
+  analyze/visualize), each in its own process, plus the sub-steps the stage
+  modules mark with profiling.step
+- Writes the results as sorted, indented JSON so runs on different commits
+  (on the same machine) can be compared with diff or with --compare
+- Needs nothing beyond the workflow requirements and no network access
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+
+import synthetic
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+
+# Generated data and stage outputs; reused across runs for the same size and seed
+work_root = os.path.join(bench_dir, 'work')
+results_dir = os.path.join(bench_dir, 'results')
+
+# Stage files and functions of each workflow, in run order, with the keyword
+# arguments each stage function takes from the benchmark options
+WORKFLOWS = {
+    'frailty': {
+        'question_dir': os.path.join(repo_dir, 'question-01'),
+        'raw_path': os.path.join('data', 'raw', 'frailty.csv'),
+        'stages': [
+            ('ingest', '1_ingest.py', 'ingest_data', ['chunksize']),
+            ('process', '2_process.py', 'process_data', ['workers']),
+            ('analyze', '3_analyze.py', 'analyze_data', ['chunksize']),
+        ],
+    },
+    'students': {
+        'question_dir': os.path.join(repo_dir, 'question-02'),
+        'raw_path': os.path.join('data', 'raw', 'StudentsPerformance.csv'),
+        'stages': [
+            ('ingest', '1_ingest.py', 'ingest_data', ['chunksize']),
+            ('process', '2_process.py', 'process_data', ['workers', 'chunksize']),
+            ('visualize', '3_visualize.py', 'visualize_data', ['workers']),
+        ],
+    },
+}
+
+DEFAULT_SIZES = [10**3, 10**4, 10**5]
+
+# Fields kept from each stage's profiling record
+METRICS = ['wall_s', 'cpu_s', 'peak_rss_bytes', 'traced_peak_bytes', 'bytes_read', 'bytes_written']
+
+
+def prepare_work_dir(workflow, rows, seed):
+    """Create the work directory for one size and generate its raw file if needed."""
+    spec = WORKFLOWS[workflow]
+    work_dir = os.path.join(work_root, f'{workflow}-{rows}-seed{seed}')
+    raw_path = os.path.join(work_dir, spec['raw_path'])
+    if not os.path.exists(raw_path):
+        print(f"Generating {rows} synthetic {workflow} rows...")
+        synthetic.write_csv(workflow, rows, raw_path, seed=seed)
+    for sub in ('processed', 'cache'):
+        os.makedirs(os.path.join(work_dir, 'data', sub), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'reports'), exist_ok=True)
+    return work_dir
+
+
+def run_stage(workflow, stage, work_dir, options, tracemalloc=False):
+    """Run one stage function in a subprocess; return its profiling records."""
+    spec = WORKFLOWS[workflow]
+    _, stage_file, function, option_names = next(s for s in spec['stages'] if s[0] == stage)
+    kwargs = {name: options[name] for name in option_names if options.get(name) is not None}
+    metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    cmd = [sys.executable, os.path.join(bench_dir, 'stage_worker.py'), spec['question_dir'],
+           stage_file, function, work_dir, metrics_path, json.dumps(kwargs)]
+    if tracemalloc:
+        cmd.append('tracemalloc')
+    with open(os.path.join(work_dir, f'{stage}.log'), 'w') as log:
+        completed = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{workflow} {stage} failed - see {log.name}")
+    with open(metrics_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def summarize_records(records, function):
+    """Stage metrics plus the wall time of each sub-step."""
+    stage = next(r for r in records if r['step'] == function)
+    result = {key: stage[key] for key in METRICS if stage.get(key) is not None}
+    steps = {}
+    for r in records:
+        if r['step'].startswith(function + '/'):
+            name = r['step'][len(function) + 1:]
+            steps[name] = round(steps.get(name, 0.0) + r['wall_s'], 6)
+    if steps:
+        result['steps'] = steps
+    return result
+
+
+def best_of(runs):
+    """Keep the fastest run's timings and the lowest memory peaks."""
+    best = dict(min(runs, key=lambda r: r['wall_s']))
+    for key in ('peak_rss_bytes', 'traced_peak_bytes'):
+        values = [r[key] for r in runs if r.get(key) is not None]
+        if values:
+            best[key] = min(values)
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(workflows, sizes, stages=None, repeat=1, seed=0, chunksize=None, workers=1,
+                   tracemalloc=False):
+    """Benchmark the selected stages at every size and return the results document."""
+    options = {'chunksize': chunksize, 'workers': workers}
+    results = {}
+    for workflow in workflows:
+        for rows in sizes:
+            work_dir = prepare_work_dir(workflow, rows, seed)
+            for stage, _, function, _ in WORKFLOWS[workflow]['stages']:
+                if stages and stage not in stages:
+                    continue
+                runs = []
+                for _ in range(repeat):
+                    records = run_stage(workflow, stage, work_dir, options, tracemalloc)
+                    runs.append(summarize_records(records, function))
+                result = best_of(runs)
+                results.setdefault(workflow, {}).setdefault(stage, {})[str(rows)] = result
+                print(f"  {workflow:<9} {stage:<10} {rows:>11,} rows  {result['wall_s']:9.3f} s  "
+                      f"{result['peak_rss_bytes'] / 2**20:9.1f} MiB")
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': {'seed': seed, 'repeat': repeat, 'chunksize': chunksize, 'workers': workers,
+                    'tracemalloc': tracemalloc},
+        'results': results,
+    }
+
+
+def compare(base, current, threshold=1.25):
+    """Print wall-time and peak-RSS ratios (current / base) per stage and size.
+
+    Returns the number of entries slower or bigger than threshold.
+    """
+    flagged = 0
+    print(f"\n{'workflow':<9} {'stage':<10} {'rows':>11}  {'wall':>8}  {'peak rss':>8}")
+    for workflow, stages in current['results'].items():
+        for stage, sizes in stages.items():
+            for rows, result in sizes.items():
+                old = base['results'].get(workflow, {}).get(stage, {}).get(rows)
+                if old is None:
+                    continue
+                wall = result['wall_s'] / old['wall_s'] if old['wall_s'] else float('nan')
+                rss = result['peak_rss_bytes'] / old['peak_rss_bytes']
+                mark = '  REGRESSION' if max(wall, rss) > threshold else ''
+                flagged += bool(mark)
+                print(f"{workflow:<9} {stage:<10} {int(rows):>11,}  {wall:7.2f}x  {rss:7.2f}x{mark}")
+    return flagged
+
+
+def parse_size(text):
+    """Accept 1000, 1e6 or 10**6."""
+    if '**' in text:
+        base, exponent = text.split('**')
+        return int(base) ** int(exponent)
+    return int(float(text))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workflow', action='append', choices=list(WORKFLOWS),
+                        help='workflow to benchmark (repeatable; default: both)')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=DEFAULT_SIZES,
+                        help='row counts to generate, e.g. 1e3 1e5 1e7 (default: 1e3 1e4 1e5)')
+    parser.add_argument('--stage', action='append',
+                        help='stage to benchmark (repeatable; default: all)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs per stage and size; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic data')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='chunk size passed to the stages that stream (needed for sizes beyond memory)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes passed to process and visualize')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also record the peak traced Python allocation of each stage (slower)')
+    parser.add_argument('--output', default=os.path.join(results_dir, 'latest.json'),
+                        help='where to write the results (default: benchmarks/results/latest.json)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='ratio above which --compare flags a regression')
+    parser.add_argument('--clean', action='store_true',
+                        help='delete the generated data and stage outputs first')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.clean:
+        shutil.rmtree(work_root, ignore_errors=True)
+    start_time = time.time()
+    document = run_benchmarks(args.workflow or list(WORKFLOWS), args.sizes, stages=args.stage,
+                              repeat=args.repeat, seed=args.seed, chunksize=args.chunksize,
+                              workers=args.workers, tracemalloc=args.tracemalloc)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Results saved to {args.output} ({time.time() - start_time:.1f} s)")
+    if args.compare:
+        with open(args.compare) as f:
+            flagged = compare(json.load(f), document, args.threshold)
+        sys.exit(1 if flagged else 0)
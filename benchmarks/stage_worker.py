@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark stage worker
+- Runs one stage function of one workflow in a fresh process, so each stage
+  gets its own peak RSS and the two workflows' same-named stage modules
+  (1_ingest, 2_process) never share an interpreter
+- Points the stage module's data and report paths at a benchmark work
+  directory instead of the question's own data
+- Records the stage and its sub-steps with the shared profiling module
+
+Usage: stage_worker.py QUESTION_DIR STAGE_FILE FUNCTION WORK_DIR METRICS_PATH KWARGS_JSON [TRACEMALLOC]
+"""
+
+import os
+import sys
+import json
+import importlib.util
+
+
+def load_stage_module(question_dir, stage_file):
+    path = os.path.join(question_dir, 'src', stage_file)
+    name = os.path.splitext(stage_file)[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def rebase_paths(module, question_dir, work_dir):
+    """Redirect the module's *_path globals from question_dir to work_dir.
+
+    Question 1 uses paths relative to the working directory, which the chdir
+    into work_dir already covers; question 2 builds absolute paths from its
+    script location.
+    """
+    for name, value in list(vars(module).items()):
+        if name.endswith('_path') and isinstance(value, str) and value.startswith(question_dir + os.sep):
+            setattr(module, name, os.path.join(work_dir, os.path.relpath(value, question_dir)))
+
+
+def main(argv):
+    question_dir, stage_file, function, work_dir, metrics_path, kwargs = argv[:6]
+    tracemalloc = len(argv) > 6 and argv[6] == 'tracemalloc'
+    question_dir = os.path.abspath(question_dir)
+    metrics_path = os.path.abspath(metrics_path)
+    kwargs = json.loads(kwargs)
+
+    sys.path.insert(0, os.path.join(question_dir, 'src'))
+    sys.path.insert(0, os.path.join(os.path.dirname(question_dir), 'common'))
+    os.chdir(work_dir)
+    import profiling
+
+    module = load_stage_module(question_dir, stage_file)
+    rebase_paths(module, question_dir, work_dir)
+    profiler = profiling.enable(metrics_path=metrics_path, output_dir=os.path.dirname(metrics_path),
+                                tracemalloc_stages=[function] if tracemalloc else ())
+    with profiler.step(function) as record:
+        result = getattr(module, function)(**kwargs)
+        if hasattr(result, 'shape'):
+            record['rows_out'] = len(result)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generators
+- Write raw CSV files with the same schemas as frailty.csv and
+  StudentsPerformance.csv, at any number of rows
+- Categorical columns keep the cardinalities and frequencies of the real
+  student data; scores are correlated like the real ones and shift with
+  gender, lunch and test preparation
+- Rows are generated and written in chunks from a seeded generator, so
+  large files need little memory and the same (rows, seed) gives the same file
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 1_000_000
+
+# Level frequencies of the 1,000-row StudentsPerformance.csv
+STUDENT_LEVELS = {
+    'gender': {'female': 0.518, 'male': 0.482},
+    'race/ethnicity': {'group A': 0.089, 'group B': 0.190, 'group C': 0.319,
+                       'group D': 0.262, 'group E': 0.140},
+    'parental level of education': {"some high school": 0.179, "high school": 0.196,
+                                    "some college": 0.226, "associate's degree": 0.222,
+                                    "bachelor's degree": 0.118, "master's degree": 0.059},
+    'lunch': {'standard': 0.645, 'free/reduced': 0.355},
+    'test preparation course': {'none': 0.642, 'completed': 0.358},
+}
+SCORE_COLUMNS = ['math score', 'reading score', 'writing score']
+
+# Score shifts (math, reading, writing) for the second level of each binary
+# column, roughly as in the real data
+SCORE_EFFECTS = {
+    ('gender', 'male'): np.array([5.0, -7.0, -9.0]),
+    ('lunch', 'standard'): np.array([11.0, 7.0, 8.0]),
+    ('test preparation course', 'completed'): np.array([5.5, 7.5, 10.0]),
+}
+SCORE_MEANS = np.array([55.0, 63.0, 62.0])
+SCORE_STD = np.array([13.0, 13.0, 12.5])
+SCORE_CORR = np.array([[1.0, 0.80, 0.78],
+                       [0.80, 1.0, 0.95],
+                       [0.78, 0.95, 1.0]])
+
+
+def _sample_levels(rng, levels, size):
+    names = list(levels)
+    p = np.array(list(levels.values()))
+    return np.array(names, dtype=object)[rng.choice(len(names), size=size, p=p / p.sum())]
+
+
+def students_chunk(rng, size):
+    """One chunk of StudentsPerformance-like rows."""
+    df = pd.DataFrame({col: _sample_levels(rng, levels, size) for col, levels in STUDENT_LEVELS.items()})
+    cov = SCORE_CORR * np.outer(SCORE_STD, SCORE_STD)
+    scores = rng.multivariate_normal(SCORE_MEANS, cov, size=size, method='cholesky')
+    for (col, level), effect in SCORE_EFFECTS.items():
+        scores += np.outer(df[col].to_numpy() == level, effect)
+    scores = np.clip(np.rint(scores), 0, 100).astype(np.int64)
+    for i, col in enumerate(SCORE_COLUMNS):
+        df[col] = scores[:, i]
+    return df
+
+
+def frailty_chunk(rng, size):
+    """One chunk of frailty.csv-like rows (heights in inches, weights in pounds)."""
+    age = rng.integers(17, 86, size=size)
+    grip = np.rint(rng.normal(27.0, 4.0, size=size) - 0.08 * (age - 40)).clip(5, 60).astype(np.int64)
+    frail = rng.random(size) < 1 / (1 + np.exp((grip - 26.0) / 3.0))
+    return pd.DataFrame({
+        'Height': np.round(rng.normal(68.2, 1.7, size=size), 1),
+        'Weight': np.rint(rng.normal(136.0, 14.0, size=size)).astype(np.int64),
+        'Age': age,
+        'Grip strength': grip,
+        'Frailty': np.where(frail, 'Y', 'N'),
+    })
+
+
+GENERATORS = {
+    'frailty': (frailty_chunk, {}),
+    # The real file quotes every field
+    'students': (students_chunk, {'quoting': 1}),
+}
+
+
+def write_csv(schema, rows, path, seed=0, chunk_rows=CHUNK_ROWS):
+    """Write rows synthetic rows of schema ('frailty' or 'students') to path."""
+    make_chunk, csv_kwargs = GENERATORS[schema]
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = make_chunk(rng, min(chunk_rows, rows - start))
+            chunk.to_csv(f, index=False, header=start == 0, **csv_kwargs)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5) or sys.argv[1] not in GENERATORS:
+        sys.exit(f"usage: {sys.argv[0]} {{{','.join(GENERATORS)}}} ROWS PATH [SEED]")
+    schema, rows, path = sys.argv[1], int(float(sys.argv[2])), sys.argv[3]
+    seed = int(sys.argv[4]) if len(sys.argv) == 5 else 0
+    write_csv(schema, rows, path, seed)
+    print(f"Wrote {rows} {schema} rows to {path}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Incremental appends
+- Appends a file of new raw records to the raw CSV, after checking that it
+  has the same columns, once its rows are processed and stored
+- Undoes a partly written append if a step fails, so it can be retried
+- Keeps the processed store as the base Parquet file plus one Parquet part
+  per append, listed in the order they were written
+- Saves a stage's sufficient statistics next to the processed store, with the
+  size and mtime of the processed files they cover, so an append can merge
+  the new rows into them instead of rescanning the history
+"""
+
+import os
+import glob
+import pickle
+import shutil
+import contextlib
+
+
+def check_header(raw_path, new_path):
+    """Raise ValueError unless new_path has raw_path's header."""
+    with open(raw_path, 'rb') as raw, open(new_path, 'rb') as new:
+        if new.readline().strip() != raw.readline().strip():
+            raise ValueError(f"{new_path} does not have the columns of {raw_path}")
+
+
+def append_raw(raw_path, new_path):
+    """Append the rows of new_path (a CSV with raw_path's header) to raw_path."""
+    check_header(raw_path, new_path)
+    with open(new_path, 'rb') as src:
+        src.readline()
+        with open(raw_path, 'rb+') as dst:
+            # Make sure the first new row starts on a line of its own
+            dst.seek(0, os.SEEK_END)
+            if dst.tell():
+                dst.seek(-1, os.SEEK_END)
+                if dst.read(1) != b'\n':
+                    dst.write(b'\n')
+            shutil.copyfileobj(src, dst)
+
+
+@contextlib.contextmanager
+def undo_on_failure(created=(), extended=()):
+    """Undo the writes of the block if it raises.
+
+    The files in created are deleted and the existing files in extended are
+    truncated back to their size before the block, so an append that failed
+    part way leaves the raw CSV and the processed store as they were.
+    Statistics saved in the block no longer match the files and are rebuilt.
+    """
+    sizes = {path: os.path.getsize(path) for path in extended if os.path.exists(path)}
+    try:
+        yield
+    except BaseException:
+        for path in created:
+            if os.path.exists(path):
+                os.remove(path)
+        for path, size in sizes.items():
+            with open(path, 'rb+') as f:
+                f.truncate(size)
+        raise
+
+
+def processed_files(base_path, appends_dir):
+    """The base processed Parquet file followed by the appended parts, in order."""
+    return [base_path] + sorted(glob.glob(os.path.join(appends_dir, 'part-*.parquet')))
+
+
+def next_part_path(appends_dir):
+    """Path for the next appended part."""
+    os.makedirs(appends_dir, exist_ok=True)
+    parts = glob.glob(os.path.join(appends_dir, 'part-*.parquet'))
+    number = max((int(os.path.basename(p)[5:-8]) for p in parts), default=0) + 1
+    return os.path.join(appends_dir, f'part-{number:05d}.parquet')
+
+
+def clear_appends(appends_dir):
+    """Delete the appended parts (after the base file was rebuilt from all raw rows)."""
+    for path in glob.glob(os.path.join(appends_dir, 'part-*.parquet')):
+        os.remove(path)
+
+
+def file_stamps(paths):
+    stamps = {}
+    for path in paths:
+        stat = os.stat(path)
+        stamps[path] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def load_statistics(path, files):
+    """The statistics saved at path if they cover exactly files (unchanged), else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, AttributeError, ImportError, EOFError):
+        return None
+    if saved.get('files') != file_stamps(files):
+        return None
+    return saved['statistics']
+
+
+def save_statistics(path, statistics, files):
+    """Save statistics as covering files."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'files': file_stamps(files), 'statistics': statistics}, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Partitioned execution
+- Splits a raw CSV into line-aligned byte ranges, or an in-memory frame into
+  row slices, so row-local work can run on several cores
+- Maps a function over the partitions in a pool of forked processes and
+  returns the results in partition order
+- Concatenates partition frames the way a single parse would have typed them
+"""
+
+import io
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+# Frame the RowSlice partitions index into; set before the pool forks so the
+# workers inherit it instead of receiving pickled slices
+_shared_frame = None
+
+
+class CsvRange:
+    """Rows of a CSV file between two line boundaries, read with the file's header.
+
+    Assumes no quoted field contains a newline, which holds for both raw files.
+    """
+
+    def __init__(self, path, header, start, end):
+        self.path = path
+        self.header = header
+        self.start = start
+        self.end = end
+
+    def read(self, reader=pd.read_csv):
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            data = f.read(self.end - self.start)
+        return reader(io.BytesIO(self.header + data))
+
+
+class RowSlice:
+    """Rows [start, end) of the shared frame."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def read(self, reader=None):
+        return _shared_frame.iloc[self.start:self.end]
+
+
+def csv_partitions(path, n_parts):
+    """Split path into at most n_parts CsvRanges of roughly equal size."""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        data_start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        bounds = [data_start]
+        for i in range(1, n_parts):
+            offset = data_start + (size - data_start) * i // n_parts
+            if offset <= bounds[-1]:
+                continue
+            # Move each cut to the start of the next line
+            f.seek(offset - 1)
+            f.readline()
+            if f.tell() < size and f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+        bounds.append(size)
+    return [CsvRange(path, header, start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def frame_partitions(df, n_parts):
+    """Split df into at most n_parts RowSlices and share it with the workers."""
+    global _shared_frame
+    _shared_frame = df
+    step = max(-(-len(df) // n_parts), 1)
+    return [RowSlice(start, min(start + step, len(df))) for start in range(0, len(df), step)]
+
+
+def map_partitions(func, partitions, workers, *args):
+    """Return [func(partition, *args) for partition in partitions], computed in parallel.
+
+    Uses a fork pool (so workers inherit the shared frame and the loaded stage
+    modules); without fork, or if the pool breaks, the partitions are run
+    serially in this process.
+    """
+    workers = min(workers, len(partitions))
+    if workers > 1 and 'fork' in mp.get_all_start_methods():
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork')) as pool:
+                return list(pool.map(func, partitions, *[[arg] * len(partitions) for arg in args]))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Parallel processing failed ({e}); processing serially")
+    return [func(partition, *args) for partition in partitions]
+
+
+def concat_partitions(frames):
+    """Concatenate partition frames in order, as one parse of all the rows would type them.
+
+    Unordered categoricals whose partitions saw different levels get the sorted
+    union of the levels; other dtypes are upcast by pd.concat (e.g. int64 and
+    float64 give float64, as a single parse of a column with a NaN would).
+    """
+    frames = list(frames)
+    for col in frames[0].columns:
+        dtypes = [frame[col].dtype for frame in frames]
+        if (all(isinstance(dtype, pd.CategoricalDtype) and not dtype.ordered for dtype in dtypes)
+                and any(dtype != dtypes[0] for dtype in dtypes)):
+            levels = sorted(set().union(*(dtype.categories for dtype in dtypes)))
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(levels)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
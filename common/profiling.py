@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Workflow profiling
+- Records wall time, CPU time, peak RSS, rows in/out and bytes read/written
+  for every stage and sub-step, as one JSON line per step
+- Optionally wraps whole stages in cProfile or tracemalloc and writes the
+  results next to the reports
+- Does nothing unless a Profiler has been enabled, so the stage modules can
+  mark their steps unconditionally
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_active = None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _io_counters():
+    """(bytes read, bytes written) by this process so far, where the OS reports it."""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class Profiler:
+    """Collects step records and appends them to metrics_path as JSON lines.
+
+    Records are written as soon as a step ends, so steps run in forked worker
+    processes land in the same file. cprofile_stages and tracemalloc_stages
+    name the top-level steps to wrap in cProfile / tracemalloc; their reports
+    go to output_dir.
+    """
+
+    def __init__(self, metrics_path=None, output_dir=None, cprofile_stages=(), tracemalloc_stages=()):
+        self.metrics_path = metrics_path
+        self.output_dir = output_dir
+        self.cprofile_stages = set(cprofile_stages)
+        self.tracemalloc_stages = set(tracemalloc_stages)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        self._stack = []
+        if metrics_path:
+            os.makedirs(os.path.dirname(metrics_path) or '.', exist_ok=True)
+
+    @contextmanager
+    def step(self, name, rows_in=None, rows_out=None):
+        top_level = not self._stack
+        self._stack.append(name)
+        record = {
+            'run_id': self.run_id,
+            'pid': os.getpid(),
+            'step': '/'.join(self._stack),
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+        }
+        profiler = self._start_cprofile(name) if top_level else None
+        tracing = self._start_tracemalloc(name) if top_level else False
+        read_before, written_before = _io_counters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall_start, 6)
+            record['cpu_s'] = round(time.process_time() - cpu_start, 6)
+            record['peak_rss_bytes'] = _peak_rss_bytes()
+            read_after, written_after = _io_counters()
+            if read_before is not None:
+                record['bytes_read'] = read_after - read_before
+                record['bytes_written'] = written_after - written_before
+            if profiler is not None:
+                self._dump_cprofile(name, profiler)
+            if tracing:
+                record['traced_peak_bytes'] = self._dump_tracemalloc(name)
+            self._stack.pop()
+            self._write(record)
+
+    def _write(self, record):
+        self.records.append(record)
+        if self.metrics_path:
+            with open(self.metrics_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def _start_cprofile(self, name):
+        if name not in self.cprofile_stages:
+            return None
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _dump_cprofile(self, name, profiler):
+        import pstats
+        profiler.disable()
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f'{name}_cprofile')
+        profiler.dump_stats(base + '.prof')
+        with open(base + '.txt', 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+        print(f"cProfile results saved to {base}.prof")
+
+    def _start_tracemalloc(self, name):
+        if name not in self.tracemalloc_stages:
+            return False
+        import tracemalloc
+        tracemalloc.start()
+        return True
+
+    def _dump_tracemalloc(self, name):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f'{name}_tracemalloc.txt')
+        with open(path, 'w') as f:
+            f.write(f"Traced memory: current {current} bytes, peak {peak} bytes\n\n")
+            for stat in snapshot.statistics('lineno')[:40]:
+                f.write(f"{stat}\n")
+        print(f"tracemalloc results saved to {path}")
+        return peak
+
+
+def enable(**kwargs):
+    """Start recording steps; kwargs are passed to Profiler."""
+    global _active
+    _active = Profiler(**kwargs)
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+@contextmanager
+def step(name, rows_in=None, rows_out=None):
+    """Time a step under the active profiler; yields a dict for extra fields.
+
+    Set record['rows_out'] (or rows_in) inside the block once it is known.
+    Without an active profiler this only yields a throwaway dict.
+    """
+    if _active is None:
+        yield {}
+        return
+    with _active.step(name, rows_in=rows_in, rows_out=rows_out) as record:
+        yield record
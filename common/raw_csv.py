@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Raw CSV reader
+- Reads a raw CSV with fixed columns (the frailty and the student
+  performance files) through a memory map instead of pandas' tokenizer
+- Finds the row and field boundaries with vectorized scans for newlines,
+  commas and quotes, one block of the file at a time
+- Parses the numeric fields straight from their bytes into typed arrays, and
+  maps the categorical fields to codes through a small dictionary of their
+  distinct values, so no per-cell Python object is created
+- The columns and their dtypes come from the caller's schema, one per dataset
+- Raises UnsupportedCSV for anything outside that fast path (missing or
+  malformed fields, quotes inside a field, exponents); read_csv then falls
+  back to pd.read_csv
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bytes scanned per block; blocks end on a line boundary
+BLOCK_BYTES = 1 << 20
+
+# Rows the categorical dictionaries are first built from
+DICTIONARY_SAMPLE = 1024
+
+# Longest numeric field parsed (15 digits keep the mantissa exact in a float64)
+MAX_DIGITS = 15
+
+# BYTE_MASKS[k] keeps the low k bytes of a uint64 word
+BYTE_MASKS = np.array([(1 << 8 * k) - 1 for k in range(9)], dtype=np.uint64)
+
+# SWAR constants for eight ASCII digits in a little-endian word
+ASCII_ZEROS = np.uint64(0x3030303030303030)
+HIGH_NIBBLES = np.uint64(0xF0F0F0F0F0F0F0F0)
+SIX = np.uint64(0x0606060606060606)
+DOTS = np.uint64(0x2E2E2E2E2E2E2E2E)
+LOW_BITS = np.uint64(0x0101010101010101)
+HIGH_BITS = np.uint64(0x8080808080808080)
+
+NEWLINE, CARRIAGE_RETURN, COMMA, QUOTE = b'\n'[0], b'\r'[0], b','[0], b'"'[0]
+DOT, MINUS, ZERO = b'.'[0], b'-'[0], b'0'[0]
+
+
+class UnsupportedCSV(ValueError):
+    """The file is outside what the fast reader handles; read it with pandas."""
+
+
+def read(source, schema):
+    """Read a CSV (a path, bytes or a BytesIO) with the columns of schema into a DataFrame.
+
+    schema maps the raw columns, in file order, to the dtype each is read as.
+
+    Integer columns come back with their schema dtype, float columns as
+    float64 (int64 if no field has a decimal point, as pandas infers) and
+    'category' columns as categoricals with sorted levels.
+    """
+    buf = _buffer(source)
+    newlines = np.flatnonzero(buf[:min(len(buf), 1 << 16)] == NEWLINE)
+    if not len(newlines):
+        raise UnsupportedCSV("no header line")
+    header = bytes(buf[:newlines[0]]).decode('utf-8').rstrip('\r').split(',')
+    if [name.strip('"') for name in header] != list(schema):
+        raise UnsupportedCSV("unexpected columns")
+
+    columns = {name: [] for name in schema}
+    start = int(newlines[0]) + 1
+    while start < len(buf):
+        end = min(start + BLOCK_BYTES, len(buf))
+        if end < len(buf):
+            # Cut the block after its last complete line
+            last = np.flatnonzero(buf[start:end] == NEWLINE)
+            if not len(last):
+                raise UnsupportedCSV("line longer than a block")
+            end = start + int(last[-1]) + 1
+        for name, values in zip(schema, _read_block(buf[start:end], schema)):
+            columns[name].append(values)
+        start = end
+    return pd.DataFrame({name: _combine(parts, schema[name]) for name, parts in columns.items()})
+
+
+def read_csv(source, schema):
+    """read(source, schema), or pd.read_csv with the same categorical columns if the file is unsupported."""
+    try:
+        return read(source, schema)
+    except UnsupportedCSV:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_csv(source, dtype={name: dtype for name, dtype in schema.items() if dtype == 'category'})
+
+
+def _buffer(source):
+    if isinstance(source, (str, os.PathLike)):
+        if not os.path.getsize(source):
+            raise UnsupportedCSV("empty file")
+        return np.memmap(source, dtype=np.uint8, mode='r')
+    if hasattr(source, 'getbuffer'):
+        return np.frombuffer(source.getbuffer(), dtype=np.uint8)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return np.frombuffer(source, dtype=np.uint8)
+    raise UnsupportedCSV(f"cannot map {type(source).__name__}")
+
+
+def _read_block(data, schema):
+    """Parse a run of complete lines into one array (or (levels, codes)) per column."""
+    # Copy the block with 8 bytes of zero padding, so every field start can be
+    # read as an (unaligned, little-endian) uint64 word
+    block = np.zeros(len(data) + 8, dtype=np.uint8)
+    block[:len(data)] = data
+    words = np.ndarray((len(data) + 1,), dtype='<u8', buffer=block, strides=(1,))
+    block = block[:len(data)]
+
+    # One scan for the field delimiters; every line must have exactly
+    # n_columns fields, the last ending at a newline and the others at commas
+    n_columns = len(schema)
+    delimiters = np.flatnonzero((block == COMMA) | (block == NEWLINE))
+    if block[-1] != NEWLINE:
+        # Last line of the file without a newline
+        delimiters = np.append(delimiters, len(block))
+    if len(delimiters) % n_columns:
+        raise UnsupportedCSV("fields per line differ")
+    ends = delimiters.reshape(-1, n_columns)
+    is_newline = block[np.minimum(ends, len(block) - 1)] == NEWLINE
+    is_newline[-1, -1] = True
+    if not is_newline[:, -1].all() or is_newline[:, :-1].any():
+        raise UnsupportedCSV("fields per line differ")
+    starts = np.concatenate([[0], delimiters[:-1] + 1]).reshape(ends.shape)
+    carriage_returns = np.count_nonzero(block == CARRIAGE_RETURN)
+    if carriage_returns:
+        # CRLF line ends: the carriage return is not part of the last field
+        crlf = block[ends[:, -1] - 1] == CARRIAGE_RETURN
+        if np.count_nonzero(crlf) != carriage_returns:
+            raise UnsupportedCSV("carriage return inside a line")
+        ends[:, -1] -= crlf
+
+    # Strip the quotes around quoted fields; any other quote is unsupported
+    quoted = block[starts] == QUOTE
+    if quoted.any():
+        closed = (ends - starts >= 2) & (block[np.maximum(ends - 1, 0)] == QUOTE)
+        if (quoted & ~closed).any():
+            raise UnsupportedCSV("unbalanced quotes")
+        starts = starts + quoted
+        ends = ends - quoted
+    if np.count_nonzero(block == QUOTE) != 2 * np.count_nonzero(quoted):
+        raise UnsupportedCSV("quote inside a field")
+
+    parsed = []
+    for j, dtype in enumerate(schema.values()):
+        fields, widths = _gather(words, starts[:, j], ends[:, j])
+        if dtype == 'category':
+            parsed.append(_codes(fields))
+        else:
+            parsed.append(_number(fields, widths, np.dtype(dtype)))
+    return parsed
+
+
+def _gather(words, starts, ends):
+    """Each field's bytes as zero-padded uint64 words (rows x words), plus the widths."""
+    widths = ends - starts
+    if not len(widths) or widths.min() == 0:
+        raise UnsupportedCSV("missing field")
+    # The word at each field's i-th 8 bytes, without the bytes past its end
+    columns = [words[np.minimum(starts + 8 * i, len(words) - 1)] & BYTE_MASKS[np.clip(widths - 8 * i, 0, 8)]
+               for i in range(-(-int(widths.max()) // 8))]
+    return np.stack(columns, axis=1), widths
+
+
+def _number(fields, widths, dtype):
+    """Parse decimal fields ([-]digits[.digits]) into dtype; floats are correctly rounded."""
+    parsed = _short_number(fields[:, 0], widths) if fields.shape[1] == 1 else None
+    mantissa, decimals, has_dot, negative = parsed if parsed is not None else _long_number(fields, widths)
+    has_dot = has_dot.any()
+    mantissa = np.where(negative, -mantissa, mantissa)
+    if dtype.kind == 'f':
+        if not has_dot:
+            # pandas infers int64 for a column without a decimal point
+            return mantissa
+        # Exact mantissa over an exact power of ten: one correctly rounded division
+        values = mantissa / 10.0 ** decimals
+        return np.where(negative & (mantissa == 0), -0.0, values)
+    if has_dot:
+        raise UnsupportedCSV("decimal point in an integer column")
+    info = np.iinfo(dtype)
+    if mantissa.min() < info.min or mantissa.max() > info.max:
+        raise UnsupportedCSV(f"value out of {dtype} range")
+    return mantissa.astype(dtype)
+
+
+def _short_number(words, widths):
+    """(mantissa, decimals, has_dot, negative) of fields of up to eight bytes, parsed within their words.
+
+    Returns None if any field is not a decimal number this short, so the
+    caller can parse the column byte by byte instead.
+    """
+    # Drop a leading minus sign
+    negative = (words & np.uint64(0xFF)) == MINUS
+    if negative.any():
+        words = np.where(negative, words >> np.uint64(8), words)
+        widths = widths - negative
+    # Drop the first decimal point: the bytes after it move down by one
+    dots = words ^ DOTS
+    first_dot = (dots - LOW_BITS) & ~dots & HIGH_BITS
+    has_dot = first_dot != 0
+    decimals = np.zeros(len(words), dtype=np.int64)
+    if has_dot.any():
+        lowest_bit = np.frexp((first_dot & (~first_dot + np.uint64(1))).astype(np.float64))[1] - 1
+        dot = np.where(has_dot, lowest_bit >> 3, widths)
+        before = BYTE_MASKS[dot]
+        words = (words & before) | ((words >> np.uint64(8)) & ~before)
+        decimals = np.where(has_dot, widths - dot - 1, 0)
+        widths = widths - has_dot
+    if widths.min() == 0:
+        return None
+    mantissa = _eight_digits(words, widths)
+    return None if mantissa is None else (mantissa, decimals, has_dot, negative)
+
+
+def _long_number(fields, widths):
+    """(mantissa, decimals, has_dot, negative) of decimal fields, parsed byte by byte."""
+    chars = fields.view(np.uint8)
+    width = int(widths.max())
+    valid = np.arange(width) < widths[:, None]
+    chars = chars[:, :width]
+    negative = chars[:, 0] == MINUS
+    is_dot = valid & (chars == DOT)
+    is_digit = valid & (chars >= ZERO) & (chars <= ZERO + 9)
+    n_digits = is_digit.sum(axis=1)
+    well_formed = is_digit | is_dot | ~valid
+    well_formed[:, 0] |= negative
+    if not well_formed.all() or (n_digits == 0).any() or n_digits.max() > MAX_DIGITS \
+            or (is_dot.sum(axis=1) > 1).any():
+        raise UnsupportedCSV("not a decimal number")
+
+    # Horner's rule over the digits; a digit after the point adds a decimal
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    decimals = np.zeros(len(chars), dtype=np.int64)
+    after_dot = np.zeros(len(chars), dtype=bool)
+    for j in range(width):
+        digit = is_digit[:, j]
+        mantissa = np.where(digit, mantissa * 10 + (chars[:, j].astype(np.int64) - ZERO), mantissa)
+        decimals += digit & after_dot
+        after_dot |= is_dot[:, j]
+    return mantissa, decimals, after_dot, negative
+
+
+def _eight_digits(words, widths):
+    """Integers of one to eight ASCII digits, parsed within their words; None if any field is not one."""
+    # Shift the digits to the top of the word and fill the bytes below with '0'
+    shift = (np.uint64(8) - widths.astype(np.uint64)) * np.uint64(8)
+    words = (words << shift) | (ASCII_ZEROS & BYTE_MASKS[8 - widths])
+    if not (((words & HIGH_NIBBLES) == ASCII_ZEROS) & (((words + SIX) & HIGH_NIBBLES) == ASCII_ZEROS)).all():
+        return None
+    # Combine neighbouring digits, then pairs, then quads
+    words = words - ASCII_ZEROS
+    words = (words * np.uint64(10) + (words >> np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    words = (words * np.uint64(100) + (words >> np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    words = words * np.uint64(10000) + (words >> np.uint64(32))
+    return (words & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+
+def _codes(fields):
+    """(levels, codes) of categorical fields, looked up in a dictionary of their distinct words."""
+    keys = fields[:, 0].copy()
+    for i in range(1, fields.shape[1]):
+        keys = keys * np.uint64(0x100000001B3) ^ fields[:, i]
+    # Build the dictionary from the first rows, and from all of them only if that misses a key
+    known, first = np.unique(keys[:DICTIONARY_SAMPLE], return_index=True)
+    inverse = np.minimum(np.searchsorted(known, keys), len(known) - 1)
+    if not (known[inverse] == keys).all():
+        known, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if fields.shape[1] > 1 and not (fields == fields[first[inverse]]).all():
+        # Two fields share a key: look them up by all their words instead
+        _, first, inverse = np.unique(fields, axis=0, return_index=True, return_inverse=True)
+    levels = [fields[i].tobytes().rstrip(b'\0').decode('utf-8') for i in first]
+    return levels, inverse.ravel()
+
+
+def _combine(parts, dtype):
+    """Concatenate one column's block results; categoricals get the sorted union of levels."""
+    if dtype != 'category':
+        if any(part.dtype.kind == 'f' for part in parts):
+            parts = [part.astype(np.float64) for part in parts]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    levels = sorted(set().union(*(block_levels for block_levels, _ in parts)))
+    index = {level: code for code, level in enumerate(levels)}
+    codes = [np.array([index[level] for level in block_levels], dtype=np.int32)[block_codes]
+             for block_levels, block_codes in parts]
+    codes = np.concatenate(codes) if codes else np.empty(0, dtype=np.int32)
+    return pd.Categorical.from_codes(codes, categories=levels)
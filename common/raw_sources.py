@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Multi-file raw sources
+- Resolves a raw data source (a CSV file, a directory of CSV files or a glob
+  pattern) to the files it names, in sorted order
+- Checks that every file has the same columns, first by header and then by
+  the kind of values each column was parsed into
+- Reads the files concurrently in a bounded thread pool and combines them into
+  one frame, with the file each row came from as a categorical column
+"""
+
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import partitioned
+
+# Provenance column: the file each row was read from, relative to the source
+SOURCE_COLUMN = 'source_file'
+
+# Files read at once; parsing releases the GIL in NumPy, so threads overlap
+# the reads and most of the parse without pickling frames between processes
+READ_THREADS = min(32, (os.cpu_count() or 1) + 4)
+
+BOM = b'\xef\xbb\xbf'
+
+
+class SchemaMismatch(ValueError):
+    """The files of a source do not all have the same columns."""
+
+
+class SourceFile:
+    """One file of a multi-file source, read with its provenance column.
+
+    dtype is the categorical dtype of the names of all files of the source,
+    shared so that every file's provenance column concatenates as one.
+    """
+
+    def __init__(self, path, code, dtype):
+        self.path = path
+        self.code = code
+        self.dtype = dtype
+
+    @property
+    def name(self):
+        return self.dtype.categories[self.code]
+
+    def read(self, reader=pd.read_csv):
+        return self.tag(reader(self.path))
+
+    def chunks(self, chunksize, **read_csv_kwargs):
+        """Yield the file in chunks of chunksize rows."""
+        with pd.read_csv(self.path, chunksize=chunksize, **read_csv_kwargs) as reader:
+            for chunk in reader:
+                yield self.tag(chunk)
+
+    def tag(self, df):
+        """df with the provenance column added."""
+        codes = np.full(len(df), self.code, dtype=np.min_scalar_type(len(self.dtype.categories)))
+        return df.assign(**{SOURCE_COLUMN: pd.Categorical.from_codes(codes, dtype=self.dtype)})
+
+
+def resolve(source):
+    """The CSV files a source names: itself, the *.csv files in it, or the glob's matches."""
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '*.csv'))
+    elif glob.has_magic(source):
+        paths = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+    elif os.path.exists(source):
+        paths = [source]
+    else:
+        raise FileNotFoundError(f"Raw data source not found at {source}")
+    if not paths:
+        raise FileNotFoundError(f"No CSV files found for {source}")
+    return sorted(paths)
+
+
+def source_files(source):
+    """SourceFiles of every file of source, after checking that their headers agree."""
+    paths = resolve(source)
+    check_headers(paths)
+    if len(paths) == 1:
+        names = [os.path.basename(paths[0])]
+    else:
+        common = os.path.commonpath([os.path.abspath(os.path.dirname(path)) for path in paths])
+        names = [os.path.relpath(os.path.abspath(path), common) for path in paths]
+    dtype = pd.CategoricalDtype(names)
+    return [SourceFile(path, code, dtype) for code, path in enumerate(paths)]
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        return f.readline().removeprefix(BOM).strip()
+
+
+def check_headers(paths):
+    """Raise SchemaMismatch unless every file has the first file's header."""
+    header = read_header(paths[0])
+    different = [path for path in paths[1:] if read_header(path) != header]
+    if different:
+        columns = header.decode(errors='replace')
+        raise SchemaMismatch(f"{len(different)} of {len(paths)} files do not have the columns of "
+                             f"{paths[0]} ({columns}): {', '.join(different[:5])}"
+                             + (", ..." if len(different) > 5 else ""))
+
+
+def check_dtypes(frames, files):
+    """Raise SchemaMismatch if a column is numeric in some files and text in others.
+
+    Numeric columns may still differ in width (int64 and float64 with
+    missing values), which concat_partitions upcasts like a single parse.
+    """
+    for col in frames[0].columns:
+        numeric = [pd.api.types.is_numeric_dtype(frame[col].dtype) for frame in frames]
+        if any(numeric) and not all(numeric):
+            text = [file.name for file, is_numeric in zip(files, numeric) if not is_numeric]
+            raise SchemaMismatch(f"Column '{col}' is numeric in some files but not in "
+                                 f"{', '.join(text[:5])}" + (", ..." if len(text) > 5 else ""))
+
+
+def read_sources(files, reader=pd.read_csv, threads=None):
+    """Read every SourceFile with reader in a pool of threads and concatenate them in order."""
+    threads = min(threads or READ_THREADS, len(files))
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            frames = list(pool.map(lambda file: file.read(reader), files))
+    else:
+        frames = [file.read(reader) for file in files]
+    check_dtypes(frames, files)
+    return partitioned.concat_partitions(frames)
+
+
+def read_chunks(files, chunksize, **read_csv_kwargs):
+    """Yield the rows of every SourceFile in chunks of at most chunksize rows, file by file."""
+    for file in files:
+        yield from file.chunks(chunksize, **read_csv_kwargs)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Resampling significance engine
+- Bootstrap confidence intervals and permutation p-values for a difference
+  of group means and for a Pearson correlation
+- Works on the distinct values (or value pairs) and their counts, so a
+  bootstrap resample is a multinomial draw of counts and a permutation is a
+  hypergeometric split of them: the cost of a resample grows with the number
+  of distinct values, not the number of rows
+- Draws a whole batch of resamples at once and reduces them with matrix
+  products; batches have their own seeds, so the result does not depend on
+  how many worker processes run them
+- A correlation whose rows are too many to shuffle, and whose values are not
+  two-level on either side, gets its p-value from the t distribution of r
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import partitioned
+
+# Elements (resamples x distinct values) drawn per batch
+BATCH_ELEMENTS = 2**22
+
+# Row draws (resamples x rows) up to which a correlation's rows are shuffled;
+# above it, only a two-valued variable is still permuted exactly
+SHUFFLE_LIMIT = 2**25
+
+# Distinct rows a DistinctRows keeps before giving up (see overflowed)
+DISTINCT_LIMIT = 1_000_000
+
+# null is how the p-value was found: 'permutation', or 't' for the t distribution
+ResamplingResult = namedtuple('ResamplingResult', ['estimate', 'ci_low', 'ci_high', 'pvalue', 'n_resamples', 'null'],
+                              defaults=['permutation'])
+
+
+class DistinctRows:
+    """Distinct rows of a 2D array and how often each occurs, merged chunk by chunk.
+
+    Rows with a missing value are skipped. If more than limit distinct rows
+    turn up, the counts are dropped and overflowed is set.
+    """
+
+    def __init__(self, n_columns, limit=DISTINCT_LIMIT):
+        self.limit = limit
+        self.overflowed = False
+        self.values = np.empty((0, n_columns))
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def update(self, matrix, counts=None):
+        if self.overflowed:
+            return self
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if counts is None:
+            counts = np.ones(len(matrix), dtype=np.int64)
+        keep = ~np.isnan(matrix).any(axis=1)
+        values = np.concatenate([self.values, matrix[keep]])
+        counts = np.concatenate([self.counts, counts[keep]])
+        self.values, inverse = np.unique(values, axis=0, return_inverse=True)
+        self.counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(self.values)).astype(np.int64)
+        if len(self.values) > self.limit:
+            self.overflowed = True
+            self.values = self.values[:0]
+            self.counts = self.counts[:0]
+        return self
+
+    def merge(self, other):
+        if other.overflowed:
+            self.overflowed = True
+            self.values = self.values[:0]
+            self.counts = self.counts[:0]
+            return self
+        return self.update(other.values, other.counts)
+
+    @property
+    def rows(self):
+        return int(self.counts.sum())
+
+
+def distinct(values):
+    """(distinct values, counts) of a 1D array, without NaN."""
+    values = np.asarray(values, dtype=np.float64)
+    values, counts = np.unique(values[~np.isnan(values)], return_counts=True)
+    return values, counts
+
+
+def batches(n_resamples, width, seed):
+    """Split n_resamples into [(size, SeedSequence)] of at most BATCH_ELEMENTS / width resamples."""
+    size = max(1, BATCH_ELEMENTS // max(width, 1))
+    sizes = [min(size, n_resamples - start) for start in range(0, n_resamples, size)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def run_batches(kernel, n_resamples, width, seed, workers, *args):
+    """Concatenate kernel((size, seed_sequence), *args) over the batches, computed in parallel."""
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    results = partitioned.map_partitions(kernel, batches(n_resamples, width, seed), workers, *args)
+    return np.concatenate(results)
+
+
+def bootstrap_counts(rng, counts, size):
+    """size bootstrap resamples of rows given by distinct-value counts, as counts (size x distinct)."""
+    n = int(counts.sum())
+    if len(counts) * 4 < n:
+        return rng.multinomial(n, counts / n, size=size)
+    # Nearly all rows distinct: drawing row indices is cheaper than the multinomial
+    owner = np.repeat(np.arange(len(counts)), counts)
+    drawn = owner[rng.integers(0, n, size=(size, n))]
+    drawn += np.arange(size)[:, None] * len(counts)
+    return np.bincount(drawn.ravel(), minlength=size * len(counts)).reshape(size, len(counts))
+
+
+def pvalue(observed, resampled):
+    """Two-sided permutation p-value, counting the observed arrangement as one resample."""
+    if np.isnan(observed):
+        return np.nan
+    resampled = resampled[~np.isnan(resampled)]
+    tolerance = 1e-12 * max(abs(observed), 1.0)
+    return (1 + np.count_nonzero(np.abs(resampled) >= abs(observed) - tolerance)) / (1 + len(resampled))
+
+
+def interval(estimates, confidence):
+    """Percentile bootstrap interval."""
+    estimates = estimates[~np.isnan(estimates)]
+    if not len(estimates):
+        return np.nan, np.nan
+    low, high = np.quantile(estimates, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return low, high
+
+
+def mean_difference(a, b, n_resamples=10_000, confidence=0.95, seed=0, workers=1):
+    """mean(a) - mean(b) with a bootstrap interval and a permutation p-value.
+
+    The bootstrap resamples each group with replacement; the permutation
+    test reassigns the pooled values to groups of the original sizes.
+    """
+    a_values, a_counts = distinct(a)
+    b_values, b_counts = distinct(b)
+    n_a, n_b = int(a_counts.sum()), int(b_counts.sum())
+    if not n_a or not n_b:
+        return ResamplingResult(np.nan, np.nan, np.nan, np.nan, 0)
+    observed = a_counts @ a_values / n_a - b_counts @ b_values / n_b
+    boot = run_batches(_bootstrap_mean_difference, n_resamples, len(a_values) + len(b_values), seed,
+                       workers, a_values, a_counts, b_values, b_counts)
+    pooled_values, inverse = np.unique(np.concatenate([a_values, b_values]), return_inverse=True)
+    pooled_counts = np.bincount(inverse, weights=np.concatenate([a_counts, b_counts])).astype(np.int64)
+    perm = run_batches(_permuted_mean_difference, n_resamples, len(pooled_values), seed + 1,
+                       workers, pooled_values, pooled_counts, n_a)
+    return ResamplingResult(observed, *interval(boot, confidence), pvalue(observed, perm), n_resamples)
+
+
+def _bootstrap_mean_difference(batch, a_values, a_counts, b_values, b_counts):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    a_means = bootstrap_counts(rng, a_counts, size) @ a_values / a_counts.sum()
+    b_means = bootstrap_counts(rng, b_counts, size) @ b_values / b_counts.sum()
+    return a_means - b_means
+
+
+def _permuted_mean_difference(batch, values, counts, n_a):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    n_b = counts.sum() - n_a
+    a_sums = rng.multivariate_hypergeometric(counts, n_a, size=size) @ values
+    return a_sums / n_a - (counts @ values - a_sums) / n_b
+
+
+def correlation(x, y, n_resamples=10_000, confidence=0.95, seed=0, workers=1, pairs=None):
+    """Pearson r of x and y with a bootstrap interval and a permutation p-value.
+
+    The bootstrap resamples (x, y) pairs with replacement; the permutation
+    test shuffles y against x. If either variable has two values, a shuffle
+    is one hypergeometric split of the other's counts. Otherwise the rows
+    are shuffled if there are at most SHUFFLE_LIMIT / n_resamples of them;
+    beyond that the p-value is the t test's for r (null 't'), which the
+    permutation distribution approaches for that many rows. Instead of x and
+    y, pairs can be a DistinctRows of the (x, y) pairs.
+    """
+    if pairs is None:
+        pairs = DistinctRows(2, limit=np.inf).update(np.column_stack([x, y]))
+    values, counts = pairs.values, pairs.counts
+    n = int(counts.sum())
+    if n < 2:
+        return ResamplingResult(np.nan, np.nan, np.nan, np.nan, 0)
+    # Centered values keep the sums of products accurate
+    values = values - counts @ values / n
+    observed = _correlations(counts[None, :], values)[0]
+    boot = run_batches(_bootstrap_correlation, n_resamples, len(counts), seed, workers, values, counts)
+    x_values, x_inverse = np.unique(values[:, 0], return_inverse=True)
+    x_counts = np.bincount(x_inverse, weights=counts).astype(np.int64)
+    y_values, y_inverse = np.unique(values[:, 1], return_inverse=True)
+    y_counts = np.bincount(y_inverse, weights=counts).astype(np.int64)
+    if len(y_values) > len(x_values):
+        x_values, x_counts, y_values, y_counts = y_values, y_counts, x_values, x_counts
+    scale = np.sqrt((x_counts @ x_values ** 2) * (y_counts @ y_values ** 2))
+    if len(y_values) == 2:
+        perm = run_batches(_split_cross_sums, n_resamples, len(x_values), seed + 1,
+                           workers, x_values, x_counts, y_values, y_counts) / scale
+    elif n * n_resamples <= SHUFFLE_LIMIT:
+        perm = run_batches(_shuffled_cross_sums, n_resamples, n, seed + 1, workers,
+                           np.repeat(values[:, 0], counts), np.repeat(values[:, 1], counts)) / scale
+    else:
+        return ResamplingResult(observed, *interval(boot, confidence), t_pvalue(observed, n), n_resamples, 't')
+    return ResamplingResult(observed, *interval(boot, confidence), pvalue(observed, perm), n_resamples)
+
+
+def _correlations(weights, values):
+    """Pearson r of the (x, y) values for every row of weights (resampled counts)."""
+    x, y = values[:, 0], values[:, 1]
+    n = weights.sum(axis=1)
+    sums = weights @ np.column_stack([x, y, x * x, y * y, x * y])
+    s_x, s_y, s_xx, s_yy, s_xy = sums.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (s_xy - s_x * s_y / n) / np.sqrt((s_xx - s_x ** 2 / n) * (s_yy - s_y ** 2 / n))
+
+
+def _bootstrap_correlation(batch, values, counts):
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    return _correlations(bootstrap_counts(rng, counts, size), values)
+
+
+def _shuffled_cross_sums(batch, x, y):
+    """sum(x * y) after shuffling y against x, for size shuffles at once."""
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    return rng.permuted(np.tile(y, (size, 1)), axis=1) @ x
+
+
+def _split_cross_sums(batch, x_values, x_counts, y_values, y_counts):
+    """sum(x * y) after shuffling a two-valued y against x, for size shuffles at once.
+
+    A shuffle only decides which x values land on the first y value: a
+    multivariate hypergeometric draw of y_counts[0] of the x counts.
+    """
+    size, seed = batch
+    rng = np.random.default_rng(seed)
+    first = rng.multivariate_hypergeometric(x_counts, int(y_counts[0]), size=size) @ x_values
+    return y_values[0] * first + y_values[1] * (x_counts @ x_values - first)
+
+
+def t_pvalue(r, n):
+    """Two-sided p-value of Pearson r from the t distribution with n - 2 degrees of freedom."""
+    from scipy import stats
+    if np.isnan(r) or n < 3:
+        return np.nan
+    if abs(r) >= 1:
+        return 0.0
+    t = r * np.sqrt((n - 2) / (1 - r * r))
+    return float(2 * stats.t.sf(abs(t), n - 2))
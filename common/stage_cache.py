@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Stage cache
+- Keys each workflow stage on the content hash of its input file(s) and the
+  source of the stage module and of every local module it imports (chained
+  through the upstream stage's key)
+- Stores what the stage produced so an unchanged stage can be skipped
+- Records which stages were cache hits and which were misses
+"""
+
+import os
+import ast
+import json
+import pickle
+import hashlib
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def module_files(module_path):
+    """module_path and the file of every local module it imports, directly or through another.
+
+    Local modules are the .py files next to module_path and the shared
+    helpers next to this module; imports inside functions count as well, so
+    lazily imported helpers are included.
+    """
+    directories = [os.path.dirname(os.path.abspath(module_path)), os.path.dirname(os.path.abspath(__file__))]
+    found = [os.path.abspath(module_path)]
+    for path in found:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                for directory in directories:
+                    local = os.path.join(directory, name.split('.')[0] + '.py')
+                    if os.path.exists(local):
+                        if local not in found:
+                            found.append(local)
+                        break
+    return found[:1] + sorted(found[1:])
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class StageCache:
+    """One cache slot per stage, stored as <stage>.json (+ output) in cache_dir."""
+
+    def __init__(self, cache_dir, enabled=True):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.status = {}
+
+    def stage_key(self, stage, module_path, inputs=(), upstream_key=None, params=None):
+        """Build the cache key for a stage.
+
+        The stage module and the local modules it imports are hashed by
+        content; inputs are hashed by content; upstream_key chains in the key of
+        the stage that feeds this one; params holds any options that change the
+        output.
+        """
+        digest = hashlib.sha256(stage.encode())
+        for path in module_files(module_path):
+            digest.update(file_digest(path).encode())
+        for path in inputs:
+            digest.update(file_digest(path).encode())
+        if upstream_key is not None:
+            digest.update(upstream_key.encode())
+        if params:
+            digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _meta_path(self, stage):
+        return os.path.join(self.cache_dir, f'{stage}.json')
+
+    def _read_meta(self, stage):
+        meta_path = self._meta_path(stage)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def is_hit(self, stage, key):
+        """True if the stored entry has this key and its outputs are untouched."""
+        if not self.enabled:
+            return False
+        meta = self._read_meta(stage)
+        if meta is None or meta['key'] != key:
+            return False
+        for path, stamp in meta['artifacts'].items():
+            if not os.path.exists(path) or _file_stamp(path) != stamp:
+                return False
+        return True
+
+    def save(self, stage, key, frame=None, frame_path=None, result=None, artifacts=()):
+        """Store a stage's output under key.
+
+        frame is written to the cache as Parquet, or frame_path points at a
+        Parquet file the stage already wrote. result is pickled. artifacts are
+        files that must still exist unchanged for a later hit.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        artifacts = list(artifacts)
+        if frame is not None:
+            frame_path = os.path.join(self.cache_dir, f'{stage}.parquet')
+            frame.to_parquet(frame_path, index=False)
+        if frame_path is not None:
+            artifacts.append(frame_path)
+        result_path = None
+        if result is not None:
+            result_path = os.path.join(self.cache_dir, f'{stage}.pkl')
+            with open(result_path, 'wb') as f:
+                pickle.dump(result, f)
+            artifacts.append(result_path)
+        meta = {
+            'key': key,
+            'frame_path': frame_path,
+            'result_path': result_path,
+            'artifacts': {path: _file_stamp(path) for path in artifacts},
+        }
+        with open(self._meta_path(stage), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def load_frame(self, stage):
+        """Return the stored frame, or None if the stage kept no frame."""
+        meta = self._read_meta(stage)
+        if meta['frame_path'] is None:
+            return None
+        # pandas is imported here so the cache itself adds nothing to startup
+        import pandas as pd
+        return pd.read_parquet(meta['frame_path'], memory_map=True)
+
+    def load_result(self, stage):
+        meta = self._read_meta(stage)
+        with open(meta['result_path'], 'rb') as f:
+            return pickle.load(f)
+
+    def record(self, stage, status):
+        """Remember whether a stage was a 'hit', 'miss' or 'skipped'."""
+        self.status[stage] = status
+
+    def report(self):
+        if not self.enabled:
+            return "Stage cache: disabled"
+        return "Stage cache: " + ", ".join(f"{stage}={status}" for stage, status in self.status.items())
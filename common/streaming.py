@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Streaming statistics
+- Running numeric moments that merge chunk by chunk (count, mean, variance,
+  min, max) without keeping the rows
+- Running co-moments for a Pearson correlation, merged the same way
+- A mergeable quantile sketch (DDSketch-style, relative accuracy) for medians
+- A column profile (missing counts, dtypes, moments, category frequencies)
+  updated one CSV chunk at a time, so memory is bounded by the chunk size
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class RunningMoments:
+    """Count, mean, variance, min and max of a stream of values.
+
+    Each chunk is reduced with NumPy and merged with the pairwise update of
+    Chan et al., which is numerically stable (Welford-style) across chunks.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        chunk = RunningMoments()
+        chunk.count = values.size
+        chunk.mean = float(values.mean())
+        chunk.m2 = float(((values - chunk.mean) ** 2).sum())
+        chunk.min = float(values.min())
+        chunk.max = float(values.max())
+        return self.merge(chunk)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance (ddof=1), matching pandas."""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class RunningCorrelation:
+    """Pearson correlation of two streams, from merged co-moments.
+
+    Only rows where both values are present are used, like Series.corr.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    def update(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keep = ~(np.isnan(x) | np.isnan(y))
+        x, y = x[keep], y[keep]
+        if x.size == 0:
+            return self
+        chunk = RunningCorrelation()
+        chunk.count = x.size
+        chunk.mean_x = float(x.mean())
+        chunk.mean_y = float(y.mean())
+        dx = x - chunk.mean_x
+        dy = y - chunk.mean_y
+        chunk.m2_x = float(dx @ dx)
+        chunk.m2_y = float(dy @ dy)
+        chunk.c_xy = float(dx @ dy)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        weight = self.count * other.count / count
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        self.m2_x += other.m2_x + dx * dx * weight
+        self.m2_y += other.m2_y + dy * dy * weight
+        self.c_xy += other.c_xy + dx * dy * weight
+        self.mean_x += dx * other.count / count
+        self.mean_y += dy * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def correlation(self):
+        denom = np.sqrt(self.m2_x * self.m2_y)
+        return self.c_xy / denom if self.count > 1 and denom > 0 else np.nan
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with a relative accuracy guarantee.
+
+    Values are counted in logarithmic buckets (as in DDSketch), so any quantile
+    is returned within relative_accuracy of the true value and memory grows
+    with the log of the value range, not with the number of rows. Until
+    exact_limit values have been seen they are kept as-is and quantiles are
+    exact, so small inputs give the same answer as pandas.
+    """
+
+    def __init__(self, relative_accuracy=0.001, exact_limit=100_000):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.exact_limit = exact_limit
+        self.count = 0
+        self.exact = []
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.count += values.size
+        if self.exact is not None:
+            self.exact.append(values)
+            if self.count <= self.exact_limit:
+                return self
+            values = np.concatenate(self.exact)
+            self.exact = None
+        self._add_to_buckets(values)
+        return self
+
+    def _add_to_buckets(self, values):
+        self.zeros += int(np.count_nonzero(values == 0))
+        for store, part in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if part.size == 0:
+                continue
+            keys, counts = np.unique(np.ceil(np.log(part) / self.log_gamma).astype(np.int64),
+                                     return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                store[key] = store.get(key, 0) + count
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.exact is not None and other.exact is not None and \
+                self.count + other.count <= self.exact_limit:
+            self.exact.extend(other.exact)
+            self.count += other.count
+            return self
+        if self.exact is not None:
+            self._add_to_buckets(np.concatenate(self.exact) if self.exact else np.empty(0))
+            self.exact = None
+        if other.exact is not None:
+            self._add_to_buckets(np.concatenate(other.exact) if other.exact else np.empty(0))
+        else:
+            for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+                for key, count in other_store.items():
+                    store[key] = store.get(key, 0) + count
+            self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        if self.exact is not None:
+            return float(np.quantile(np.concatenate(self.exact), q))
+        # Walk the buckets in value order until the target rank is reached
+        rank = q * (self.count - 1)
+        buckets = [(-self._bucket_value(key), count) for key, count in sorted(self.negative.items(), reverse=True)]
+        buckets.append((0.0, self.zeros))
+        buckets += [(self._bucket_value(key), count) for key, count in sorted(self.positive.items())]
+        seen = 0
+        for value, count in buckets:
+            seen += count
+            if seen > rank:
+                return value
+        return buckets[-1][0]
+
+    def _bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+
+class StreamingProfile:
+    """Integrity checks for a CSV read in chunks."""
+
+    def __init__(self):
+        self.rows = 0
+        self.preview = None
+        self.missing = None
+        self.dtypes = {}
+        self.moments = {}
+        self.frequencies = {}
+
+    def update(self, chunk):
+        if self.preview is None:
+            self.preview = chunk.head()
+            self.missing = pd.Series(0, index=chunk.columns, dtype='int64')
+        self.rows += len(chunk)
+        self.missing += chunk.isna().sum()
+
+        for col in chunk.columns:
+            dtype = chunk[col].dtype
+            numeric = pd.api.types.is_numeric_dtype(dtype)
+            if col not in self.dtypes or (self._only_missing(col) and chunk[col].notna().any()):
+                # A column with nothing but missing values so far is read as
+                # float64 (or object), so it is typed by its first values instead
+                if col in self.dtypes and numeric:
+                    dtype = np.result_type(dtype, np.float64)
+                self.dtypes[col] = dtype
+                self.moments.pop(col, None)
+                self.frequencies.pop(col, None)
+                if numeric:
+                    self.moments[col] = RunningMoments()
+                else:
+                    self.frequencies[col] = pd.Series(dtype='int64')
+            elif col in self.moments:
+                if not numeric:
+                    raise ValueError(f"Column '{col}' has non-numeric values after row {self.rows - len(chunk)}")
+                # e.g. int64 chunks followed by a chunk with NaNs (float64)
+                self.dtypes[col] = np.result_type(self.dtypes[col], dtype)
+
+            if col in self.moments:
+                self.moments[col].update(chunk[col].to_numpy(dtype=np.float64, na_value=np.nan))
+            else:
+                counts = chunk[col].value_counts()
+                self.frequencies[col] = self.frequencies[col].add(counts, fill_value=0).astype('int64')
+        return self
+
+    def _only_missing(self, col):
+        if col in self.moments:
+            return self.moments[col].count == 0
+        return self.frequencies[col].sum() == 0
+
+    def dtypes_series(self):
+        return pd.Series(self.dtypes, dtype=object)
+
+    def numeric_summary(self):
+        """count/mean/std/min/max per numeric column, laid out like describe()."""
+        summary = {}
+        for col in self.dtypes:
+            m = self.moments.get(col)
+            if m is None:
+                continue
+            if m.count == 0:
+                # describe() of a column with only missing values
+                summary[col] = {'count': 0, 'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan}
+            else:
+                summary[col] = {'count': m.count, 'mean': m.mean, 'std': m.std, 'min': m.min, 'max': m.max}
+        return pd.DataFrame(summary)
+
+    def value_counts(self, col):
+        counts = self.frequencies[col].sort_values(ascending=False, kind='stable')
+        counts.index.name = col
+        counts.name = 'count'
+        return counts
+
+
+def profile_csv(path, chunksize, **read_csv_kwargs):
+    """Profile a CSV file chunk by chunk and return the StreamingProfile."""
+    profile = StreamingProfile()
+    with pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs) as reader:
+        for chunk in reader:
+            profile.update(chunk)
+    return profile
@@ -7,22 +7,81 @@ Stage 1: Data Ingestion
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 
+# Helper modules shared by both workflows
+common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if common_dir not in sys.path:
+    sys.path.insert(0, common_dir)
+
+import profiling
+import incremental
+import raw_csv
+import raw_sources
+from streaming import StreamingProfile, profile_csv
+
 # Define paths
 raw_data_path = os.path.join('data', 'raw', 'frailty.csv')
 
+# Raw columns in file order, with the dtype each is read as
+RAW_DTYPES = {
+    'Height': np.float64,
+    'Weight': np.int64,
+    'Age': np.int64,
+    'Grip strength': np.int64,
+    'Frailty': 'category',
+}
+
+def read_raw(source):
+    """Read a raw CSV of this dataset with raw_csv, or pandas if it is outside the fast path."""
+    return raw_csv.read_csv(source, RAW_DTYPES)
+
 # Read the raw data
-def ingest_data():
+def ingest_data(chunksize=None, append_path=None, source=None):
+    """Load and check the raw data.
+
+    source reads a directory or glob of raw CSV files with the same columns
+    (e.g. one per site) instead of the raw CSV: they are read concurrently
+    and combined into one frame with a source_file column naming the file
+    each row came from.
+
+    With chunksize, the file is streamed in chunks of that many rows and the
+    checks are accumulated chunk by chunk; no full frame is kept, so None is
+    returned and the processing stage reads the raw file itself.
+
+    With append_path, only that file of new records is loaded and checked
+    (it must have the raw CSV's columns); the new rows are returned for
+    process_data(append=True, append_path=...), which adds them to the raw
+    CSV once they are processed and stored.
+    """
     print("Stage 1: Ingesting Data")
     
     # Check if the data file exists
-    if not os.path.exists(raw_data_path):
+    if source is not None:
+        if append_path is not None:
+            raise ValueError("append_path cannot be combined with source")
+        files = raw_sources.source_files(source)
+        print(f"Reading {len(files)} raw files from {source}")
+    elif not os.path.exists(raw_data_path):
         raise FileNotFoundError(f"Raw data file not found at {raw_data_path}")
+    if append_path is not None and not os.path.exists(append_path):
+        raise FileNotFoundError(f"New records file not found at {append_path}")
+    if append_path is not None:
+        incremental.check_header(raw_data_path, append_path)
+    
+    if chunksize and append_path is None:
+        ingest_streaming(chunksize, None if source is None else files)
+        return None
     
     # Load the data
-    df = pd.read_csv(raw_data_path)
+    with profiling.step('csv_parse') as record:
+        if source is not None:
+            df = raw_sources.read_sources(files, read_raw)
+        else:
+            df = read_raw(raw_data_path if append_path is None else append_path)
+        record['rows_out'] = len(df)
     
     # Display basic information
     print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
@@ -43,6 +102,41 @@ def ingest_data():
     
     return df
 
+def ingest_streaming(chunksize, files=None):
+    """Same checks as ingest_data, with memory bounded by the chunk size.
+
+    files (SourceFiles of a multi-file source) are streamed one after another.
+    """
+    with profiling.step('streaming_profile') as record:
+        if files is None:
+            print(f"Streaming {raw_data_path} in chunks of {chunksize} rows")
+            profile = profile_csv(raw_data_path, chunksize)
+        else:
+            print(f"Streaming {len(files)} raw files in chunks of {chunksize} rows")
+            profile = StreamingProfile()
+            for chunk in raw_sources.read_chunks(files, chunksize):
+                profile.update(chunk)
+        record['rows_out'] = profile.rows
+    
+    # Display basic information
+    print(f"Loaded {profile.rows} records with {len(profile.dtypes)} variables")
+    print("Data preview:")
+    print(profile.preview)
+    
+    # Check for missing values
+    missing = profile.missing
+    if missing.sum() > 0:
+        print("Missing values found:")
+        print(missing[missing > 0])
+    else:
+        print("No missing values found")
+    
+    # Data types
+    print("Data types:")
+    print(profile.dtypes_series())
+    
+    return profile
+
 if __name__ == "__main__":
     df = ingest_data()
     print("Data ingestion complete")
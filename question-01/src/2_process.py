@@ -7,66 +7,132 @@ Stage 2: Data Processing
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
 
+# Helper modules shared by both workflows
+common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if common_dir not in sys.path:
+    sys.path.insert(0, common_dir)
+
+import profiling
+import partitioned
+import incremental
+import raw_csv
+import raw_sources
+
 # Define paths
 raw_data_path = os.path.join('data', 'raw', 'frailty.csv')
-processed_data_path = os.path.join('data', 'processed', 'frailty_processed.csv')
+processed_data_path = os.path.join('data', 'processed', 'frailty_processed.parquet')
+processed_csv_path = os.path.join('data', 'processed', 'frailty_processed.csv')
+# Processed rows of incremental appends, one Parquet part per append
+appends_path = os.path.join('data', 'processed', 'frailty_appends')
 
-def process_data():
-    print("Stage 2: Processing Data")
-    
-    # Load raw data
-    df = pd.read_csv(raw_data_path)
-    print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
+# Raw columns in file order, with the dtype each is read as
+RAW_DTYPES = {
+    'Height': np.float64,
+    'Weight': np.int64,
+    'Age': np.int64,
+    'Grip strength': np.int64,
+    'Frailty': 'category',
+}
 
-    # Rename grip strength to Grip_kg
-    df.rename(columns={'Grip strength': 'Grip_kg'}, inplace=True)
-    
-    # Unit standardization
-    print("Standardizing units...")
-    df['Height_m'] = df['Height'] * 0.0254  # Convert inches to meters
-    df['Weight_kg'] = df['Weight'] * 0.45359237  # Convert pounds to kilograms
-    
-    # Feature engineering
-    print("Engineering features...")
-    # Calculate BMI (rounded to 2 decimal places)
-    df['BMI'] = round(df['Weight_kg'] / (df['Height_m'] ** 2), 2)
-    
-    # Create AgeGroup categorical variable
-    conditions = [
-        (df['Age'] < 30),
-        (df['Age'] >= 30) & (df['Age'] <= 45),
-        (df['Age'] > 45) & (df['Age'] <= 60),
-        (df['Age'] > 60)
-    ]
-    choices = ['<30', '30-45', '46-60', '>60']
-    df['AgeGroup'] = np.select(conditions, choices, default='Unknown')
+def read_raw(source):
+    """Read a raw CSV of this dataset with raw_csv, or pandas if it is outside the fast path."""
+    return raw_csv.read_csv(source, RAW_DTYPES)
+
+# AgeGroup levels in order, and their one-hot column names
+AGE_GROUPS = ['<30', '30-45', '46-60', '>60']
+AGE_GROUP_COLUMNS = ['AgeGroup_<30', 'AgeGroup_30–45', 'AgeGroup_46–60', 'AgeGroup_>60']
+# Where groups 2-4 start for searchsorted(side='right'): 30 is in 30-45, but 45
+# and 60 still belong to the group below
+AGE_BIN_EDGES = np.array([30.0, np.nextafter(45.0, np.inf), np.nextafter(60.0, np.inf)])
+
+INCHES_TO_METERS = 0.0254
+POUNDS_TO_KILOGRAMS = 0.45359237
+
+def process_data(df=None, export_csv=False, workers=1, append=False, source=None, append_path=None):
+    """Process the raw frailty data.
+
+    If df is given (e.g. the frame returned by ingest_data), it is used instead
+    of re-reading the raw CSV. The caller's frame is left unmodified.
+
+    Every transformation is row-local, so with workers > 1 the rows are split
+    into partitions (byte ranges of the raw CSV, or row slices of df) that
+    are processed in a pool of forked worker processes (0 means one per CPU)
+    and concatenated in order; the result is identical to the serial path's.
+
+    The processed data is saved as Parquet so downstream stages get the
+    categorical and int8 dtypes back; set export_csv to also write the CSV.
+
+    With append, df holds only new raw rows (from ingest_data(append_path=...)):
+    they are processed and written as the next part of the processed store,
+    next to the existing processed file, and added to the CSV export if there
+    is one (export_csv is ignored). The file they were read from, append_path,
+    is then appended to the raw CSV. If any of these writes fails, the ones
+    before it are undone, so the append can be rerun. A run without append
+    rebuilds the whole store from the raw CSV and drops the appended parts.
+
+    source (a directory or glob of raw CSV files, see raw_sources) is read
+    instead of the raw CSV when df is not given; its files are read
+    concurrently, or with workers > 1 processed as one partition each, and
+    the rows keep their source_file column.
+    """
+    print("Stage 2: Processing Data")
     
-    # Categorical encoding
-    print("Encoding categorical variables...")
-    # Binary encoding for Frailty (Y→1, N→0)
-    df['Frailty_binary'] = (df['Frailty'] == 'Y').astype('int8')
+    if append and (df is None or append_path is None):
+        raise ValueError("append needs the new raw rows as df and their file as append_path")
     
-    # One-hot encoding for AgeGroup
-    age_group_dummies = pd.get_dummies(df['AgeGroup'], prefix='AgeGroup')
-    # Convert boolean True/False to binary 1/0
-    age_group_dummies = age_group_dummies.astype('int8')
-    df = pd.concat([df, age_group_dummies], axis=1)
+    if append and source is not None:
+        raise ValueError("append cannot be combined with source")
+    files = raw_sources.source_files(source) if df is None and source is not None else None
     
-    # Rename columns to match requirements
-    df.rename(columns={
-        'AgeGroup_<30': 'AgeGroup_<30',
-        'AgeGroup_30-45': 'AgeGroup_30–45',
-        'AgeGroup_46-60': 'AgeGroup_46–60',
-        'AgeGroup_>60': 'AgeGroup_>60'
-    }, inplace=True)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        if files is not None:
+            partitions = files
+        elif df is None:
+            partitions = partitioned.csv_partitions(raw_data_path, workers)
+        else:
+            partitions = partitioned.frame_partitions(df, workers)
+    if workers > 1 and len(partitions) > 1:
+        print(f"Processing {len(partitions)} partitions with {workers} worker processes")
+        print("Standardizing units, engineering features and encoding categorical variables...")
+        with profiling.step('partitioned_process') as record:
+            frames = partitioned.map_partitions(_process_partition, partitions, workers)
+            df = partitioned.concat_partitions(frames)
+            record['rows_out'] = len(df)
+    else:
+        # Load raw data unless the upstream stage handed it over
+        if df is None:
+            with profiling.step('csv_parse') as record:
+                if files is not None:
+                    df = raw_sources.read_sources(files, read_raw)
+                else:
+                    df = read_raw(raw_data_path)
+                record['rows_out'] = len(df)
+            print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
+        else:
+            print(f"Received {df.shape[0]} records with {df.shape[1]} variables from ingest")
+        
+        print("Standardizing units, engineering features and encoding categorical variables...")
+        df = engineer_features(df)
     
     # Save processed data
-    os.makedirs(os.path.dirname(processed_data_path), exist_ok=True)
-    df.to_csv(processed_data_path, index=False)
-    print(f"Processed data saved to {processed_data_path}")
+    if append:
+        save_append(df, append_path)
+    else:
+        os.makedirs(os.path.dirname(processed_data_path), exist_ok=True)
+        with profiling.step('write_parquet', rows_out=len(df)):
+            df.to_parquet(processed_data_path, index=False, compression='snappy')
+        incremental.clear_appends(appends_path)
+        print(f"Processed data saved to {processed_data_path}")
+        if export_csv:
+            with profiling.step('write_csv', rows_out=len(df)):
+                df.to_csv(processed_csv_path, index=False)
+            print(f"CSV export saved to {processed_csv_path}")
     
     # Display data preview
     print("Processed data preview:")
@@ -74,6 +140,83 @@ def process_data():
     
     return df
 
+def save_append(df, append_path):
+    """Store the processed new rows as the next part, then add their raw file to the raw CSV.
+
+    The raw CSV is extended last, so it only holds rows whose processed part
+    exists; a failed step undoes the earlier ones.
+    """
+    output_path = incremental.next_part_path(appends_path)
+    with incremental.undo_on_failure(created=[output_path], extended=[processed_csv_path, raw_data_path]):
+        with profiling.step('write_parquet', rows_out=len(df)):
+            df.to_parquet(output_path, index=False, compression='snappy')
+        print(f"Processed data saved to {output_path}")
+        # Only extend an existing export; a new one would miss the history
+        if os.path.exists(processed_csv_path):
+            with profiling.step('write_csv', rows_out=len(df)):
+                df.to_csv(processed_csv_path, index=False, mode='a', header=False)
+            print(f"CSV export extended at {processed_csv_path}")
+        with profiling.step('append_raw', rows_in=len(df)):
+            incremental.append_raw(raw_data_path, append_path)
+        print(f"Appended {len(df)} new records to {raw_data_path}")
+
+def _process_partition(partition):
+    """Worker: the processed rows of one partition."""
+    return engineer_features(partition.read(read_raw))
+
+def engineer_features(df):
+    """Return df with Grip_kg renamed and the derived and encoded columns added."""
+    # Rename grip strength to Grip_kg
+    df = df.rename(columns={'Grip strength': 'Grip_kg'})
+    
+    # Unit standardization
+    with profiling.step('unit_standardization', rows_in=len(df)):
+        height_m, weight_kg = standardize_units(df['Height'], df['Weight'])
+    
+    # Feature engineering
+    with profiling.step('feature_engineering', rows_in=len(df)):
+        # BMI (rounded to 2 decimal places) and AgeGroup codes
+        bmi = compute_bmi(height_m, weight_kg)
+        age_codes = age_group_codes(df['Age'])
+    
+    # Categorical encoding
+    with profiling.step('categorical_encoding', rows_in=len(df)):
+        features = {
+            'Height_m': height_m,
+            'Weight_kg': weight_kg,
+            'BMI': bmi,
+            'AgeGroup': pd.Categorical.from_codes(age_codes, categories=AGE_GROUPS, ordered=True),
+            # Binary encoding for Frailty (Y→1, N→0)
+            'Frailty_binary': (df['Frailty'] == 'Y').to_numpy(dtype=bool).view(np.int8),
+        }
+        # One-hot encoding for AgeGroup, one int8 column per group
+        features.update(zip(AGE_GROUP_COLUMNS, one_hot(age_codes, len(AGE_GROUPS))))
+        return pd.concat([df, pd.DataFrame(features, index=df.index, copy=False)], axis=1)
+
+def standardize_units(height, weight):
+    """Return (Height_m, Weight_kg) as float64 arrays, one ufunc pass each."""
+    height_m = np.multiply(height, INCHES_TO_METERS, dtype=np.float64)
+    weight_kg = np.multiply(weight, POUNDS_TO_KILOGRAMS, dtype=np.float64)
+    return np.asarray(height_m), np.asarray(weight_kg)
+
+def compute_bmi(height_m, weight_kg):
+    """BMI rounded to 2 decimals, computed in place in a single buffer."""
+    bmi = np.multiply(height_m, height_m)
+    np.divide(weight_kg, bmi, out=bmi)
+    return np.round(bmi, 2, out=bmi)
+
+def age_group_codes(age):
+    """Index into AGE_GROUPS for every age, as int8 (-1 where Age is missing)."""
+    age = np.asarray(age)
+    codes = np.searchsorted(AGE_BIN_EDGES, age, side='right').astype(np.int8)
+    if age.dtype.kind == 'f':
+        codes[np.isnan(age)] = -1
+    return codes
+
+def one_hot(codes, n_levels):
+    """One int8 indicator array per level, straight from the codes."""
+    return [(codes == code).view(np.int8) for code in range(n_levels)]
+
 if __name__ == "__main__":
     processed_df = process_data()
     print("Data processing complete")
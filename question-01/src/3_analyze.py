@@ -7,64 +7,199 @@ Stage 3: Data Analysis
 """
 
 import os
+import sys
 import pandas as pd
 import numpy as np
-from scipy import stats
+import pyarrow.dataset as ds
+
+# Helper modules shared by both workflows
+common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if common_dir not in sys.path:
+    sys.path.insert(0, common_dir)
+
+import profiling
+import incremental
+import resampling
+from streaming import RunningMoments, RunningCorrelation, QuantileSketch
 
 # Define paths
-processed_data_path = os.path.join('data', 'processed', 'frailty_processed.csv')
+processed_data_path = os.path.join('data', 'processed', 'frailty_processed.parquet')
+appends_path = os.path.join('data', 'processed', 'frailty_appends')
+# Accumulators of the last analysis, with the processed files they cover
+statistics_path = os.path.join('data', 'processed', 'frailty_statistics.pkl')
 findings_path = os.path.join('reports', 'findings.md')
 
-def analyze_data():
+# Select numeric columns for summary statistics
+numeric_cols = ['Height', 'Weight', 'Height_m', 'Weight_kg', 'BMI', 'Age', 'Grip_kg']
+
+def analyze_data(df=None, chunksize=None, relative_accuracy=0.001, append=False, n_resamples=0,
+                 workers=1):
+    """Analyze the processed frailty data.
+
+    If df is given (e.g. the frame returned by process_data), it is used instead
+    of loading the processed data.
+
+    All statistics come from one streaming pass (see accumulate). With
+    chunksize, the data is read in batches of that many rows, so the processed
+    file (or a directory of Parquet partitions) never has to fit in memory.
+    relative_accuracy bounds the median error once the sketch leaves exact mode.
+
+    The correlation gets a bootstrap confidence interval and a permutation
+    p-value from n_resamples resamples of the distinct (Grip_kg,
+    Frailty_binary) pairs counted in the same pass (0, the default, skips
+    them); workers processes share the resamples.
+
+    The accumulators are saved next to the processed data. With append, df
+    holds only the rows process_data(append=True) just added to the store:
+    they are merged into the saved accumulators, so the cost is proportional
+    to the new rows. If the saved accumulators do not cover the rest of the
+    store (or used another relative_accuracy), they are rebuilt from all of it.
+    """
     print("Stage 3: Analyzing Data")
     
-    # Load processed data
-    df = pd.read_csv(processed_data_path)
-    print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
-    
-    # Select numeric columns for summary statistics
-    numeric_cols = ['Height', 'Weight', 'Height_m', 'Weight_kg', 'BMI', 'Age', 'Grip_kg']
-    
-    # Compute summary statistics
-    print("Computing summary statistics...")
-    summary = df[numeric_cols].describe().T
-    
-    # Compute median separately (not included in describe())
-    summary['median'] = df[numeric_cols].median()
+    files = incremental.processed_files(processed_data_path, appends_path)
+    state = None
+    if append:
+        state = incremental.load_statistics(statistics_path, files[:-1])
+        if state is not None and (state['relative_accuracy'] != relative_accuracy
+                                  or set(state) != set(new_state(numeric_cols))):
+            state = None
+        if state is None:
+            print("Saved statistics do not cover the processed data; rebuilding them")
+            df = None
+        else:
+            print(f"Merging {df.shape[0]} new records into the statistics of {state['rows']} records")
+    if state is None:
+        state = new_state(numeric_cols, relative_accuracy)
     
-    # Rearrange columns for better readability
-    summary = summary[['mean', 'median', 'std']]
+    # Stream processed data unless the upstream stage handed it over
+    if df is None:
+        print(f"Reading {processed_data_path}" + (f" in batches of {chunksize} rows" if chunksize else ""))
+    elif not append:
+        print(f"Received {df.shape[0]} records with {df.shape[1]} variables from processing")
+    chunks = iter_processed_chunks(df, chunksize)
     
-    # Calculate correlation between Grip_kg and Frailty_binary
-    print("Calculating correlations...")
-    correlation = df['Grip_kg'].corr(df['Frailty_binary'])
+    # Compute summary statistics and the Grip_kg/Frailty_binary correlation
+    print("Computing summary statistics and correlations...")
+    with profiling.step('summary_statistics') as record:
+        rows_before = state['rows']
+        accumulate(state, chunks)
+        record['rows_in'] = state['rows'] - rows_before
+        summary, correlation = summarize(state)
+    print(f"Analyzed {state['rows']} records")
+    test = None
+    if n_resamples and not state['pairs'].overflowed:
+        print(f"Resampling the correlation {n_resamples} times...")
+        with profiling.step('resampling', rows_in=state['pairs'].rows):
+            test = resampling.correlation(None, None, n_resamples, workers=workers, pairs=state['pairs'])
+    with profiling.step('save_statistics'):
+        incremental.save_statistics(statistics_path, state, files)
     
     # Generate findings report
     print("Generating findings report...")
     os.makedirs(os.path.dirname(findings_path), exist_ok=True)
     
-    with open(findings_path, 'w') as f:
-        f.write("# Frailty Data Analysis Findings\n\n")
+    with profiling.step('write_report'):
+        with open(findings_path, 'w') as f:
+            f.write("# Frailty Data Analysis Findings\n\n")
         
-        f.write("## Summary Statistics for Numeric Variables\n\n")
-        f.write(summary.to_markdown(floatfmt=".2f"))
-        f.write("\n\n")
+            f.write("## Summary Statistics for Numeric Variables\n\n")
+            f.write(summary.to_markdown(floatfmt=".2f"))
+            f.write("\n\n")
         
-        f.write("## Relationship between Grip Strength and Frailty\n\n")
-        f.write(f"Correlation between Grip_kg and Frailty_binary: {correlation:.4f}\n\n")
+            f.write("## Relationship between Grip Strength and Frailty\n\n")
+            f.write(f"Correlation between Grip_kg and Frailty_binary: {correlation:.4f}\n\n")
+            if test is not None:
+                null = 'permutation' if test.null == 'permutation' else 't-test'
+                f.write(f"95% bootstrap confidence interval: [{test.ci_low:.4f}, {test.ci_high:.4f}]; "
+                        f"{null} p-value: {test.pvalue:.4f} ({test.n_resamples} resamples)\n\n")
         
-        if correlation < 0:
-            f.write("The negative correlation indicates that **higher** grip strength is associated with **lower** frailty (Frailty_binary=0 means N).\n")
-            f.write("This supports the hypothesis that reduced grip strength correlates with higher frailty scores.\n\n")
-        elif correlation > 0:
-            f.write("The positive correlation indicates that **higher** grip strength is associated with **higher** frailty (Frailty_binary=1 means Y).\n")
-            f.write("This contradicts the expected hypothesis that reduced grip strength correlates with higher frailty scores.\n\n")
-        else:
-            f.write("No correlation was found between grip strength and frailty.\n\n")
+            if correlation < 0:
+                f.write("The negative correlation indicates that **higher** grip strength is associated with **lower** frailty (Frailty_binary=0 means N).\n")
+                f.write("This supports the hypothesis that reduced grip strength correlates with higher frailty scores.\n\n")
+            elif correlation > 0:
+                f.write("The positive correlation indicates that **higher** grip strength is associated with **higher** frailty (Frailty_binary=1 means Y).\n")
+                f.write("This contradicts the expected hypothesis that reduced grip strength correlates with higher frailty scores.\n\n")
+            else:
+                f.write("No correlation was found between grip strength and frailty.\n\n")
     
     print(f"Findings saved to {findings_path}")
     return summary, correlation
 
+def iter_processed_chunks(df=None, chunksize=None):
+    """Yield the processed data as DataFrames of at most chunksize rows."""
+    columns = numeric_cols + ['Frailty_binary']
+    if df is not None:
+        step = chunksize or max(len(df), 1)
+        for start in range(0, len(df), step):
+            yield df.iloc[start:start + step]
+        return
+    
+    # The processed file (or a directory of partitions) and any appended parts
+    for path in incremental.processed_files(processed_data_path, appends_path):
+        dataset = ds.dataset(path, format='parquet')
+        if not chunksize:
+            yield dataset.to_table(columns=columns).to_pandas()
+            continue
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+
+
+def new_state(columns, relative_accuracy=0.001):
+    """Empty accumulators for the mean, median and std of columns and corr(Grip_kg, Frailty_binary).
+
+    Means, standard deviations and the correlation use mergeable Welford-style
+    accumulators; medians come from a QuantileSketch; the distinct
+    (Grip_kg, Frailty_binary) pairs are counted for resampling.
+    """
+    return {
+        'columns': list(columns),
+        'relative_accuracy': relative_accuracy,
+        'rows': 0,
+        'moments': {col: RunningMoments() for col in columns},
+        'sketches': {col: QuantileSketch(relative_accuracy) for col in columns},
+        'grip_frailty': RunningCorrelation(),
+        'pairs': resampling.DistinctRows(2),
+    }
+
+
+def accumulate(state, chunks):
+    """Add every chunk to the accumulators in state."""
+    for chunk in chunks:
+        state['rows'] += len(chunk)
+        for col in state['columns']:
+            values = chunk[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            state['moments'][col].update(values)
+            state['sketches'][col].update(values)
+        grip = chunk['Grip_kg'].to_numpy(dtype=np.float64, na_value=np.nan)
+        frailty = chunk['Frailty_binary'].to_numpy(dtype=np.float64, na_value=np.nan)
+        state['grip_frailty'].update(grip, frailty)
+        state['pairs'].update(np.column_stack([grip, frailty]))
+    return state
+
+
+def summarize(state):
+    """(summary, correlation) from the accumulators in state."""
+    columns = state['columns']
+    moments, sketches = state['moments'], state['sketches']
+    summary = pd.DataFrame({
+        'mean': [moments[col].mean if moments[col].count else np.nan for col in columns],
+        'median': [sketches[col].median for col in columns],
+        'std': [moments[col].std for col in columns],
+    }, index=columns)
+    return summary, state['grip_frailty'].correlation
+
+
+def summarize_chunks(chunks, columns, relative_accuracy=0.001):
+    """Mean, median and std of columns plus corr(Grip_kg, Frailty_binary) in one pass.
+
+    Returns (summary, correlation, rows).
+    """
+    state = accumulate(new_state(columns, relative_accuracy), chunks)
+    summary, correlation = summarize(state)
+    return summary, correlation, state['rows']
+
+
 if __name__ == "__main__":
     summary, correlation = analyze_data()
     print(f"Data analysis complete. Correlation between Grip_kg and Frailty_binary: {correlation:.4f}")
@@ -7,73 +7,452 @@ Stage 2: Data Processing
 """
 
 import os
+import sys
+import warnings
+from functools import reduce
+
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Helper modules shared by both workflows
+common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if common_dir not in sys.path:
+    sys.path.insert(0, common_dir)
+
+import profiling
+import partitioned
+import imputation
+import incremental
+import raw_csv
+import raw_sources
+import group_stats
 
 # Define paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_dir = os.path.dirname(script_dir)
 raw_data_path = os.path.join(project_dir, 'data', 'raw', 'StudentsPerformance.csv')
-processed_data_path = os.path.join(project_dir, 'data', 'processed', 'students_processed.csv')
+processed_data_path = os.path.join(project_dir, 'data', 'processed', 'students_processed.parquet')
+processed_csv_path = os.path.join(project_dir, 'data', 'processed', 'students_processed.csv')
+# Processed rows of incremental appends, one Parquet part per append
+appends_path = os.path.join(project_dir, 'data', 'processed', 'students_appends')
+# FillStatistics of all raw rows, with the processed files they cover
+statistics_path = os.path.join(project_dir, 'data', 'processed', 'students_fill_statistics.pkl')
+# AggregateCube of the processed store (score sums over every combination of
+# the categorical columns), with the processed files it covers
+cube_path = os.path.join(project_dir, 'data', 'processed', 'students_cube_statistics.pkl')
+
+# Raw columns parsed straight into compact dtypes: the five categorical
+# columns as category (small-int codes) and the scores as uint8
+CATEGORICAL_COLUMNS = ['gender', 'race/ethnicity', 'parental level of education',
+                       'lunch', 'test preparation course']
+RAW_SCORE_COLUMNS = ['math score', 'reading score', 'writing score']
+RAW_DTYPES = {**{col: 'category' for col in CATEGORICAL_COLUMNS},
+              **{col: np.uint8 for col in RAW_SCORE_COLUMNS}}
+SCORE_COLUMNS = ['math_score', 'reading_score', 'writing_score']
+
+# overall_avg and the performance_category code for every possible total of
+# three uint8 scores, so both are table lookups on the integer sum
+PERFORMANCE_BINS = [0, 40, 60, 75, 100]
+PERFORMANCE_LABELS = ['Poor', 'Average', 'Good', 'Excellent']
+AVG_BY_TOTAL = np.arange(3 * 255 + 1) / 3
+PERFORMANCE_CODE_BY_TOTAL = pd.cut(AVG_BY_TOTAL, bins=PERFORMANCE_BINS, labels=PERFORMANCE_LABELS).codes
+
+def process_data(df=None, export_csv=False, workers=1, chunksize=None, append=False, source=None,
+                 append_path=None):
+    """Process the raw student performance data.
+
+    If df is given (e.g. the frame returned by ingest_data), it is used instead
+    of re-reading the raw CSV. The caller's frame is left unmodified.
+
+    With chunksize (and no df), the raw CSV is streamed twice in chunks of
+    that many rows: once to collect the fill statistics and once to fill,
+    transform and write each chunk, so files bigger than memory can be
+    processed. Nothing is returned in that mode; the Parquet file holds the
+    same data the in-memory path would produce.
+
+    With workers > 1 the rows are split into partitions (byte ranges of the
+    raw CSV, or row slices of df) that are processed in a pool of forked
+    worker processes (0 means one per CPU); the result is identical to the
+    serial path's.
+
+    The processed data is saved as Parquet so downstream stages get the
+    categorical and uint8 dtypes back; set export_csv to also write the CSV.
 
-def process_data():
+    With append, df holds only new raw rows (from ingest_data(append_path=...)):
+    they are processed serially and written as the next part of the processed
+    store, and added to the CSV export if there is one (export_csv is
+    ignored). Their missing values are filled from the saved fill statistics
+    of all earlier rows merged with theirs; rows processed earlier keep the
+    fills they were given. Once the part and the statistics are saved, the
+    file the rows were read from, append_path, is appended to the raw CSV; if
+    any of these writes fails, the ones before it are undone, so the append
+    can be rerun. A run without append rebuilds the whole store from the raw
+    CSV and drops the appended parts.
+
+    Every run also saves the AggregateCube of the processed store (count, sum
+    and sum of squares of the scores over every combination of the
+    categorical columns, with their rollups) next to it; an append merges the
+    new rows into the saved cube.
+
+    source (a directory or glob of raw CSV files, see raw_sources) is read
+    instead of the raw CSV when df is not given; its files are read
+    concurrently, streamed one after another, or with workers > 1 processed
+    as one partition each, and the rows keep their source_file column.
+    """
     print("Stage 2: Processing Data")
     
-    # Load raw data
-    df = pd.read_csv(raw_data_path)
-    print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
+    if append and (df is None or append_path is None):
+        raise ValueError("append needs the new raw rows as df and their file as append_path")
+    if append and source is not None:
+        raise ValueError("append cannot be combined with source")
+    files = raw_sources.source_files(source) if df is None and source is not None else None
     
-    # Clean column names - strip quotes if any and ensure snake_case
-    df.columns = [col.strip('"').replace(' ', '_').replace('/', '_') for col in df.columns]
+    if df is None and chunksize:
+        if files is None:
+            print(f"Streaming {raw_data_path} in chunks of {chunksize} rows")
+        else:
+            print(f"Streaming {len(files)} raw files in chunks of {chunksize} rows")
+        preview, stats, cube = process_streaming(raw_data_path if files is None else files,
+                                                 chunksize, export_csv)
+        incremental.clear_appends(appends_path)
+        incremental.save_statistics(statistics_path, stats, [processed_data_path])
+        incremental.save_statistics(cube_path, cube, [processed_data_path])
+        print(f"Aggregate cube saved to {cube_path}")
+        print_summary(preview)
+        return None
     
-    # Check for missing values
-    print("\nChecking for missing values...")
-    missing = df.isna().sum()
-    if missing.sum() > 0:
-        print("Missing values found:")
-        print(missing[missing > 0])
-        
-        # Handle missing values (if any)
-        for col in df.columns:
-            if df[col].isna().sum() > 0:
-                if pd.api.types.is_numeric_dtype(df[col]):
-                    # Fill numeric columns with median
-                    df[col] = df[col].fillna(df[col].median())
-                else:
-                    # Fill categorical columns with mode
-                    df[col] = df[col].fillna(df[col].mode()[0])
+    if append:
+        workers = 1
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        if files is not None:
+            partitions = files
+        elif df is None:
+            partitions = partitioned.csv_partitions(raw_data_path, workers)
+        else:
+            partitions = partitioned.frame_partitions(df, workers)
+    if workers > 1 and len(partitions) > 1:
+        print(f"Processing {len(partitions)} partitions with {workers} worker processes")
+        with profiling.step('partitioned_process') as record:
+            df, stats = process_partitioned(partitions, workers)
+            record['rows_out'] = len(df)
     else:
-        print("No missing values found")
-    
-    # Feature engineering
-    print("\nEngineering features...")
-    
-    # Create overall average score
-    df['overall_avg'] = (df['math_score'] + df['reading_score'] + df['writing_score']) / 3
-    
-    # Create performance categories based on overall average
-    bins = [0, 40, 60, 75, 100]
-    labels = ['Poor', 'Average', 'Good', 'Excellent']
-    df['performance_category'] = pd.cut(df['overall_avg'], bins=bins, labels=labels)
+        # Load raw data unless the upstream stage handed it over
+        if df is None:
+            with profiling.step('csv_parse') as record:
+                if files is not None:
+                    df = raw_sources.read_sources(files, read_raw)
+                else:
+                    df = read_raw(raw_data_path)
+                record['rows_out'] = len(df)
+            print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
+        else:
+            print(f"Received {df.shape[0]} records with {df.shape[1]} variables from ingest")
+        
+        # Clean column names (returns a new frame, so the caller's raw frame is not touched)
+        df = clean_column_names(df)
+        
+        # Missing counts and fill values from one pass over the columns
+        with profiling.step('fill_statistics', rows_in=len(df)):
+            stats = imputation.FillStatistics().update(df)
+        report_missing(stats.missing)
+        if append:
+            stats = merge_saved_statistics(stats)
+        fills = stats.fills()
+        
+        # Feature engineering
+        print("\nEngineering features...")
+        df = transform(df, fills, category_levels(stats))
     
-    # Convert categorical variables to proper category dtype
-    categorical_cols = df.select_dtypes(include=['object']).columns
-    for col in categorical_cols:
-        df[col] = df[col].astype('category')
+    # Score sums over every combination of the categorical columns
+    with profiling.step('aggregate_cube', rows_in=len(df)):
+        cube = group_stats.AggregateCube.of(df)
+        if append:
+            cube = merge_saved_cube(cube)
     
     # Save processed data
-    os.makedirs(os.path.dirname(processed_data_path), exist_ok=True)
-    df.to_csv(processed_data_path, index=False)
-    print(f"\nProcessed data saved to {processed_data_path}")
+    if append:
+        save_append(df, stats, cube, append_path)
+    else:
+        os.makedirs(os.path.dirname(processed_data_path), exist_ok=True)
+        with profiling.step('write_parquet', rows_out=len(df)):
+            df.to_parquet(processed_data_path, index=False, compression='snappy')
+        incremental.clear_appends(appends_path)
+        save_store_statistics(stats, cube)
+        print(f"\nProcessed data saved to {processed_data_path}")
+        print(f"Aggregate cube saved to {cube_path}")
+        if export_csv:
+            with profiling.step('write_csv', rows_out=len(df)):
+                df.to_csv(processed_csv_path, index=False)
+            print(f"CSV export saved to {processed_csv_path}")
     
-    # Display data summary
+    print_summary(df.head())
+    return df
+
+def save_store_statistics(stats, cube):
+    """Save the FillStatistics and AggregateCube as covering the processed store."""
+    files = incremental.processed_files(processed_data_path, appends_path)
+    incremental.save_statistics(statistics_path, stats, files)
+    incremental.save_statistics(cube_path, cube, files)
+
+def save_append(df, stats, cube, append_path):
+    """Store the processed new rows as the next part, then add their raw file to the raw CSV.
+
+    The raw CSV is extended last, so it only holds rows whose processed part
+    and statistics are saved; a failed step undoes the earlier ones.
+    """
+    output_path = incremental.next_part_path(appends_path)
+    with incremental.undo_on_failure(created=[output_path], extended=[processed_csv_path, raw_data_path]):
+        with profiling.step('write_parquet', rows_out=len(df)):
+            df.to_parquet(output_path, index=False, compression='snappy')
+        save_store_statistics(stats, cube)
+        print(f"\nProcessed data saved to {output_path}")
+        print(f"Aggregate cube saved to {cube_path}")
+        # Only extend an existing export; a new one would miss the history
+        if os.path.exists(processed_csv_path):
+            with profiling.step('write_csv', rows_out=len(df)):
+                df.to_csv(processed_csv_path, index=False, mode='a', header=False)
+            print(f"CSV export extended at {processed_csv_path}")
+        with profiling.step('append_raw', rows_in=len(df)):
+            incremental.append_raw(raw_data_path, append_path)
+        print(f"\nAppended {len(df)} new records to {raw_data_path}")
+
+def merge_saved_statistics(stats):
+    """The saved FillStatistics of the processed store merged with stats of new rows.
+
+    If none are saved for the current store, they are recounted from the raw
+    CSV, which does not hold the new rows yet.
+    """
+    files = incremental.processed_files(processed_data_path, appends_path)
+    saved = incremental.load_statistics(statistics_path, files)
+    if saved is not None:
+        print(f"Filling from the statistics of {saved.rows} earlier and {stats.rows} new records")
+        return saved.merge(stats)
+    print("Saved fill statistics do not cover the processed data; recounting the raw data")
+    with profiling.step('fill_statistics_rebuild'):
+        saved = imputation.scan(read_raw_chunks(raw_data_path, 100_000,
+                                                {col: 'category' for col in CATEGORICAL_COLUMNS}))
+    return saved.merge(stats)
+
+def merge_saved_cube(cube):
+    """The saved AggregateCube of the processed store merged with cube (of new rows).
+
+    If none is saved for the current store, it is rebuilt from the processed
+    files.
+    """
+    files = incremental.processed_files(processed_data_path, appends_path)
+    saved = incremental.load_statistics(cube_path, files)
+    if saved is not None:
+        return saved.merge(cube)
+    print("Saved aggregate cube does not cover the processed data; rebuilding it")
+    with profiling.step('aggregate_cube_rebuild'):
+        for path in files:
+            rows = pd.read_parquet(path, columns=group_stats.GROUP_COLUMNS + group_stats.SCORE_COLUMNS)
+            cube = group_stats.AggregateCube.of(rows).merge(cube)
+    return cube
+
+def print_summary(preview):
     print("\nProcessed data preview:")
-    print(df.head())
+    print(preview)
     
     print("\nNew columns added:")
     print(f"- overall_avg: Average of math, reading, and writing scores")
     print(f"- performance_category: Performance level based on overall average")
+
+def process_streaming(path, chunksize, export_csv):
+    """Process the raw CSV in two streaming passes; return (preview of the first rows, FillStatistics, AggregateCube).
+
+    path may also be a list of SourceFiles, which are streamed one after another.
+
+    The first pass collects the missing counts, value counts and fill values
+    of every column; the second fills, transforms and appends each chunk to
+    the Parquet (and CSV) output. Each chunk is given the categorical levels
+    and score dtypes of the whole file, so all chunks share one schema.
+    """
+    categorical = {col: 'category' for col in CATEGORICAL_COLUMNS}
+    with profiling.step('fill_statistics'):
+        stats = imputation.scan(read_raw_chunks(path, chunksize, categorical))
+    print(f"Scanned {stats.rows} records with {len(stats.columns)} variables")
+    report_missing(stats.missing)
+    fills = stats.fills()
+    
+    levels = {col: pd.CategoricalDtype(stats.columns[clean_name(col)].levels()) for col in CATEGORICAL_COLUMNS}
+    score_dtypes = {}
+    for col in SCORE_COLUMNS:
+        counts = stats.columns[col]
+        whole_fill = not counts.missing or float(fills.get(col, np.nan)).is_integer()
+        score_dtypes[col] = np.uint8 if counts.small_ints and whole_fill else np.float64
+    
+    print("\nEngineering features...")
+    os.makedirs(os.path.dirname(processed_data_path), exist_ok=True)
+    preview = None
+    writer = None
+    cube = None
+    with profiling.step('transform_and_write', rows_in=stats.rows) as record:
+        try:
+            for chunk in read_raw_chunks(path, chunksize, levels):
+                chunk = transform(chunk, fills).astype(score_dtypes)
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                first = writer is None
+                if first:
+                    preview = chunk.head()
+                    writer = pq.ParquetWriter(processed_data_path, table.schema, compression='snappy')
+                writer.write_table(table)
+                chunk_cube = group_stats.AggregateCube.of(chunk)
+                cube = chunk_cube if cube is None else cube.merge(chunk_cube)
+                if export_csv:
+                    chunk.to_csv(processed_csv_path, index=False, mode='w' if first else 'a', header=first)
+        finally:
+            if writer is not None:
+                writer.close()
+        record['rows_out'] = stats.rows
+    print(f"\nProcessed data saved to {processed_data_path}")
+    if export_csv:
+        print(f"CSV export saved to {processed_csv_path}")
+    return preview, stats, cube
+
+def read_raw_chunks(path, chunksize, dtype):
+    """Yield the raw CSV (or list of SourceFiles) in chunks of chunksize rows, with snake_case column names."""
+    if not isinstance(path, (str, os.PathLike)):
+        for chunk in raw_sources.read_chunks(path, chunksize, dtype=dtype):
+            yield clean_column_names(chunk)
+        return
+    with pd.read_csv(path, chunksize=chunksize, dtype=dtype) as reader:
+        for chunk in reader:
+            yield clean_column_names(chunk)
+
+def process_partitioned(partitions, workers):
+    """Run the processing over partitions in a process pool; return (concatenated frame, FillStatistics).
+
+    Missing-value imputation needs the global median/mode, so it is a
+    reduce-then-apply: the first pass parses every partition, counts its
+    values and transforms the partitions that have no missing values; the
+    fills are then computed from the merged FillStatistics and a second pass
+    gives the remaining partitions the categorical levels of all partitions
+    and transforms them with the fills.
+    """
+    with profiling.step('count_and_transform'):
+        results = partitioned.map_partitions(_process_partition, partitions, workers)
+    stats = reduce(imputation.FillStatistics.merge, [stats for stats, _ in results])
+    frames = [frame for _, frame in results]
+    
+    report_missing(stats.missing)
+    if stats.missing.sum() > 0:
+        with profiling.step('impute_missing'):
+            fills = stats.fills()
+            todo = [i for i, frame in enumerate(frames) if frame is None]
+            done = partitioned.map_partitions(_process_partition, [partitions[i] for i in todo], workers,
+                                              fills, category_levels(stats))
+            for i, (_, frame) in zip(todo, done):
+                frames[i] = frame
+    
+    print("\nEngineering features...")
+    with profiling.step('concat_partitions'):
+        return partitioned.concat_partitions(frames), stats
+
+def _process_partition(partition, fills=None, levels=None):
+    """Worker: (FillStatistics, processed frame) of one partition.
+
+    Without fills, a partition that has missing values is only counted and
+    its frame is None.
+    """
+    df = clean_column_names(partition.read(read_raw))
+    if fills is not None:
+        return None, transform(df, fills, levels)
+    stats = imputation.FillStatistics().update(df)
+    if stats.missing.sum() > 0:
+        return stats, None
+    return stats, transform(df, {})
+
+def clean_name(col):
+    """Strip quotes if any and convert a column name to snake_case."""
+    return col.strip('"').replace(' ', '_').replace('/', '_')
+
+def clean_column_names(df):
+    return df.rename(columns=clean_name)
+
+def report_missing(missing):
+    print("\nChecking for missing values...")
+    if missing.sum() > 0:
+        print("Missing values found:")
+        print(missing[missing > 0])
+    else:
+        print("No missing values found")
+
+def category_levels(stats):
+    """Categorical dtype of each categorical column with the levels of all rows stats counted."""
+    return {clean_name(col): pd.CategoricalDtype(stats.columns[clean_name(col)].levels())
+            for col in CATEGORICAL_COLUMNS if clean_name(col) in stats.columns}
+
+def transform(df, fills, levels=None):
+    """Fill missing values, compact the dtypes and add the derived columns.
+
+    levels (from category_levels) are given to the filled categorical columns
+    first: rows that do not hold a column's mode, such as a few appended rows
+    or one partition, would otherwise lack the category it is filled with.
+    """
+    if fills:
+        with profiling.step('fill_missing', rows_in=len(df)):
+            if levels:
+                df = df.astype({col: dtype for col, dtype in levels.items() if col in fills})
+            df = df.fillna(fills)
+    
+    # Category codes and uint8 scores (a no-op if the CSV was parsed that way)
+    with profiling.step('category_encoding', rows_in=len(df)):
+        df = compact_dtypes(df)
     
+    with profiling.step('feature_engineering', rows_in=len(df)):
+        scores = [df[col].to_numpy() for col in SCORE_COLUMNS]
+        if all(values.dtype == np.uint8 for values in scores):
+            # Overall average and performance category looked up from the
+            # integer total of the three scores
+            total = np.add(scores[0], scores[1], dtype=np.uint16)
+            total += scores[2]
+            df['overall_avg'] = AVG_BY_TOTAL[total]
+            df['performance_category'] = pd.Categorical.from_codes(
+                PERFORMANCE_CODE_BY_TOTAL[total], categories=PERFORMANCE_LABELS, ordered=True)
+        else:
+            # Imputed (fractional) scores: compute from the float values
+            df['overall_avg'] = (df['math_score'] + df['reading_score'] + df['writing_score']) / 3
+            df['performance_category'] = pd.cut(df['overall_avg'], bins=PERFORMANCE_BINS,
+                                                labels=PERFORMANCE_LABELS)
+    return df
+
+def read_raw(path):
+    """Read the raw CSV with the categorical columns as category and the scores as uint8."""
+    try:
+        return raw_csv.read(path, RAW_DTYPES)
+    except raw_csv.UnsupportedCSV:
+        if hasattr(path, 'seek'):
+            path.seek(0)
+    try:
+        with warnings.catch_warnings():
+            # pandas warns about the NaN cast before raising on it
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return pd.read_csv(path, dtype=RAW_DTYPES)
+    except (ValueError, OverflowError):
+        # Missing or negative scores do not fit uint8; parse them as numbers
+        # and let imputation and compact_dtypes deal with them
+        if hasattr(path, 'seek'):
+            path.seek(0)
+        return pd.read_csv(path, dtype={col: 'category' for col in CATEGORICAL_COLUMNS})
+
+def compact_dtypes(df):
+    """Cast string columns to category and whole-number scores within 0-255 to uint8."""
+    for col in df.select_dtypes(include=['object']).columns:
+        df[col] = df[col].astype('category')
+    for col in SCORE_COLUMNS:
+        values = df[col].to_numpy()
+        if values.dtype == np.uint8:
+            continue
+        # An empty column (e.g. of a header-only file) has no min or max but fits uint8
+        if values.size == 0 or (pd.api.types.is_numeric_dtype(values) and np.isfinite(values).all()
+                                and (values == np.round(values)).all()
+                                and values.min() >= 0 and values.max() <= 255):
+            df[col] = values.astype(np.uint8)
     return df
 
 if __name__ == "__main__":
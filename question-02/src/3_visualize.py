@@ -11,203 +11,682 @@ Stage 3: Data Visualization
 """
 
 import os
+import sys
+import re
+import json
+import hashlib
+import multiprocessing as mp
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.ticker import MaxNLocator
-from scipy import stats
 
-# Set the style for all plots
-plt.style.use('seaborn-v0_8-whitegrid')
-sns.set_context("talk")
+# Helper modules shared by both workflows
+common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if common_dir not in sys.path:
+    sys.path.insert(0, common_dir)
+
+import profiling
+import partitioned
+import incremental
+import resampling
+import figure_templates
+from stage_cache import file_digest, module_files
+from group_stats import GroupStats, GroupSums
+
+# matplotlib, seaborn and scipy.stats are imported by configure_plotting() when
+# the first plot is drawn, so importing this module stays cheap
+plt = None
+sns = None
+stats = None
+cbook = None
 
 # Define paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_dir = os.path.dirname(script_dir)
-processed_data_path = os.path.join(project_dir, 'data', 'processed', 'students_processed.csv')
+processed_data_path = os.path.join(project_dir, 'data', 'processed', 'students_processed.parquet')
+appends_path = os.path.join(project_dir, 'data', 'processed', 'students_appends')
+# GroupSums of the processed store, with the processed files they cover
+statistics_path = os.path.join(project_dir, 'data', 'processed', 'students_group_statistics.pkl')
+# AggregateCube the processing stage saved with the processed store
+cube_path = os.path.join(project_dir, 'data', 'processed', 'students_cube_statistics.pkl')
 reports_path = os.path.join(project_dir, 'reports')
 findings_path = os.path.join(reports_path, 'visualization_findings.md')
+# Bootstrap intervals and permutation p-values of the plotted comparisons
+significance_path = os.path.join(reports_path, 'significance.md')
+# Correlation and regression of every score pair for every group level
+fits_path = os.path.join(reports_path, 'score_fits.csv')
+
+# Faceted reports: one directory of charts and findings per facet, plus the
+# data hash each facet was last rendered from
+facets_path = os.path.join(reports_path, 'facets')
+facet_manifest_path = os.path.join(facets_path, 'manifest.json')
 
 # Common figure parameters
 FIG_SIZE = (10, 7.5)  # 800x600 at 100 DPI, set DPI=300 when saving
 DPI = 300
 
-# Set general matplotlib parameters for cleaner plots
-plt.rcParams.update({
-    'font.size': 12,                    # Larger base font size
-    'axes.titlesize': 16,               # Large title
-    'axes.labelsize': 14,               # Clear axis labels
-    'xtick.labelsize': 12,              # Readable tick labels
-    'ytick.labelsize': 12,
-    'legend.fontsize': 12,              # Readable legend
-    'axes.spines.top': False,           # Remove top border
-    'axes.spines.right': False,         # Remove right border
-    'axes.grid': True,                  # Add light grid
-    'grid.alpha': 0.3,                  # Make grid subtle
-    'figure.figsize': FIG_SIZE,         # Consistent figure size
-    'figure.dpi': 100,                  # Screen display DPI
-    'savefig.dpi': DPI                  # Higher DPI for saved figures
-})
-
-def visualize_data():
+# How the charts are saved: resolution, whether images are cropped to the
+# tight bounding box (one extra layout draw per chart), the PNG zlib level and
+# an optional vector copy ('svg' or 'pdf') next to each PNG
+RenderProfile = namedtuple('RenderProfile', ['dpi', 'tight', 'png_compression', 'vector'])
+RENDER_PROFILES = {
+    'production': RenderProfile(dpi=DPI, tight=True, png_compression=6, vector=None),
+    # Screen resolution, uncropped, fastest compression: for iterating on charts
+    'preview': RenderProfile(dpi=100, tight=False, png_compression=1, vector=None),
+}
+VECTOR_FORMATS = ('svg', 'pdf')
+
+# Profile every chart is saved with; set by set_render_profile
+render_profile = RENDER_PROFILES['production']
+
+# V5 switches from a scatter to binned density above this many rows; the bins
+# are one score point wide and centered on the integer scores
+SCATTER_MAX_POINTS = 50_000
+SCORE_BIN_EDGES = np.arange(-0.5, 101, 1.0)
+
+def configure_plotting():
+    """Import the plotting libraries and apply the shared style (once per process)."""
+    global plt, sns, stats, cbook
+    if plt is not None:
+        return
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from scipy import stats
+    from matplotlib import cbook
+    
+    # Set the style for all plots
+    plt.style.use('seaborn-v0_8-whitegrid')
+    sns.set_context("talk")
+    
+    # Set general matplotlib parameters for cleaner plots
+    plt.rcParams.update({
+        'font.size': 12,                    # Larger base font size
+        'axes.titlesize': 16,               # Large title
+        'axes.labelsize': 14,               # Clear axis labels
+        'xtick.labelsize': 12,              # Readable tick labels
+        'ytick.labelsize': 12,
+        'legend.fontsize': 12,              # Readable legend
+        'axes.spines.top': False,           # Remove top border
+        'axes.spines.right': False,         # Remove right border
+        'axes.grid': True,                  # Add light grid
+        'grid.alpha': 0.3,                  # Make grid subtle
+        'figure.figsize': FIG_SIZE,         # Consistent figure size
+        'figure.dpi': 100,                  # Screen display DPI
+        'savefig.dpi': DPI                  # Higher DPI for saved figures
+    })
+
+def set_render_profile(name='production', vector=None):
+    """Save every chart with RENDER_PROFILES[name], plus a vector copy if vector is given."""
+    global render_profile
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile: {name}")
+    if vector not in (None,) + VECTOR_FORMATS:
+        raise ValueError(f"Unknown vector format: {vector}")
+    profile = RENDER_PROFILES[name]._replace(vector=vector)
+    if profile != render_profile:
+        # Templates are laid out for the profile they were first saved with
+        figure_templates.clear()
+        render_profile = profile
+    return profile
+
+def visualize_data(df=None, workers=1, facets=(), force=False, append=False, resamples=0,
+                   render='production', vector=None):
+    """Create all five visualizations.
+
+    If df is given (e.g. the frame returned by process_data), it is used instead
+    of loading the processed Parquet file.
+
+    The group means, variances and t-tests of the charts and findings are
+    answered from the AggregateCube the processing stage saved (built from
+    the rows if it does not cover the processed files). The per-group
+    correlation matrices are saved next to the processed data. With append, df holds only the rows
+    process_data(append=True) just added to the store: their GroupSums are
+    merged into the saved ones instead of recomputing them over the history
+    (which happens if the saved sums do not cover the rest of the store). The
+    charts still draw every row, so the whole store is loaded for them.
+
+    With facets (column names), the five visualizations and a findings file
+    are also rendered for every combination of their values by
+    visualize_facets, from the same loaded data.
+
+    With workers > 1 the plots are rendered in a pool of forked worker
+    processes that share df copy-on-write (0 means one worker per CPU). Where
+    fork is unavailable, or the pool fails, the plots are rendered serially.
+
+    With resamples, the comparisons the plots annotate get bootstrap
+    confidence intervals and permutation p-values from that many resamples
+    (see significance_tests), written to reports/significance.md and to each
+    facet's findings.
+
+    render names the render profile of the charts (see RENDER_PROFILES):
+    'production' for 300 DPI cropped images, 'preview' for fast low-resolution
+    ones. With vector ('svg' or 'pdf'), every chart is also saved in that format.
+    """
     print("Stage 3: Data Visualization")
-    
-    # Load processed data
-    df = pd.read_csv(processed_data_path)
-    print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
+    configure_plotting()
+    set_render_profile(render, vector)
+    
+    files = incremental.processed_files(processed_data_path, appends_path)
+    sums = None
+    if append:
+        sums = incremental.load_statistics(statistics_path, files[:-1])
+        if sums is None:
+            print("Saved group sums do not cover the processed data; recomputing them")
+        else:
+            with profiling.step('merge_group_sums', rows_in=len(df)):
+                sums.merge(GroupSums.of(df))
+            print(f"Merged the group sums of {df.shape[0]} new records")
+        df = None
+    
+    # Load processed data unless the upstream stage handed it over
+    if df is None:
+        df = load_processed()
+        print(f"Loaded {df.shape[0]} records with {df.shape[1]} variables")
+    else:
+        print(f"Received {df.shape[0]} records with {df.shape[1]} variables from processing")
     
     # Create reports directory if it doesn't exist
     os.makedirs(reports_path, exist_ok=True)
     
-    # A. V1 - Gender boxplots (math vs reading)
-    print("\nCreating Visualization 1: Gender boxplots")
-    v1_path = os.path.join(reports_path, 'V1_gender_boxplots.png')
-    create_gender_boxplots(df, v1_path)
-    
-    # B. V2 - Test prep impact on math
-    print("Creating Visualization 2: Test prep impact on math")
-    v2_path = os.path.join(reports_path, 'V2_test_prep_math.png')
-    create_test_prep_impact(df, v2_path)
-    
-    # C. V3 - Lunch type and average performance
-    print("Creating Visualization 3: Lunch type and performance")
-    v3_path = os.path.join(reports_path, 'V3_lunch_performance.png')
-    create_lunch_performance(df, v3_path)
-    
-    # D. V4 - Subject correlations
-    print("Creating Visualization 4: Subject correlations")
-    v4_path = os.path.join(reports_path, 'V4_subject_correlations.png')
-    create_subject_correlations(df, v4_path)
-    
-    # E. V5 - Math vs reading with trend lines by test prep
-    print("Creating Visualization 5: Math vs reading scatter")
-    v5_path = os.path.join(reports_path, 'V5_math_reading_scatter.png')
-    create_math_reading_scatter(df, v5_path)
+    cube = incremental.load_statistics(cube_path, files)
+    if cube is None:
+        print("Saved aggregate cube does not cover the processed data; building it from the rows")
+    
+    # Group index, aggregate cube and co-moments shared by all plots
+    with profiling.step('group_stats', rows_in=len(df)):
+        group_stats = GroupStats(df, sums=sums, cube=cube)
+    if cube is not None and group_stats.cube is not cube:
+        print("Saved aggregate cube is not of the given data; built it from the rows")
+    incremental.save_statistics(statistics_path, group_stats.sums, files)
+    with profiling.step('score_fits'):
+        group_stats.fits().to_csv(fits_path, index=False)
+    print(f"Score-pair fits of every group level saved to {fits_path}")
+    
+    jobs = [(title, func, os.path.join(reports_path, filename))
+            for title, func, filename in visualizations()]
+    
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if not (workers > 1 and render_parallel(df, group_stats, jobs, workers)):
+        print()
+        for title, func, save_path in jobs:
+            print(f"Creating {title}")
+            with profiling.step(func.__name__, rows_in=len(df)):
+                func(df, save_path, group_stats)
     
     print("\nAll visualizations created successfully")
+    
+    if resamples:
+        print(f"\nResampling the plotted comparisons {resamples} times...")
+        with profiling.step('resampling', rows_in=len(df)):
+            tests = significance_tests(group_stats, resamples, workers)
+        with open(significance_path, 'w') as f:
+            f.write('\n'.join(["# Student Performance: Resampling Significance Tests", ""] +
+                               significance_lines(tests)) + '\n')
+        print(f"Significance tests saved to {significance_path}")
+    
+    if facets:
+        print()
+        visualize_facets(df, facets, workers=workers, force=force, resamples=resamples,
+                         cube=group_stats.cube)
     return True
 
 
-def create_gender_boxplots(df, save_path):
+def load_processed():
+    """The processed data: the Parquet file plus any appended parts, in order."""
+    with profiling.step('load_parquet') as record:
+        frames = [pd.read_parquet(path, memory_map=True)
+                  for path in incremental.processed_files(processed_data_path, appends_path)]
+        df = frames[0] if len(frames) == 1 else partitioned.concat_partitions(frames)
+        record['rows_out'] = len(df)
+    return df
+
+
+def visualizations():
+    """A-E. V1-V5: (title, function that draws it, file name)."""
+    return [
+        ("Visualization 1: Gender boxplots", create_gender_boxplots, 'V1_gender_boxplots.png'),
+        ("Visualization 2: Test prep impact on math", create_test_prep_impact, 'V2_test_prep_math.png'),
+        ("Visualization 3: Lunch type and performance", create_lunch_performance, 'V3_lunch_performance.png'),
+        ("Visualization 4: Subject correlations", create_subject_correlations, 'V4_subject_correlations.png'),
+        ("Visualization 5: Math vs reading scatter", create_math_reading_scatter, 'V5_math_reading_scatter.png'),
+    ]
+
+
+# Set by the pool initializer in each worker process
+_worker_df = None
+_worker_group_stats = None
+
+def _init_render_worker(df, group_stats):
+    global _worker_df, _worker_group_stats
+    _worker_df = df
+    _worker_group_stats = group_stats
+
+def _render_in_worker(func_name, save_path):
+    with profiling.step(func_name, rows_in=len(_worker_df)):
+        globals()[func_name](_worker_df, save_path, _worker_group_stats)
+    return save_path
+
+def render_parallel(df, group_stats, jobs, workers):
+    """Render jobs in a process pool; returns False if the caller should go serial.
+
+    The pool uses the fork start method so each worker inherits df from the
+    parent instead of receiving a pickled copy per task.
+    """
+    if 'fork' not in mp.get_all_start_methods():
+        print("\nParallel rendering needs the 'fork' start method; rendering serially")
+        return False
+    
+    workers = min(workers, len(jobs))
+    print(f"\nRendering {len(jobs)} visualizations with {workers} worker processes")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('fork'),
+                                 initializer=_init_render_worker, initargs=(df, group_stats)) as pool:
+            futures = {pool.submit(_render_in_worker, func.__name__, save_path): title
+                       for title, func, save_path in jobs}
+            for future in as_completed(futures):
+                future.result()
+                print(f"Finished {futures[future]}")
+    except (OSError, BrokenProcessPool) as e:
+        print(f"Parallel rendering failed ({e}); rendering serially")
+        return False
+    return True
+
+
+def visualize_facets(df=None, facets=(), workers=1, force=False, resamples=0, cube=None):
+    """Render V1-V5 and a findings file for every combination of the facet columns.
+
+    The processed data is loaded once (unless df is given) and split by the
+    facet columns; facet "col1=a__col2=b" is written to
+    reports/facets/col1=a__col2=b/. A facet whose rows, plotting code and
+    resamples setting hash to the same value as in the last batch, and whose files are all there, is
+    skipped unless force is set.
+
+    With workers > 1 the facets are rendered in a pool of forked worker
+    processes (0 means one per CPU); each worker reuses its figure templates
+    from one facet to the next.
+
+    If every facet column is a dimension of cube (the AggregateCube of df),
+    each facet's means and t-tests are read from a where() view of it
+    instead of a cube of the facet's rows.
+
+    Returns {facet name: 'rendered' or 'unchanged'}.
+    """
+    global _facet_frame, _facet_cube
+    print(f"Faceted reports by {' × '.join(facets)}")
+    configure_plotting()
+    facets = list(facets)
+    
+    if df is None:
+        df = load_processed()
+    unknown = [col for col in facets if col not in df.columns]
+    if unknown:
+        raise ValueError(f"Unknown facet column(s): {', '.join(unknown)}")
+    
+    # Row positions of every facet from one groupby, and a hash of its rows
+    # and of the code that draws it
+    code_digest = ''.join(file_digest(path) for path in module_files(__file__))
+    code_digest += f'resamples={resamples}{render_profile}'
+    with profiling.step('partition_facets', rows_in=len(df)):
+        groups = df.groupby(facets, observed=True, sort=True).indices
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        jobs = []
+        for values, positions in groups.items():
+            values = values if isinstance(values, tuple) else (values,)
+            name = facet_name(facets, values)
+            digest = hashlib.sha256(code_digest.encode())
+            digest.update(row_hashes[positions].tobytes())
+            title = ', '.join(f'{col} = {value}' for col, value in zip(facets, values))
+            jobs.append((name, title, positions, digest.hexdigest(), dict(zip(facets, values))))
+    
+    manifest = {}
+    if os.path.exists(facet_manifest_path):
+        with open(facet_manifest_path) as f:
+            manifest = json.load(f)
+    filenames = [filename for _, _, filename in visualizations()] + ['visualization_findings.md']
+    if render_profile.vector:
+        filenames += [f'{os.path.splitext(filename)[0]}.{render_profile.vector}'
+                      for _, _, filename in visualizations()]
+    status = {}
+    todo = []
+    for name, title, positions, digest, filters in jobs:
+        facet_dir = os.path.join(facets_path, name)
+        if (not force and manifest.get(name, {}).get('hash') == digest
+                and all(os.path.exists(os.path.join(facet_dir, filename)) for filename in filenames)):
+            status[name] = 'unchanged'
+        else:
+            todo.append((name, title, positions, filters))
+    print(f"{len(jobs)} facets: {len(todo)} to render, {len(jobs) - len(todo)} unchanged")
+    
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    # Workers inherit the frame and cube through fork instead of receiving pickled subsets
+    _facet_frame = df
+    _facet_cube = cube if cube is not None and all(col in cube.dimensions for col in facets) else None
+    try:
+        with profiling.step('render_facets', rows_in=len(df)):
+            for name in partitioned.map_partitions(_render_facet, todo, workers, resamples):
+                status[name] = 'rendered'
+    finally:
+        _facet_frame = None
+        _facet_cube = None
+    
+    os.makedirs(facets_path, exist_ok=True)
+    manifest = {name: {'hash': digest, 'rows': len(positions)} for name, _, positions, digest, _ in jobs}
+    tmp_path = facet_manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, facet_manifest_path)
+    print(f"Faceted reports saved to {facets_path}")
+    return status
+
+
+def facet_name(facets, values):
+    """Directory name of a facet, e.g. lunch=free_reduced__gender=male."""
+    return '__'.join(f"{col}={re.sub(r'[^A-Za-z0-9._-]+', '_', str(value))}"
+                     for col, value in zip(facets, values))
+
+
+# Frame the facet jobs index into, and the cube their filters select from
+# (None if the facet columns are not all cube dimensions); set before the
+# pool forks
+_facet_frame = None
+_facet_cube = None
+
+def _render_facet(job, resamples=0):
+    """Worker: draw V1-V5 and write the findings of one facet."""
+    name, title, positions, filters = job
+    facet_dir = os.path.join(facets_path, name)
+    os.makedirs(facet_dir, exist_ok=True)
+    df = _facet_frame.iloc[positions].reset_index(drop=True)
+    with profiling.step('render_facet', rows_in=len(df)):
+        group_stats = GroupStats(df, cube=None if _facet_cube is None else _facet_cube.where(**filters))
+        for _, func, filename in visualizations():
+            func(df, os.path.join(facet_dir, filename), group_stats)
+        tests = significance_tests(group_stats, resamples) if resamples else None
+        write_findings(df, group_stats, os.path.join(facet_dir, 'visualization_findings.md'), title, tests)
+    return name
+
+
+def write_findings(df, group_stats, path, title, tests=None):
+    """Write the findings of one facet: each chart with the numbers it shows.
+
+    tests (from significance_tests) adds their table.
+    """
+    scores = ['math_score', 'reading_score']
+    gender_tests = {col: group_stats.ttest('gender', 'male', 'female', col) for col in scores}
+    prep_test = group_stats.ttest('test_preparation_course', 'completed', 'none', 'math_score')
+    lunch_test = group_stats.ttest('lunch', 'standard', 'free/reduced', 'overall_avg')
+    corr = group_stats.corr(['math_score', 'reading_score', 'writing_score'])
+    
+    lines = [
+        f"# Student Performance Findings: {title}",
+        "",
+        f"{len(df)} students.",
+        "",
+        "## Visualization 1: Gender Differences in Math vs Reading Scores",
+        "",
+        "![Gender Differences in Math vs Reading Scores](V1_gender_boxplots.png)",
+        "",
+    ]
+    for col in scores:
+        subject = col.replace('_score', '').capitalize()
+        lines.append(f"- {subject}: female mean {group_stats.mean('gender', 'female', col):.1f}, "
+                     f"male mean {group_stats.mean('gender', 'male', col):.1f} "
+                     f"(p={gender_tests[col].pvalue:.4f})")
+    lines += [
+        "",
+        "## Visualization 2: Test Preparation Impact on Math Scores",
+        "",
+        "![Test Preparation Impact on Math Scores](V2_test_prep_math.png)",
+        "",
+        f"- Math mean with test preparation {group_stats.mean('test_preparation_course', 'completed', 'math_score'):.1f}, "
+        f"without {group_stats.mean('test_preparation_course', 'none', 'math_score'):.1f} "
+        f"(p={prep_test.pvalue:.4f})",
+        "",
+        "## Visualization 3: Lunch Type and Average Test Performance",
+        "",
+        "![Lunch Type and Average Test Performance](V3_lunch_performance.png)",
+        "",
+        f"- Overall average with standard lunch {group_stats.mean('lunch', 'standard', 'overall_avg'):.1f}, "
+        f"with free/reduced lunch {group_stats.mean('lunch', 'free/reduced', 'overall_avg'):.1f} "
+        f"(p={lunch_test.pvalue:.4f})",
+        "",
+        "## Visualization 4: Subject Score Correlations",
+        "",
+        "![Subject Score Correlations](V4_subject_correlations.png)",
+        "",
+        f"- Math-Reading r={corr.loc['math_score', 'reading_score']:.2f}, "
+        f"Math-Writing r={corr.loc['math_score', 'writing_score']:.2f}, "
+        f"Reading-Writing r={corr.loc['reading_score', 'writing_score']:.2f}",
+        "",
+        "## Visualization 5: Math vs Reading Scores by Test Preparation",
+        "",
+        "![Math vs Reading Scores by Test Preparation](V5_math_reading_scatter.png)",
+        "",
+    ]
+    for group in group_stats.unique('test_preparation_course'):
+        fit = group_stats.fit('test_preparation_course', group, 'reading_score', 'math_score')
+        lines.append(f"- {group} (n={fit['count']}): R² = {fit['r_squared']:.2f}, "
+                     f"math = {fit['slope']:.2f} × reading {'-' if fit['intercept'] < 0 else '+'} "
+                     f"{abs(fit['intercept']):.1f} (p={fit['pvalue']:.4f})")
+    if tests:
+        lines += ["", "## Resampling Significance Tests", ""] + significance_lines(tests)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def significance_tests(group_stats, n_resamples, workers=1):
+    """Bootstrap intervals and permutation p-values of what V1, V2, V3 and V5 compare.
+
+    Returns [(label, statistic, ResamplingResult)]: the group mean
+    differences behind the t-test p-values of V1-V3, and the math/reading
+    correlation of each test-preparation group in V5.
+    """
+    comparisons = [
+        ('V1 math: male - female', 'gender', 'male', 'female', 'math_score'),
+        ('V1 reading: male - female', 'gender', 'male', 'female', 'reading_score'),
+        ('V2 math: completed - none', 'test_preparation_course', 'completed', 'none', 'math_score'),
+        ('V3 overall average: standard - free/reduced', 'lunch', 'standard', 'free/reduced', 'overall_avg'),
+    ]
+    tests = []
+    for label, group, level_a, level_b, column in comparisons:
+        if group not in group_stats.levels:
+            continue
+        result = resampling.mean_difference(group_stats.subset(group, level_a, column),
+                                            group_stats.subset(group, level_b, column),
+                                            n_resamples, workers=workers)
+        tests.append((label, 'mean difference', result))
+    if 'test_preparation_course' in group_stats.levels:
+        for level in group_stats.unique('test_preparation_course'):
+            result = resampling.correlation(group_stats.subset('test_preparation_course', level, 'reading_score'),
+                                            group_stats.subset('test_preparation_course', level, 'math_score'),
+                                            n_resamples, workers=workers)
+            tests.append((f'V5 math ~ reading: {level}', 'r', result))
+    return tests
+
+
+def significance_lines(tests):
+    """Markdown table of significance_tests results."""
+    n_resamples = max((result.n_resamples for _, _, result in tests), default=0)
+    lines = [f"{n_resamples} bootstrap resamples (95% percentile interval) and {n_resamples} permutations "
+             "(two-sided p-value) per comparison.",
+             "",
+             "| Comparison | Statistic | Estimate | 95% CI | Permutation p |",
+             "| :--- | :--- | ---: | ---: | ---: |"]
+    for label, statistic, result in tests:
+        marker = ' (t)' if result.null == 't' else ''
+        lines.append(f"| {label} | {statistic} | {result.estimate:.3f} | "
+                     f"[{result.ci_low:.3f}, {result.ci_high:.3f}] | {result.pvalue:.4f}{marker} |")
+    if any(result.null == 't' for _, _, result in tests):
+        lines += ["", "(t): too many rows to shuffle; the p-value is the t test's for r."]
+    return lines
+
+
+def save_figure(template, save_path):
+    """Save a template's figure with the render profile, using its precomputed layout."""
+    profile = render_profile
+    with profiling.step('savefig'):
+        template.save(save_path, profile.dpi, pil_kwargs={'compress_level': profile.png_compression})
+        if profile.vector:
+            template.save(f'{os.path.splitext(save_path)[0]}.{profile.vector}', profile.dpi)
+
+
+def template_key(chart, group_stats, column, *extra):
+    """Templates are per chart and per set (and order) of the groups it draws."""
+    return (chart, tuple(group_stats.levels[column]), tuple(group_stats.unique(column))) + extra
+
+
+def create_gender_boxplots(df, save_path, group_stats=None):
     """A. V1 - Gender boxplots (math vs reading)"""
+    configure_plotting()
+    if group_stats is None:
+        group_stats = GroupStats(df)
     
-    # Prepare data for plotting
-    math_by_gender = df[['gender', 'math_score']].copy()
-    math_by_gender['subject'] = 'Math'
-    math_by_gender.rename(columns={'math_score': 'score'}, inplace=True)
+    # Means for both genders come from the group table
+    columns = ['math_score', 'reading_score']
+    means = [(subject_idx + offset, group_stats.mean('gender', gender, column))
+             for subject_idx, column in enumerate(columns)
+             for gender, offset in [('female', -0.2), ('male', 0.2)]]
     
-    reading_by_gender = df[['gender', 'reading_score']].copy()
-    reading_by_gender['subject'] = 'Reading'
-    reading_by_gender.rename(columns={'reading_score': 'score'}, inplace=True)
-    
-    plot_data = pd.concat([math_by_gender, reading_by_gender])
-    
-    # Create the plot
-    plt.figure()
-    
-    # Create boxplot with consistent color mapping
-    sns.boxplot(x='subject', y='score', hue='gender', data=plot_data, 
-               palette={'female': '#e74c3c', 'male': '#3498db'}, linewidth=1.5)
+    # Simplified statistical annotation
+    math_ttest = group_stats.ttest('gender', 'male', 'female', 'math_score')
+    reading_ttest = group_stats.ttest('gender', 'male', 'female', 'reading_score')
+    stat_text = f"Math: p={math_ttest.pvalue:.4f} | Reading: p={reading_ttest.pvalue:.4f}"
     
-    # Calculate and display means
-    for subject in ['Math', 'Reading']:
-        subject_idx = 0 if subject == 'Math' else 1
+    key = template_key('V1', group_stats, 'gender')
+    template = figure_templates.get(key)
+    if template is None:
+        # Prepare data for plotting
+        math_by_gender = df[['gender', 'math_score']].copy()
+        math_by_gender['subject'] = 'Math'
+        math_by_gender.rename(columns={'math_score': 'score'}, inplace=True)
+        
+        reading_by_gender = df[['gender', 'reading_score']].copy()
+        reading_by_gender['subject'] = 'Reading'
+        reading_by_gender.rename(columns={'reading_score': 'score'}, inplace=True)
+        
+        plot_data = pd.concat([math_by_gender, reading_by_gender])
         
-        # Calculate means for both genders
-        male_subset = plot_data[(plot_data['subject'] == subject) & (plot_data['gender'] == 'male')]
-        female_subset = plot_data[(plot_data['subject'] == subject) & (plot_data['gender'] == 'female')]
+        # Create the plot
+        plt.figure()
         
-        male_mean = male_subset['score'].mean()
-        female_mean = female_subset['score'].mean()
+        # Create boxplot with consistent color mapping
+        ax = sns.boxplot(x='subject', y='score', hue='gender', data=plot_data, 
+                        palette={'female': '#e74c3c', 'male': '#3498db'}, linewidth=1.5)
         
         # Position text labels
-        plt.text(subject_idx - 0.2, female_mean + 3, f'{female_mean:.1f}', 
-              ha='center', va='bottom', fontweight='bold', fontsize=12)
-        plt.text(subject_idx + 0.2, male_mean + 3, f'{male_mean:.1f}', 
-              ha='center', va='bottom', fontweight='bold', fontsize=12)
-    
-    # Customize plot
-    plt.title('Gender Differences: Math vs Reading Scores')
-    plt.xlabel('Subject')
-    plt.ylabel('Score')
-    plt.ylim(0, 100)
-    
-    # Simplified statistical annotation
-    math_male = df[df['gender'] == 'male']['math_score']
-    math_female = df[df['gender'] == 'female']['math_score']
-    reading_male = df[df['gender'] == 'male']['reading_score']
-    reading_female = df[df['gender'] == 'female']['reading_score']
-    
-    math_ttest = stats.ttest_ind(math_male, math_female)
-    reading_ttest = stats.ttest_ind(reading_male, reading_female)
-    
-    stat_text = f"Math: p={math_ttest.pvalue:.4f} | Reading: p={reading_ttest.pvalue:.4f}"
-    plt.annotate(stat_text, xy=(0.5, 0.01), xycoords='figure fraction', 
-               ha='center', fontsize=11, bbox=dict(facecolor='white', alpha=0.8))
-    
-    # Enhance legend
-    plt.legend(title=None, loc='upper right')
+        mean_labels = [plt.text(x, mean + 3, f'{mean:.1f}', 
+                             ha='center', va='bottom', fontweight='bold', fontsize=12)
+                       for x, mean in means]
+        
+        # Customize plot
+        plt.title('Gender Differences: Math vs Reading Scores')
+        plt.xlabel('Subject')
+        plt.ylabel('Score')
+        plt.ylim(0, 100)
+        
+        stat_label = plt.annotate(stat_text, xy=(0.5, 0.01), xycoords='figure fraction', 
+                                ha='center', fontsize=11, bbox=dict(facecolor='white', alpha=0.8))
+        
+        # Enhance legend
+        plt.legend(title=None, loc='upper right')
+        
+        plt.tight_layout()
+        template = figure_templates.add(key, plt.gcf(), render_profile.dpi, render_profile.tight,
+                                        boxes=list(ax.containers),
+                                        mean_labels=mean_labels, stat_label=stat_label)
+    else:
+        # One box container per gender, in hue order, with a box per subject
+        genders = [gender for gender in group_stats.levels['gender'] if group_stats.count('gender', gender)]
+        for container, gender in zip(template.artists['boxes'], genders):
+            figure_templates.set_boxes(container, cbook.boxplot_stats(
+                [group_stats.subset('gender', gender, column) for column in columns]))
+        for label, (_, mean) in zip(template.artists['mean_labels'], means):
+            figure_templates.set_text(label, f'{mean:.1f}', mean + 3)
+        figure_templates.set_text(template.artists['stat_label'], stat_text)
     
     # Save the figure
-    plt.tight_layout()
-    plt.savefig(save_path, dpi=DPI, bbox_inches='tight')
-    plt.close()
+    save_figure(template, save_path)
     
     print(f"Saved visualization to {save_path}")
 
 
-def create_test_prep_impact(df, save_path):
+def create_test_prep_impact(df, save_path, group_stats=None):
     """B. V2 - Test prep impact on math"""
-    
-    plt.figure()
-    
-    # Create simpler boxplots instead of violin plots for clarity
-    # Fix the FutureWarning by properly using hue instead of palette directly
-    sns.boxplot(x='test_preparation_course', y='math_score', 
-              data=df, hue='test_preparation_course', 
-              palette=['#2ecc71', '#f39c12'], 
-              order=['completed', 'none'], legend=False,
-              width=0.6, linewidth=1.5)
+    configure_plotting()
+    if group_stats is None:
+        group_stats = GroupStats(df)
     
     # Calculate and display means more clearly
     courses = ['completed', 'none']
-    for i, course in enumerate(courses):
-        mean_score = df[df['test_preparation_course'] == course]['math_score'].mean()
-        plt.text(i, mean_score + 2, f'{mean_score:.1f}', 
-              ha='center', va='bottom', fontweight='bold', fontsize=14,
-              color='black')
+    means = [group_stats.mean('test_preparation_course', course, 'math_score') for course in courses]
     
     # Add statistical test
-    completed = df[df['test_preparation_course'] == 'completed']['math_score']
-    none = df[df['test_preparation_course'] == 'none']['math_score']
-    ttest_result = stats.ttest_ind(completed, none)
-    
-    # Customize plot
-    plt.title('Impact of Test Preparation on Math Score')
-    plt.xlabel('Test Preparation')
-    plt.ylabel('Math Score')
-    plt.ylim(0, 100)
+    ttest_result = group_stats.ttest('test_preparation_course', 'completed', 'none', 'math_score')
     
-    # Add clearer statistical annotation
-    plt.annotate(f"p={ttest_result.pvalue:.4f}", 
-               xy=(0.5, 0.01), xycoords='figure fraction', 
-               ha='center', fontsize=11, bbox=dict(facecolor='white', alpha=0.8))
+    key = template_key('V2', group_stats, 'test_preparation_course')
+    template = figure_templates.get(key)
+    if template is None:
+        plt.figure()
+        
+        # Create simpler boxplots instead of violin plots for clarity
+        # Fix the FutureWarning by properly using hue instead of palette directly
+        # (hue_order/dodge keep the colors and box positions the same whether the
+        # column arrives as strings or as a category dtype)
+        ax = sns.boxplot(x='test_preparation_course', y='math_score', 
+                        data=df, hue='test_preparation_course', 
+                        palette=['#2ecc71', '#f39c12'], 
+                        order=courses, legend=False,
+                        hue_order=group_stats.unique('test_preparation_course'), dodge=False,
+                        width=0.6, linewidth=1.5)
+        
+        mean_labels = [plt.text(i, mean_score + 2, f'{mean_score:.1f}', 
+                             ha='center', va='bottom', fontweight='bold', fontsize=14,
+                             color='black')
+                       for i, mean_score in enumerate(means)]
+        
+        # Customize plot
+        plt.title('Impact of Test Preparation on Math Score')
+        plt.xlabel('Test Preparation')
+        plt.ylabel('Math Score')
+        plt.ylim(0, 100)
+        
+        # Add clearer statistical annotation
+        stat_label = plt.annotate(f"p={ttest_result.pvalue:.4f}", 
+                                xy=(0.5, 0.01), xycoords='figure fraction', 
+                                ha='center', fontsize=11, bbox=dict(facecolor='white', alpha=0.8))
+        
+        plt.tight_layout()
+        template = figure_templates.add(key, plt.gcf(), render_profile.dpi, render_profile.tight,
+                                        boxes=list(ax.containers),
+                                        mean_labels=mean_labels, stat_label=stat_label)
+    else:
+        # One single-box container per course, in hue (first appearance) order
+        for container, course in zip(template.artists['boxes'], group_stats.unique('test_preparation_course')):
+            figure_templates.set_boxes(container, cbook.boxplot_stats(
+                [group_stats.subset('test_preparation_course', course, 'math_score')]))
+        for label, mean_score in zip(template.artists['mean_labels'], means):
+            figure_templates.set_text(label, f'{mean_score:.1f}', mean_score + 2)
+        figure_templates.set_text(template.artists['stat_label'], f"p={ttest_result.pvalue:.4f}")
     
     # Save the figure
-    plt.tight_layout()
-    plt.savefig(save_path, dpi=DPI, bbox_inches='tight')
-    plt.close()
+    save_figure(template, save_path)
     
     print(f"Saved visualization to {save_path}")
 
 
-def create_lunch_performance(df, save_path):
+def create_lunch_performance(df, save_path, group_stats=None):
     """C. V3 - Lunch type and average performance"""
+    configure_plotting()
+    if group_stats is None:
+        group_stats = GroupStats(df)
     
     # Prepare data for plotting
     subjects = ['math_score', 'reading_score', 'writing_score']
-    means = df.groupby('lunch')[subjects].mean().reset_index()
+    means = group_stats.means('lunch', subjects).reset_index()
     
     # Reshape for grouped bar chart
     plot_data = pd.melt(means, id_vars='lunch', value_vars=subjects,
@@ -216,164 +695,265 @@ def create_lunch_performance(df, save_path):
     # Rename for better display
     plot_data['subject'] = plot_data['subject'].str.replace('_score', '').str.capitalize()
     
-    # Create the plot
-    plt.figure()
-    
-    # Create grouped bar chart with clearer colors
-    bar_colors = ['#3498db', '#2ecc71', '#9b59b6']  # Blue, green, purple
-    ax = sns.barplot(x='lunch', y='average_score', hue='subject', data=plot_data, 
-                   palette=bar_colors, edgecolor='white', linewidth=1)
-    
-    # Add simplified value labels on bars
-    for p in ax.patches:
-        height = p.get_height()
-        ax.annotate(f'{height:.0f}', 
-                  (p.get_x() + p.get_width() / 2., height + 0.5), 
-                  ha='center', va='bottom', fontweight='bold', fontsize=11)
-    
-    # Add overall average line for each lunch type
-    for i, lunch_type in enumerate(['free/reduced', 'standard']):
-        overall_avg = df[df['lunch'] == lunch_type]['overall_avg'].mean()
-        plt.axhline(y=overall_avg, xmin=i/2, xmax=(i+1)/2, 
-                  color='#e74c3c', linestyle='-', linewidth=2)
-        plt.text(i, overall_avg - 3, f'Avg: {overall_avg:.1f}', 
-              ha='center', va='top', color='black', fontweight='bold')
+    lunch_types = ['free/reduced', 'standard']
+    overall_avgs = [group_stats.mean('lunch', lunch_type, 'overall_avg') for lunch_type in lunch_types]
     
     # Statistical test
-    std_overall = df[df['lunch'] == 'standard']['overall_avg']
-    free_overall = df[df['lunch'] == 'free/reduced']['overall_avg']
-    ttest_result = stats.ttest_ind(std_overall, free_overall)
-    
-    # Customize plot
-    plt.title('Average Scores by Lunch Type')
-    plt.xlabel('Lunch Type')
-    plt.ylabel('Score')
-    plt.ylim(0, 85)
+    ttest_result = group_stats.ttest('lunch', 'standard', 'free/reduced', 'overall_avg')
     
-    # Clean up legend
-    plt.legend(title=None, loc='upper right', frameon=True, framealpha=0.9)
-    
-    # Create t-test
-    ttest_result = stats.ttest_ind(std_overall, free_overall)
-
-    # Add clearer statistical annotation
-    plt.annotate(f"p={ttest_result.pvalue:.4f}", 
-               xy=(0.5, 0.01), xycoords='figure fraction', 
-               ha='center', fontsize=11,
-               bbox=dict(facecolor='white', alpha=0.8))
+    key = template_key('V3', group_stats, 'lunch')
+    template = figure_templates.get(key)
+    if template is None:
+        # Create the plot
+        plt.figure()
+        
+        # Create grouped bar chart with clearer colors
+        bar_colors = ['#3498db', '#2ecc71', '#9b59b6']  # Blue, green, purple
+        ax = sns.barplot(x='lunch', y='average_score', hue='subject', data=plot_data, 
+                       palette=bar_colors, edgecolor='white', linewidth=1)
+        
+        # Add simplified value labels on bars
+        bar_labels = []
+        for p in ax.patches:
+            height = p.get_height()
+            bar_labels.append(ax.annotate(f'{height:.0f}', 
+                                          (p.get_x() + p.get_width() / 2., height + 0.5), 
+                                          ha='center', va='bottom', fontweight='bold', fontsize=11))
+        
+        # Add overall average line for each lunch type
+        avg_lines = []
+        avg_labels = []
+        for i, overall_avg in enumerate(overall_avgs):
+            avg_lines.append(plt.axhline(y=overall_avg, xmin=i/2, xmax=(i+1)/2, 
+                                         color='#e74c3c', linestyle='-', linewidth=2))
+            avg_labels.append(plt.text(i, overall_avg - 3, f'Avg: {overall_avg:.1f}', 
+                                       ha='center', va='top', color='black', fontweight='bold'))
+        
+        # Customize plot
+        plt.title('Average Scores by Lunch Type')
+        plt.xlabel('Lunch Type')
+        plt.ylabel('Score')
+        plt.ylim(0, 85)
+        
+        # Clean up legend
+        plt.legend(title=None, loc='upper right', frameon=True, framealpha=0.9)
+        
+        # Add clearer statistical annotation
+        stat_label = plt.annotate(f"p={ttest_result.pvalue:.4f}", 
+                                xy=(0.5, 0.01), xycoords='figure fraction', 
+                                ha='center', fontsize=11,
+                                bbox=dict(facecolor='white', alpha=0.8))
+        
+        plt.tight_layout()
+        template = figure_templates.add(key, plt.gcf(), render_profile.dpi, render_profile.tight,
+                                        bars=list(ax.containers),
+                                        bar_labels=bar_labels, avg_lines=avg_lines,
+                                        avg_labels=avg_labels, stat_label=stat_label)
+    else:
+        # One bar container per subject (hue), with a bar per lunch type (x),
+        # both in order of appearance in plot_data
+        bar_labels = iter(template.artists['bar_labels'])
+        for container, (_, bars) in zip(template.artists['bars'], plot_data.groupby('subject', sort=False)):
+            for bar, height, label in zip(container, bars['average_score'], bar_labels):
+                bar.set_height(height)
+                label.set_text(f'{height:.0f}')
+                label.xy = label.xyann = (bar.get_x() + bar.get_width() / 2., height + 0.5)
+        for line, label, overall_avg in zip(template.artists['avg_lines'], template.artists['avg_labels'],
+                                            overall_avgs):
+            line.set_ydata([overall_avg, overall_avg])
+            figure_templates.set_text(label, f'Avg: {overall_avg:.1f}', overall_avg - 3)
+        figure_templates.set_text(template.artists['stat_label'], f"p={ttest_result.pvalue:.4f}")
     
     # Save the figure
-    plt.tight_layout()
-    plt.savefig(save_path, dpi=DPI, bbox_inches='tight')
-    plt.close()
+    save_figure(template, save_path)
     
     print(f"Saved visualization to {save_path}")
 
 
-def create_subject_correlations(df, save_path):
+def create_subject_correlations(df, save_path, group_stats=None):
     """D. V4 - Subject correlations heatmap"""
+    configure_plotting()
     
     # Prepare data for correlation analysis
     subjects = ['math_score', 'reading_score', 'writing_score']
-    corr_matrix = df[subjects].corr()
+    if group_stats is not None:
+        # From the score-pair fits (the co-moments kept with the group sums)
+        corr_matrix = group_stats.corr(subjects)
+    else:
+        corr_matrix = df[subjects].corr()
     
     # Rename columns/index for display
     pretty_names = {'math_score': 'Math', 'reading_score': 'Reading', 'writing_score': 'Writing'}
     corr_matrix = corr_matrix.rename(index=pretty_names, columns=pretty_names)
-    
-    # Create the plot with square aspect ratio
-    plt.figure(figsize=(8, 6.5))
-    
-    # Create heatmap with improved readability
-    cmap = sns.diverging_palette(230, 20, as_cmap=True)
     mask = np.triu(np.ones_like(corr_matrix, dtype=bool))
+    upper = [(i, j) for i in range(len(corr_matrix)) for j in range(i+1, len(corr_matrix))]
     
-    sns.heatmap(
-        corr_matrix, 
-        annot=True,            # Show the correlation values
-        fmt='.2f',             # Simpler number format (2 decimal places)
-        cmap=cmap,             # Better color scheme
-        mask=mask,             # Show only half of the symmetric matrix
-        vmin=0.75, vmax=1.0,   # Focus scale on relevant range
-        square=True,           # Make cells square
-        linewidths=0.8,        # Thin lines between cells
-        annot_kws={"size": 14, "weight": "bold"},  # Make numbers more readable
-        cbar_kws={"shrink": .8, "label": "Correlation"}  # Improve colorbar
-    )
-    
-    # Add correlations as text for the upper triangle
-    for i in range(len(corr_matrix)):
-        for j in range(i+1, len(corr_matrix)):
-            plt.text(j+0.5, i+0.5, f'{corr_matrix.iloc[i, j]:.2f}',
-                  ha='center', va='center', color='black', fontweight='bold', fontsize=14)
-    
-    # Customize plot
-    plt.title('Subject Score Correlations')
-    
-    # Save the figure with tight layout
-    plt.tight_layout()
-    plt.savefig(save_path, dpi=DPI, bbox_inches='tight')
-    plt.close()
+    key = ('V4',)
+    template = figure_templates.get(key)
+    if template is None:
+        # Create the plot with square aspect ratio
+        plt.figure(figsize=(8, 6.5))
+        
+        # Create heatmap with improved readability
+        cmap = sns.diverging_palette(230, 20, as_cmap=True)
+        
+        ax = sns.heatmap(
+            corr_matrix, 
+            annot=True,            # Show the correlation values
+            fmt='.2f',             # Simpler number format (2 decimal places)
+            cmap=cmap,             # Better color scheme
+            mask=mask,             # Show only half of the symmetric matrix
+            vmin=0.75, vmax=1.0,   # Focus scale on relevant range
+            square=True,           # Make cells square
+            linewidths=0.8,        # Thin lines between cells
+            annot_kws={"size": 14, "weight": "bold"},  # Make numbers more readable
+            cbar_kws={"shrink": .8, "label": "Correlation"}  # Improve colorbar
+        )
+        # seaborn's labels of the unmasked (lower) cells, in row-major order
+        cell_labels = list(ax.texts)
+        
+        # Add correlations as text for the upper triangle
+        upper_labels = [plt.text(j+0.5, i+0.5, f'{corr_matrix.iloc[i, j]:.2f}',
+                                 ha='center', va='center', color='black', fontweight='bold', fontsize=14)
+                        for i, j in upper]
+        
+        # Customize plot
+        plt.title('Subject Score Correlations')
+        
+        plt.tight_layout()
+        template = figure_templates.add(key, plt.gcf(), render_profile.dpi, render_profile.tight,
+                                        mesh=ax.collections[0],
+                                        cell_labels=cell_labels, upper_labels=upper_labels)
+    else:
+        mesh = template.artists['mesh']
+        values = np.ma.masked_where(mask, corr_matrix.to_numpy())
+        mesh.set_array(values)
+        # Recolor seaborn's labels for contrast with their new cell colors
+        colors = mesh.to_rgba(values.compressed())
+        for label, value, color in zip(template.artists['cell_labels'], values.compressed(), colors):
+            label.set_text(f'{value:.2f}')
+            label.set_color('.15' if sns.utils.relative_luminance(color) > .408 else 'w')
+        for label, (i, j) in zip(template.artists['upper_labels'], upper):
+            label.set_text(f'{corr_matrix.iloc[i, j]:.2f}')
+    
+    # Save the figure with the precomputed tight layout
+    save_figure(template, save_path)
     
     print(f"Saved visualization to {save_path}")
 
 
-def create_math_reading_scatter(df, save_path):
-    """E. V5 - Math vs reading scatter with trend lines by test prep"""
-    
-    plt.figure()
-    
-    # Create scatter plot with clearer colors and better visibility
-    groups = df['test_preparation_course'].unique()
+def create_math_reading_scatter(df, save_path, group_stats=None, binned=None):
+    """E. V5 - Math vs reading scatter with trend lines by test prep
+
+    Above SCATTER_MAX_POINTS rows (or with binned=True) the points are drawn as
+    a per-group 2D density raster, so render time does not grow with the row
+    count. The trend lines are the groups' rows of group_stats.fits().
+    """
+    configure_plotting()
+    from matplotlib.markers import MarkerStyle
+    if group_stats is None:
+        group_stats = GroupStats(df)
+    if binned is None:
+        binned = len(df) > SCATTER_MAX_POINTS
+    if binned:
+        from matplotlib.colors import LinearSegmentedColormap, LogNorm, to_rgba
+        histograms = group_stats.histogram2d('test_preparation_course', 'reading_score',
+                                             'math_score', SCORE_BIN_EDGES)
+    
+    groups = group_stats.unique('test_preparation_course')
     colors = {'completed': '#2ecc71', 'none': '#e67e22'}
     markers = {'completed': 'o', 'none': 'x'}
     
+    key = template_key('V5', group_stats, 'test_preparation_course', binned)
+    template = figure_templates.get(key)
+    if template is None:
+        plt.figure()
+        points = []
+        fit_lines = []
+        fit_labels = []
+    
     # Plot each group with regression line
-    for group in groups:
-        subset = df[df['test_preparation_course'] == group]
-        
+    for i, group in enumerate(groups):
         # Count observations
-        n = len(subset)
+        n = group_stats.count('test_preparation_course', group)
         
-        # Calculate regression line
-        slope, intercept, r_value, p_value, std_err = stats.linregress(
-            subset['reading_score'], subset['math_score'])
+        # Regression line from the group's fit (undefined for a single reading
+        # score, e.g. in a small facet)
+        fit = group_stats.fit('test_preparation_course', group, 'reading_score', 'math_score')
+        slope, intercept, r_value = fit['slope'], fit['intercept'], fit['r']
         
-        # Plot scatter with reduced point size and increased clarity
-        plt.scatter(subset['reading_score'], subset['math_score'], 
-                  alpha=0.5, color=colors[group], s=40,
-                  marker=markers[group], edgecolor='none',
-                  label=f"{group} (n={n})")
+        if binned:
+            # Density raster from the binned counts
+            counts = histograms[group]
+            density = np.ma.masked_equal(counts.T, 0)
+            if template is None:
+                cmap = LinearSegmentedColormap.from_list(
+                    f'density_{group}', [to_rgba(colors[group], 0.15), to_rgba(colors[group], 0.9)])
+                points.append(plt.imshow(density, origin='lower', aspect='auto',
+                                         extent=(SCORE_BIN_EDGES[0], SCORE_BIN_EDGES[-1],
+                                                 SCORE_BIN_EDGES[0], SCORE_BIN_EDGES[-1]),
+                                         cmap=cmap, norm=LogNorm(), interpolation='nearest'))
+                plt.plot([], [], 's', color=colors[group], alpha=0.6, markersize=10,
+                       label=f"{group} (n={n})")
+            else:
+                image = template.artists['points'][i]
+                image.set_data(density)
+                image.autoscale()
+        else:
+            reading = group_stats.subset('test_preparation_course', group, 'reading_score')
+            math = group_stats.subset('test_preparation_course', group, 'math_score')
+            
+            if template is None:
+                # Plot scatter with reduced point size and increased clarity;
+                # unfilled markers (the 'x') are drawn by their edge, so only
+                # filled ones drop it
+                edge = {'edgecolor': 'none'} if MarkerStyle(markers[group]).is_filled() else {}
+                points.append(plt.scatter(reading, math, 
+                                          alpha=0.5, color=colors[group], s=40,
+                                          marker=markers[group], **edge,
+                                          label=f"{group} (n={n})"))
+            else:
+                template.artists['points'][i].set_offsets(np.column_stack([reading, math]))
         
         # Add regression line with increased width for visibility
         x = np.array([20, 100])
         y = intercept + slope * x
-        plt.plot(x, y, color=colors[group], linewidth=3)
         
         # Add simpler regression equation text
         text_x = 70
         text_y = intercept + slope * text_x + (8 if group == 'completed' else -8)
-        plt.text(text_x, text_y, f"R² = {r_value**2:.2f}", 
-               color=colors[group], fontweight='bold', fontsize=12, ha='center', 
-               bbox=dict(facecolor='white', alpha=0.9, edgecolor=colors[group], boxstyle='round,pad=0.3'))
-    
-    # Customize plot
-    plt.title('Math vs Reading Scores by Test Preparation')
-    plt.xlabel('Reading Score')
-    plt.ylabel('Math Score')
-    plt.xlim(20, 100)
-    plt.ylim(20, 100)
-    
-    # Create legend with clearer labels
-    legend = plt.legend(title=None, loc='lower right', 
-                      frameon=True, framealpha=0.9, edgecolor='gray')
-    
-    # Remove reference line - simplify the plot
+        if template is None:
+            fit_lines.append(plt.plot(x, y, color=colors[group], linewidth=3)[0])
+            fit_labels.append(plt.text(text_x, text_y, f"R² = {r_value**2:.2f}", 
+                                       color=colors[group], fontweight='bold', fontsize=12, ha='center', 
+                                       bbox=dict(facecolor='white', alpha=0.9, edgecolor=colors[group],
+                                                 boxstyle='round,pad=0.3')))
+        else:
+            template.artists['fit_lines'][i].set_ydata(y)
+            figure_templates.set_text(template.artists['fit_labels'][i], f"R² = {r_value**2:.2f}", text_y)
+            template.artists['legend'].get_texts()[i].set_text(f"{group} (n={n})")
+    
+    if template is None:
+        # Customize plot
+        plt.title('Math vs Reading Scores by Test Preparation')
+        plt.xlabel('Reading Score')
+        plt.ylabel('Math Score')
+        plt.xlim(20, 100)
+        plt.ylim(20, 100)
+        
+        # Create legend with clearer labels
+        legend = plt.legend(title=None, loc='lower right', 
+                          frameon=True, framealpha=0.9, edgecolor='gray')
+        
+        # Remove reference line - simplify the plot
+        
+        plt.tight_layout()
+        template = figure_templates.add(key, plt.gcf(), render_profile.dpi, render_profile.tight,
+                                        points=points, fit_lines=fit_lines,
+                                        fit_labels=fit_labels, legend=legend)
     
     # Save the figure
-    plt.tight_layout()
-    plt.savefig(save_path, dpi=DPI, bbox_inches='tight')
-    plt.close()
+    save_figure(template, save_path)
     
     print(f"Saved visualization to {save_path}")
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Figure templates
+- Keeps each chart's figure alive after its first render, keyed by the chart
+  and the shape of its data (which groups are drawn), with the styled axes,
+  legend and static annotations already in place
+- Later renders of the same chart for another data subset only update the
+  data artists (box paths, bar heights, scatter offsets, heatmap colors and
+  the value labels)
+- Lays each figure out once: tight_layout and the tight bounding box are
+  computed on the first render and reused, so saving an image costs one draw
+  instead of the two savefig(bbox_inches='tight') makes (or none at all if
+  the figure is saved uncropped)
+"""
+
+import numpy as np
+
+# matplotlib is imported inside the functions: they only run once the
+# visualization stage has set up plotting, and importing this module stays cheap
+
+# Live templates of this process, by key
+_templates = {}
+
+
+class FigureTemplate:
+    """A laid-out figure plus the artists its chart updates for each subset."""
+
+    def __init__(self, fig, artists, dpi, tight=True):
+        self.fig = fig
+        self.artists = artists
+        # None saves the whole figure
+        self.bbox = tight_bbox(fig, dpi) if tight else None
+
+    def save(self, path, dpi, **kwargs):
+        self.fig.savefig(path, dpi=dpi, bbox_inches=self.bbox, **kwargs)
+
+
+def tight_bbox(fig, dpi):
+    """The bounding box (inches) that savefig(dpi=dpi, bbox_inches='tight') crops fig to."""
+    import matplotlib as mpl
+    screen_dpi = fig.dpi
+    fig.dpi = dpi
+    try:
+        fig.draw_without_rendering()
+        bbox = fig.get_tightbbox(fig.canvas.get_renderer())
+    finally:
+        fig.dpi = screen_dpi
+    pad = mpl.rcParams['savefig.pad_inches']
+    return bbox.padded(pad)
+
+
+def get(key):
+    """The template stored under key, or None."""
+    return _templates.get(key)
+
+
+def add(key, fig, dpi, tight=True, **artists):
+    """Store fig (already drawn and laid out) as the template for key.
+
+    The figure is detached from pyplot, so later plt calls never draw on it,
+    and given its own Agg canvas (which renders the PNGs anyway). With tight,
+    its images are cropped to the tight bounding box at dpi.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    plt.close(fig)
+    FigureCanvasAgg(fig)
+    template = FigureTemplate(fig, artists, dpi, tight)
+    _templates[key] = template
+    return template
+
+
+def clear():
+    """Drop every template (their figures are freed with them)."""
+    _templates.clear()
+
+
+def set_text(text, string, y=None):
+    """Change a label's string and, optionally, its data y position."""
+    text.set_text(string)
+    if y is not None:
+        text.set_y(y)
+
+
+def set_boxes(container, stats):
+    """Redraw the boxes of a vertical seaborn/matplotlib box plot container.
+
+    stats holds one matplotlib.cbook.boxplot_stats entry per box, in the order
+    the boxes were drawn; the box positions and widths stay as they are.
+    """
+    from matplotlib.path import Path
+    for i, box_stats in enumerate(stats):
+        q1, q3 = box_stats['q1'], box_stats['q3']
+        low, high = box_stats['whislo'], box_stats['whishi']
+        box = container.boxes[i]
+        vertices = box.get_path().vertices.copy()
+        vertices[:, 1] = [q1, q1, q3, q3, q1, q1][:len(vertices)]
+        box.set_path(Path(vertices, box.get_path().codes))
+        container.medians[i].set_ydata([box_stats['med'], box_stats['med']])
+        container.whiskers[2 * i].set_ydata([q1, low])
+        container.whiskers[2 * i + 1].set_ydata([q3, high])
+        container.caps[2 * i].set_ydata([low, low])
+        container.caps[2 * i + 1].set_ydata([high, high])
+        position = vertices[:2, 0].mean()
+        container.fliers[i].set_data(np.full(len(box_stats['fliers']), position), box_stats['fliers'])
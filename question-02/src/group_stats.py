@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Group statistics
+- Builds a group index (category code -> row positions) for each categorical
+  column once, right after the processed data is loaded
+- Tabulates count, sum and sum of squares of every score column for every
+  combination of the categorical columns, with every rollup, as a mergeable
+  AggregateCube that the processing stage saves with the processed data
+- Answers group means, variances and two-sample t-tests from that cube by
+  array lookups, instead of re-filtering the whole frame
+- Keeps the co-moment (correlation) matrices of the score columns in a
+  mergeable GroupSums, so they can be saved and updated from appended rows
+  alone
+- Fits every score pair (correlation and least-squares line) for every group
+  level at once from those co-moment matrices, as one tidy table
+"""
+
+import copy
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+GROUP_COLUMNS = ['gender', 'race_ethnicity', 'parental_level_of_education',
+                 'lunch', 'test_preparation_course']
+SCORE_COLUMNS = ['math_score', 'reading_score', 'writing_score', 'overall_avg']
+
+# Same fields as scipy.stats.ttest_ind's result
+TTestResult = namedtuple('TTestResult', ['statistic', 'pvalue'])
+
+# Count, mean and sample variance of one column over one cell or rollup of an
+# AggregateCube: the inputs of a two-sample t-test
+CellSummary = namedtuple('CellSummary', ['count', 'mean', 'variance'])
+
+# Columns of the pairwise_fits table; group and level are None for all rows
+FIT_COLUMNS = ['group', 'level', 'x', 'y', 'count', 'slope', 'intercept', 'r', 'r_squared', 'pvalue', 'stderr']
+
+
+def category_codes(series):
+    """Return (codes, levels) for a column, using the category codes if it has them."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), list(series.cat.categories)
+    codes, levels = pd.factorize(series, sort=True)
+    return codes, list(levels)
+
+
+class Moments:
+    """Count, mean vector and co-moment matrix (sum of centered cross products) of rows of values.
+
+    Two sets of rows are combined with the pairwise update of Chan et al., so
+    the matrix stays accurate however many times it is merged.
+    """
+
+    def __init__(self, n_columns):
+        self.count = 0
+        self.mean = np.zeros(n_columns)
+        self.comoment = np.zeros((n_columns, n_columns))
+
+    @classmethod
+    def of(cls, matrix):
+        """Moments of the rows of a 2D array that have no missing value."""
+        moments = cls(matrix.shape[1])
+        matrix = matrix[~np.isnan(matrix).any(axis=1)]
+        if len(matrix):
+            moments.count = len(matrix)
+            moments.mean = matrix.mean(axis=0)
+            centered = matrix - moments.mean
+            moments.comoment = centered.T @ centered
+        return moments
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * (self.count * other.count / total)
+        self.mean = self.mean + delta * (other.count / total)
+        self.count = total
+        return self
+
+
+class GroupSums:
+    """Mergeable co-moments of the value columns: per group level and over all rows.
+
+    moments maps (group, level) to the Moments of all value columns, and None
+    to those of all rows.
+    """
+
+    def __init__(self, value_columns):
+        self.value_columns = list(value_columns)
+        self.moments = {}
+
+    @classmethod
+    def of(cls, df, group_columns=GROUP_COLUMNS, value_columns=SCORE_COLUMNS):
+        """GroupSums of a frame, without building the group index."""
+        sums = cls([col for col in value_columns if col in df.columns])
+        values = {col: df[col].to_numpy(dtype=np.float64) for col in sums.value_columns}
+        for group in group_columns:
+            if group in df.columns:
+                codes, levels = category_codes(df[group])
+                sums.add_group(group, levels, codes, values)
+        sums.add_totals(values)
+        return sums
+
+    def add_group(self, group, levels, codes, values, positions=None):
+        """Add the rows of one group column (codes into levels; -1 = missing).
+
+        positions ({level: row positions}) saves a scan per level if known.
+        """
+        matrix = np.column_stack([values[col] for col in self.value_columns])
+        for code, level in enumerate(levels):
+            rows = positions[level] if positions is not None else np.flatnonzero(codes == code)
+            self._merge_moments((group, level), Moments.of(matrix[rows]))
+
+    def add_totals(self, values):
+        """Add the rows to the moments over all rows."""
+        matrix = np.column_stack([values[col] for col in self.value_columns])
+        self._merge_moments(None, Moments.of(matrix))
+
+    def _merge_moments(self, key, moments):
+        self.moments.setdefault(key, Moments(len(self.value_columns))).merge(moments)
+
+    def merge(self, other):
+        """Add the co-moments of other (over other rows with the same value columns)."""
+        for key, moments in other.moments.items():
+            self._merge_moments(key, moments)
+        return self
+
+    def fits(self, columns=None):
+        """pairwise_fits of columns (default: all value columns) over all rows and every group level."""
+        return pairwise_fits(self.moments, self.value_columns, columns)
+
+    def describes(self, values):
+        """True if the totals match those of values ({column: array}), i.e. the sums are of those rows."""
+        totals = self.moments.get(None)
+        if totals is None or list(values) != self.value_columns:
+            return False
+        moments = Moments.of(np.column_stack([values[col] for col in self.value_columns]))
+        return moments.count == totals.count and np.allclose(moments.mean, totals.mean)
+
+
+class AggregateCube:
+    """Count, sum and sum of squares of the value columns for every combination of the dimensions.
+
+    Every array has an axis per dimension, with a slot per level, one for
+    rows where that dimension is missing, and a last slot (ALL) that holds
+    the sum over the dimension. counts, sums and sums_sq have a leading
+    value-column axis, and rows counts the rows. Every cell and every rollup,
+    down to the grand total, is therefore stored, and a query is one lookup
+    per array. Queries name levels as keyword filters; dimensions they leave
+    out are rolled up:
+
+        cube.mean('math_score', race_ethnicity='group C', lunch='standard')
+
+    The arrays are dense: their size is the product of the dimensions' level
+    counts (plus two), not the number of rows.
+    """
+
+    def __init__(self, dimensions, levels, value_columns, rows, counts, sums, sums_sq):
+        self.dimensions = list(dimensions)
+        self.levels = {dim: list(levels[dim]) for dim in self.dimensions}
+        self.value_columns = list(value_columns)
+        self.rows = rows
+        self.counts = counts
+        self.sums = sums
+        self.sums_sq = sums_sq
+        # Filters applied to every query (see where)
+        self.filters = {}
+        self._axes = {dim: axis for axis, dim in enumerate(self.dimensions)}
+        self._codes = {dim: {level: code for code, level in enumerate(self.levels[dim])}
+                       for dim in self.dimensions}
+        self._columns = {col: i for i, col in enumerate(self.value_columns)}
+
+    @classmethod
+    def of(cls, df, dimensions=GROUP_COLUMNS, value_columns=SCORE_COLUMNS):
+        """AggregateCube of a frame, from bincounts over one combined cell code per row."""
+        dimensions = [dim for dim in dimensions if dim in df.columns]
+        value_columns = [col for col in value_columns if col in df.columns]
+        levels = {}
+        cell = np.zeros(len(df), dtype=np.intp)
+        for dim in dimensions:
+            codes, levels[dim] = category_codes(df[dim])
+            n_slots = len(levels[dim]) + 1
+            # Rows with a missing value go to the slot after the levels
+            cell = cell * n_slots + np.where(codes >= 0, codes, n_slots - 1)
+        shape = tuple(len(levels[dim]) + 1 for dim in dimensions)
+        size = int(np.prod(shape))
+        values = df[value_columns].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.0)
+
+        def tabulate(weights):
+            return np.stack([np.bincount(cell, weights=weights[:, j], minlength=size)
+                             for j in range(len(value_columns))]).reshape((len(value_columns),) + shape)
+
+        return cls(dimensions, levels, value_columns,
+                   rollup(np.bincount(cell, minlength=size).reshape(shape)),
+                   rollup(tabulate(valid).astype(np.int64), first_axis=1),
+                   rollup(tabulate(values), first_axis=1),
+                   rollup(tabulate(values ** 2), first_axis=1))
+
+    def merge(self, other):
+        """Add the cells of other (other rows with the same dimensions and value columns).
+
+        Levels that only one side has are added; if the levels differ, the
+        union is sorted, as concat_partitions does for categoricals.
+        """
+        if other.dimensions != self.dimensions or other.value_columns != self.value_columns:
+            raise ValueError("Cannot merge cubes with different dimensions or value columns")
+        levels = {dim: self.levels[dim] if other.levels[dim] == self.levels[dim]
+                  else sorted(set(self.levels[dim]) | set(other.levels[dim]))
+                  for dim in self.dimensions}
+        rows, counts, sums, sums_sq = [rollup(mine + theirs, first_axis=mine.ndim - len(self.dimensions))
+                                       for mine, theirs in zip(self._cells(levels), other._cells(levels))]
+        self.__init__(self.dimensions, levels, self.value_columns, rows, counts, sums, sums_sq)
+        return self
+
+    def _cells(self, levels):
+        """The arrays without their ALL slots, laid out for levels (a superset of self.levels)."""
+        index = []
+        for dim in self.dimensions:
+            codes = {level: code for code, level in enumerate(levels[dim])}
+            index.append(np.array([codes[level] for level in self.levels[dim]] + [len(levels[dim])],
+                                  dtype=np.intp))
+        shape = tuple(len(levels[dim]) + 1 for dim in self.dimensions)
+        cells = []
+        for array in (self.rows, self.counts, self.sums, self.sums_sq):
+            lead = (slice(None),) * (array.ndim - len(self.dimensions))
+            out = np.zeros(array.shape[:len(lead)] + shape, dtype=array.dtype)
+            out[lead + np.ix_(*index)] = array[lead + (slice(0, -1),) * len(self.dimensions)]
+            cells.append(out)
+        return cells
+
+    def where(self, **filters):
+        """The cube with filters added to every query, e.g. the rows of one facet."""
+        view = copy.copy(self)
+        view.filters = {**self.filters, **filters}
+        return view
+
+    def _index(self, filters):
+        """Index of the cell or rollup that filters select, or None if one of their levels is absent."""
+        if self.filters:
+            if any(filters.get(dim, level) != level for dim, level in self.filters.items()):
+                # A level the view's rows cannot have
+                return None
+            filters = {**self.filters, **filters}
+        index = [-1] * len(self.dimensions)
+        for dim, level in filters.items():
+            if dim not in self._axes:
+                raise KeyError(f"{dim!r} is not a dimension of the cube")
+            code = self._codes[dim].get(level)
+            if code is None:
+                return None
+            index[self._axes[dim]] = code
+        return tuple(index)
+
+    def count(self, **filters):
+        """Number of rows that match filters."""
+        index = self._index(filters)
+        return 0 if index is None else int(self.rows[index])
+
+    def describes(self, df):
+        """True if df has the cube's row count and the mean of every value column, i.e. the cube is of df."""
+        if self.count() != len(df):
+            return False
+        return all(np.isclose(self.mean(col), df[col].mean(), equal_nan=True) for col in self.value_columns)
+
+    def summary(self, column, **filters):
+        """CellSummary (count, mean, sample variance) of column over the rows that match filters."""
+        return self._summary(column, filters)
+
+    def _summary(self, column, filters):
+        index = self._index(filters)
+        if index is None:
+            return CellSummary(0, np.nan, np.nan)
+        index = (self._columns[column],) + index
+        n, s, ss = int(self.counts[index]), float(self.sums[index]), float(self.sums_sq[index])
+        return CellSummary(n, s / n if n else np.nan, (ss - s * s / n) / (n - 1) if n > 1 else np.nan)
+
+    def mean(self, column, **filters):
+        return self._summary(column, filters).mean
+
+    def variance(self, column, **filters):
+        """Sample variance (ddof=1)."""
+        return self._summary(column, filters).variance
+
+    def means(self, dimension, columns, **filters):
+        """DataFrame of the means of columns, one row per level of dimension (like groupby().mean())."""
+        levels = self.levels[dimension]
+        return pd.DataFrame({col: [self._summary(col, {**filters, dimension: level}).mean for level in levels]
+                             for col in columns},
+                            index=pd.Index(levels, name=dimension))
+
+    def ttest(self, column, dimension, level_a, level_b, **filters):
+        """Student's two-sample t-test (equal variances) of two levels, like stats.ttest_ind."""
+        return student_ttest(self._summary(column, {**filters, dimension: level_a}),
+                             self._summary(column, {**filters, dimension: level_b}))
+
+    def table(self):
+        """Tidy table of every cell and rollup: the dimensions, column, count, sum, sum_sq and mean.
+
+        A dimension is None in the rollups over it. Rows with a missing value
+        of a dimension only count in those rollups.
+        """
+        cells = np.ix_(*[np.r_[0:len(self.levels[dim]), -1] for dim in self.dimensions])
+        labels = np.meshgrid(*[np.array(self.levels[dim] + [None], dtype=object) for dim in self.dimensions],
+                             indexing='ij')
+        frames = []
+        for col, j in self._columns.items():
+            counts = self.counts[j][cells].ravel()
+            sums = self.sums[j][cells].ravel()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                means = sums / counts
+            frames.append(pd.DataFrame({
+                **{dim: values.ravel() for dim, values in zip(self.dimensions, labels)},
+                'column': col,
+                'count': counts,
+                'sum': sums,
+                'sum_sq': self.sums_sq[j][cells].ravel(),
+                'mean': means,
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+
+def rollup(cells, first_axis=0):
+    """cells with an ALL slot appended to every axis from first_axis on, holding the sum over that axis.
+
+    Summing the axes one after another also fills the slots where several
+    axes are ALL, so every rollup of the dimensions is included.
+    """
+    for axis in range(first_axis, cells.ndim):
+        cells = np.concatenate([cells, cells.sum(axis=axis, keepdims=True)], axis=axis)
+    return cells
+
+
+def student_ttest(a, b):
+    """Student's two-sample t-test (equal variances) from two CellSummary, like stats.ttest_ind."""
+    from scipy import stats
+
+    if not a.count or not b.count or a.count + b.count < 3:
+        # A level missing from the data (e.g. in a small facet)
+        return TTestResult(np.nan, np.nan)
+    dof = a.count + b.count - 2
+    pooled = ((a.count - 1) * a.variance + (b.count - 1) * b.variance) / dof
+    t = (a.mean - b.mean) / np.sqrt(pooled * (1 / a.count + 1 / b.count))
+    return TTestResult(t, 2 * stats.t.sf(abs(t), dof))
+
+
+class GroupStats:
+    """Per-group sufficient statistics for the processed student data.
+
+    Means, variances and t-tests come from cube (an AggregateCube over exactly
+    these rows, e.g. the one the processing stage saved, or a where() view of
+    a larger cube) if given, else from a cube of the frame. The co-moments
+    come from sums (a GroupSums over exactly these rows, e.g. saved ones
+    updated with appended rows) if given, else from the frame. A cube or sums
+    whose row count or column means differ from the frame's (say, saved ones
+    given with a filtered frame) are ignored.
+    """
+
+    def __init__(self, df, group_columns=GROUP_COLUMNS, value_columns=SCORE_COLUMNS, sums=None, cube=None):
+        self.group_columns = [col for col in group_columns if col in df.columns]
+        self.value_columns = [col for col in value_columns if col in df.columns]
+        self.values = {col: df[col].to_numpy(dtype=np.float64) for col in self.value_columns}
+        self.levels = {}
+        self.codes = {}
+        self._positions = {}
+        if sums is not None and not sums.describes(self.values):
+            sums = None
+        compute = sums is None
+        self.sums = GroupSums(self.value_columns) if compute else sums
+        if (cube is None or cube.dimensions != self.group_columns or cube.value_columns != self.value_columns
+                or not cube.describes(df)):
+            cube = AggregateCube.of(df, self.group_columns, self.value_columns)
+        self.cube = cube
+        self._fits = None
+
+        for group in self.group_columns:
+            codes, levels = category_codes(df[group])
+            self.levels[group] = levels
+            self.codes[group] = codes
+            n_levels = len(levels)
+            valid = codes >= 0
+
+            # Row positions for every level from one stable sort of the codes
+            order = np.argsort(codes, kind='stable')
+            counts = np.bincount(codes[valid], minlength=n_levels)
+            bounds = np.cumsum(counts)
+            order = order[len(codes) - valid.sum():]
+            for code, level in enumerate(levels):
+                self._positions[(group, level)] = order[bounds[code] - counts[code]:bounds[code]]
+
+            if compute:
+                positions = {level: self._positions[(group, level)] for level in levels}
+                self.sums.add_group(group, levels, codes, self.values, positions)
+        if compute:
+            self.sums.add_totals(self.values)
+
+    def positions(self, group, level):
+        """Row positions (into the original frame) of one group."""
+        return self._positions[(group, level)]
+
+    def subset(self, group, level, column):
+        """The values of column for one group, as a NumPy array."""
+        return self.values[column][self._positions[(group, level)]]
+
+    def unique(self, group):
+        """Levels present in the data, in order of first appearance (like Series.unique())."""
+        present = [level for level in self.levels[group] if self.count(group, level)]
+        return sorted(present, key=lambda level: self._positions[(group, level)][0])
+
+    def count(self, group, level):
+        return len(self._positions[(group, level)])
+
+    def mean(self, group, level, column):
+        return self.cube.mean(column, **{group: level})
+
+    def variance(self, group, level, column):
+        """Sample variance (ddof=1)."""
+        return self.cube.variance(column, **{group: level})
+
+    def fits(self):
+        """Table of every score-pair fit over all rows and every group level (see pairwise_fits)."""
+        if self._fits is None:
+            self._fits = self.sums.fits()
+        return self._fits
+
+    def fit(self, group, level, x, y):
+        """The fit of y on x for one group level (group None: all rows), as a row of fits()."""
+        return select_fits(self.fits(), group, level).set_index(['x', 'y']).loc[(x, y)]
+
+    def corr(self, columns, group=None, level=None):
+        """Correlation matrix of columns (like df[columns].corr()), or of one group level."""
+        return correlation_matrix(self.fits(), columns, group, level)
+
+    def means(self, group, columns):
+        """DataFrame of group means, one row per level (like groupby().mean())."""
+        return self.cube.means(group, columns).reindex(pd.Index(self.levels[group], name=group))
+
+    def ttest(self, group, level_a, level_b, column):
+        """Student's two-sample t-test (equal variances), like stats.ttest_ind."""
+        return self.cube.ttest(column, group, level_a, level_b)
+
+    def histogram2d(self, group, x_column, y_column, edges):
+        """2D histogram of (x, y) for every level of group, from one bincount.
+
+        Returns {level: counts} with counts[i, j] the number of rows whose x
+        falls in bin i and y in bin j of edges (the last bin includes its
+        right edge, like np.histogram2d). Rows outside edges are dropped.
+        """
+        edges = np.asarray(edges, dtype=np.float64)
+        n_bins = len(edges) - 1
+        codes = self.codes[group]
+        bins = []
+        for column in (x_column, y_column):
+            values = self.values[column]
+            index = np.searchsorted(edges, values, side='right') - 1
+            index[values == edges[-1]] = n_bins - 1
+            bins.append(index)
+        x_bin, y_bin = bins
+        keep = (codes >= 0) & (x_bin >= 0) & (x_bin < n_bins) & (y_bin >= 0) & (y_bin < n_bins)
+        flat = (codes[keep].astype(np.int64) * n_bins + x_bin[keep]) * n_bins + y_bin[keep]
+        n_levels = len(self.levels[group])
+        counts = np.bincount(flat, minlength=n_levels * n_bins * n_bins).reshape(n_levels, n_bins, n_bins)
+        return {level: counts[code] for code, level in enumerate(self.levels[group])}
+
+
+def pairwise_fits(moments, value_columns, columns=None):
+    """Least-squares fit of y on x for every ordered pair of columns and every Moments, as a table.
+
+    moments maps (group, level), or None for all rows, to the Moments of
+    value_columns. Their counts, means and co-moment matrices are stacked so
+    that every fit comes out of one vectorized pass. slope, intercept, r,
+    pvalue (of r = 0) and stderr (of the slope) are those of
+    stats.linregress(x, y), except that the p-value of a fit to fewer than
+    three rows is NaN. Returns a DataFrame with FIT_COLUMNS.
+    """
+    from scipy import stats
+
+    columns = list(value_columns if columns is None else columns)
+    keys = list(moments)
+    index = [value_columns.index(col) for col in columns]
+    pairs = [(a, b) for a in range(len(columns)) for b in range(len(columns)) if a != b]
+    x = np.array([index[a] for a, _ in pairs], dtype=np.intp)
+    y = np.array([index[b] for _, b in pairs], dtype=np.intp)
+
+    n_columns = len(value_columns)
+    count = np.array([moments[key].count for key in keys], dtype=np.float64).reshape(-1, 1)
+    mean = np.array([moments[key].mean for key in keys]).reshape(-1, n_columns)
+    comoment = np.array([moments[key].comoment for key in keys]).reshape(-1, n_columns, n_columns)
+    c_xx, c_yy, c_xy = comoment[:, x, x], comoment[:, y, y], comoment[:, x, y]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = c_xy / c_xx
+        intercept = mean[:, y] - slope * mean[:, x]
+        r = np.clip(c_xy / (np.sqrt(c_xx) * np.sqrt(c_yy)), -1.0, 1.0)
+        dof = count - 2
+        t = r * np.sqrt(dof / ((1.0 - r) * (1.0 + r)))
+        pvalue = np.where(dof > 0, 2 * stats.t.sf(np.abs(t), np.maximum(dof, 1)), np.nan)
+        stderr = np.sqrt((1 - r ** 2) * c_yy / c_xx / dof)
+
+    n_pairs = len(pairs)
+    return pd.DataFrame({
+        'group': np.repeat(np.array([None if key is None else key[0] for key in keys], dtype=object), n_pairs),
+        'level': np.repeat(np.array([None if key is None else key[1] for key in keys], dtype=object), n_pairs),
+        'x': np.tile(np.array([columns[a] for a, _ in pairs], dtype=object), len(keys)),
+        'y': np.tile(np.array([columns[b] for _, b in pairs], dtype=object), len(keys)),
+        'count': np.repeat(count.ravel().astype(np.int64), n_pairs),
+        'slope': slope.ravel(),
+        'intercept': intercept.ravel(),
+        'r': r.ravel(),
+        'r_squared': (r ** 2).ravel(),
+        'pvalue': pvalue.ravel(),
+        'stderr': stderr.ravel(),
+    }, columns=FIT_COLUMNS)
+
+
+def select_fits(fits, group=None, level=None):
+    """The rows of a pairwise_fits table for one group level, or for all rows if group is None."""
+    if group is None:
+        return fits[fits['group'].isna()]
+    return fits[(fits['group'] == group) & (fits['level'] == level)]
+
+
+def correlation_matrix(fits, columns, group=None, level=None):
+    """Correlation matrix of columns (1 on the diagonal) from a pairwise_fits table."""
+    rows = select_fits(fits, group, level)
+    r = rows.pivot(index='x', columns='y', values='r').reindex(index=columns, columns=columns).to_numpy(copy=True)
+    np.fill_diagonal(r, 1.0)
+    return pd.DataFrame(r, index=columns, columns=columns)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Missing-value imputation
+- Counts the missing values and the distinct values of every column of a
+  table read in chunks or partitions, in one pass and without keeping rows
+- Bounded whole numbers (the 0-100 scores) are counted by counting sort into
+  a fixed array; other values (the categorical levels) are hash-counted
+- Gives the exact median of each numeric column and the mode of each other
+  column from the counts, so memory is bounded by the number of distinct
+  values, not the number of rows
+"""
+
+import numpy as np
+import pandas as pd
+
+# Whole numbers in [0, SMALL_INT_LIMIT) are counted in an array slot each
+SMALL_INT_LIMIT = 256
+
+
+class ColumnCounts:
+    """Missing count and count of each distinct value of one column, merged chunk by chunk."""
+
+    def __init__(self):
+        self.numeric = True
+        self.missing = 0
+        self.small = np.zeros(SMALL_INT_LIMIT, dtype=np.int64)
+        self.other = {}
+
+    def update(self, series, n_missing=None):
+        self.missing += int(series.isna().sum()) if n_missing is None else n_missing
+        if not pd.api.types.is_numeric_dtype(series.dtype):
+            self.numeric = False
+            self._count(series.value_counts(sort=False))
+            return self
+        values = series.to_numpy()
+        if values.dtype.kind == 'f':
+            values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        if (values.min() < 0 or values.max() >= SMALL_INT_LIMIT
+                or (values.dtype.kind == 'f' and (values != np.floor(values)).any())):
+            self._count(pd.Series(values).value_counts(sort=False))
+        else:
+            self.small += np.bincount(values.astype(np.intp), minlength=SMALL_INT_LIMIT)
+        return self
+
+    def _count(self, counts):
+        for value, n in zip(counts.index, counts.to_numpy()):
+            if n:
+                self.other[value] = self.other.get(value, 0) + int(n)
+
+    def merge(self, other):
+        self.numeric = self.numeric and other.numeric
+        self.missing += other.missing
+        self.small += other.small
+        for value, n in other.other.items():
+            self.other[value] = self.other.get(value, 0) + n
+        return self
+
+    @property
+    def small_ints(self):
+        """True if every value is a whole number that fits the counting array (e.g. uint8)."""
+        return self.numeric and not self.other
+
+    def distribution(self):
+        """Count of each distinct value, sorted by value."""
+        present = np.flatnonzero(self.small)
+        counts = pd.Series(self.small[present], index=present.astype(np.float64))
+        if self.other:
+            other = pd.Series(self.other, dtype='int64')
+            if not self.numeric:
+                return other.sort_index()
+            counts = pd.concat([counts, other.set_axis(other.index.astype(np.float64))])
+            counts = counts.groupby(level=0).sum()
+        return counts
+
+    def levels(self):
+        """Distinct values in sort order (the categories a single parse would infer)."""
+        return self.distribution().index
+
+    def median(self):
+        """Middle value, or the mean of the two middle values, as Series.median() gives."""
+        values = self.distribution()
+        if values.empty:
+            return None
+        n = values.sum()
+        cumulative = values.to_numpy().cumsum()
+        levels = values.index.to_numpy(dtype=np.float64)
+        low = levels[np.searchsorted(cumulative, (n - 1) // 2, side='right')]
+        high = levels[np.searchsorted(cumulative, n // 2, side='right')]
+        return (low + high) / 2
+
+    def mode(self):
+        """Most frequent value; ties go to the first in sort order, as Series.mode()[0]."""
+        values = self.distribution()
+        if values.empty:
+            return None
+        return values.index[values.to_numpy() == values.max()][0]
+
+    def fill_value(self):
+        return self.median() if self.numeric else self.mode()
+
+
+class FillStatistics:
+    """ColumnCounts of every column of a table seen in chunks or partitions."""
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def update(self, df):
+        self.rows += len(df)
+        missing = df.isna().sum()
+        for col in df.columns:
+            self.columns.setdefault(col, ColumnCounts()).update(df[col], int(missing[col]))
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        for col, counts in other.columns.items():
+            if col in self.columns:
+                self.columns[col].merge(counts)
+            else:
+                self.columns[col] = counts
+        return self
+
+    @property
+    def missing(self):
+        return pd.Series({col: counts.missing for col, counts in self.columns.items()}, dtype='int64')
+
+    def fills(self):
+        """Median of each numeric column, mode of each other column, that has missing values."""
+        fills = {}
+        for col, counts in self.columns.items():
+            if counts.missing:
+                value = counts.fill_value()
+                if value is not None:
+                    fills[col] = value
+        return fills
+
+
+def scan(chunks):
+    """FillStatistics of an iterable of frames (e.g. CSV chunks), in one pass."""
+    stats = FillStatistics()
+    for chunk in chunks:
+        stats.update(chunk)
+    return stats
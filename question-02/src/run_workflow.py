@@ -8,8 +8,19 @@ Main workflow runner
 import os
 import sys
 import time
+import glob
+import json
+import argparse
 import importlib.util
 
+# Helper modules shared by both workflows
+common_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'common')
+if common_dir not in sys.path:
+    sys.path.insert(0, common_dir)
+
+import profiling
+from stage_cache import StageCache
+
 # Dynamically import the modules
 def import_module_from_file(module_name, file_path):
     spec = importlib.util.spec_from_file_location(module_name, file_path)
@@ -20,55 +31,409 @@ def import_module_from_file(module_name, file_path):
 
 # Get the script's directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
+cache_dir = os.path.join(os.path.dirname(script_dir), 'data', 'cache')
+
+run_state_path = os.path.join(cache_dir, 'run_state.json')
+
+# Metrics and cProfile/tracemalloc output of profiled runs
+profile_dir = os.path.join(os.path.dirname(script_dir), 'reports', 'profile')
+
+raw_data_path = os.path.join(os.path.dirname(script_dir), 'data', 'raw', 'StudentsPerformance.csv')
+processed_data_path = os.path.join(os.path.dirname(script_dir), 'data', 'processed', 'students_processed.parquet')
+
+STAGES = ['ingest', 'process', 'visualize']
+
+# Workflow modules are imported on first use, so a run only pays for the
+# libraries (pandas, matplotlib, seaborn, scipy) of the stages it executes
+stage_paths = {
+    'ingest': os.path.join(script_dir, "1_ingest.py"),
+    'process': os.path.join(script_dir, "2_process.py"),
+    'visualize': os.path.join(script_dir, "3_visualize.py"),
+}
+
+_stage_modules = {}
+import_report = {}
+
+def load_stage(stage):
+    """Import a stage module the first time it is needed.
+
+    Records the import time and the non-stdlib top-level packages it pulled in.
+    """
+    if stage not in _stage_modules:
+        already_loaded = set(sys.modules)
+        start_time = time.perf_counter()
+        _stage_modules[stage] = import_module_from_file(stage, stage_paths[stage])
+        packages = {name.split('.')[0] for name in set(sys.modules) - already_loaded}
+        packages = {name for name in packages
+                    if name not in sys.stdlib_module_names and not name.startswith('_')}
+        import_report[stage] = (time.perf_counter() - start_time, sorted(packages - {stage}))
+    return _stage_modules[stage]
+
+def print_import_report():
+    print("\nStartup import report:")
+    if not import_report:
+        print("  no stage modules were imported")
+    for stage, (seconds, packages) in import_report.items():
+        print(f"  {stage:<10} {seconds:6.3f} s  {', '.join(packages) or '-'}")
+
+def select_stages(start=None, stop=None, only=None):
+    """Return the stages to run, in order, from --from/--to or --only."""
+    if only:
+        return [only]
+    first = STAGES.index(start) if start else 0
+    last = STAGES.index(stop) if stop else len(STAGES) - 1
+    if first > last:
+        raise ValueError(f"Stage '{start}' comes after '{stop}'")
+    return STAGES[first:last + 1]
+
+def check_artifact(path, inputs):
+    """Make sure an upstream artifact exists and is newer than its inputs."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found - run the stage that produces it first")
+    stale = [p for p in inputs if os.path.getmtime(p) > os.path.getmtime(path)]
+    if stale:
+        raise RuntimeError(f"{path} is older than {', '.join(stale)} - rerun the stage that produces it")
 
-# Import our workflow modules
-ingest_module = import_module_from_file("ingest", os.path.join(script_dir, "1_ingest.py"))
-process_module = import_module_from_file("process", os.path.join(script_dir, "2_process.py"))
-visualize_module = import_module_from_file("visualize", os.path.join(script_dir, "3_visualize.py"))
+def load_run_state():
+    if not os.path.exists(run_state_path):
+        return None
+    with open(run_state_path) as f:
+        return json.load(f)
 
-# Get the functions
-ingest_data = ingest_module.ingest_data
-process_data = process_module.process_data
-visualize_data = visualize_module.visualize_data
+def save_run_state(stages, completed, status):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(run_state_path, 'w') as f:
+        json.dump({'stages': stages, 'completed': completed, 'status': status}, f, indent=2)
 
-def run_workflow():
-    """Run the complete three-stage workflow."""
+def resume_stages():
+    """Stages left over from the last run, or None if it did not fail."""
+    state = load_run_state()
+    if state is None or state['status'] != 'failed':
+        return None
+    return [stage for stage in state['stages'] if stage not in state['completed']]
+
+def raw_inputs(source):
+    """The raw files a run reads: the raw CSV, or the files of a multi-file source."""
+    if source is None:
+        return [raw_data_path]
+    # Imported here so that runs on the raw CSV do not load pandas up front
+    import raw_sources
+    return raw_sources.resolve(source)
+
+def frame_rows(df):
+    return None if df is None else len(df)
+
+def print_banner(title):
+    print("\n" + "="*50)
+    print(title)
+    print("="*50)
+
+def run_workflow(export_csv=False, use_cache=True, chunksize=None, workers=1, show_imports=False,
+                 stages=STAGES, facets=(), resamples=0, render='production', vector=None,
+                 source=None):
+    """Run the three-stage workflow, or the selected stages of it.
+
+    Each stage hands its DataFrame to the next one in memory, so the raw CSV is
+    parsed only once; the processed Parquet file is still written as an
+    artifact (plus the processed CSV when export_csv is set).
+
+    With use_cache, a stage whose input file and module source (including the
+    helper modules it imports) are unchanged since the last run is skipped and
+    its stored output is reused.
+
+    chunksize streams the raw file through ingest and processing in chunks of
+    that many rows, so memory is bounded by the chunk size (and the number of
+    distinct values) rather than the file size; visualization then reads the
+    processed Parquet file.
+
+    workers sets how many processes process the rows, render the
+    visualizations and run the resamples (0 = one per CPU); the outputs do
+    not depend on it.
+
+    resamples is the number of bootstrap and permutation resamples behind the
+    confidence intervals and p-values in reports/significance.md and the
+    facet findings (0, the default, = none).
+
+    render selects how the charts are saved: 'production' (300 DPI, cropped)
+    or 'preview' (screen resolution, uncropped, fast PNG compression); vector
+    ('svg' or 'pdf') also saves each chart in that format.
+
+    source reads the raw data from a directory or glob of CSV files with the
+    same columns (e.g. one per site) instead of the raw CSV. Ingest reads them
+    concurrently into one frame with a source_file column naming each row's
+    file, and the cache keys cover every file.
+
+    show_imports prints how long each stage module took to import.
+
+    facets (column names of the processed data) makes the visualize stage
+    also render the five visualizations and a findings file for every
+    combination of their values, under reports/facets/; facets whose data is
+    unchanged since the last batch are skipped.
+
+    stages lists the stages to run. When visualize runs without process, the
+    processed Parquet file must exist and be newer than the raw data and
+    2_process.py. Progress is saved so a failed run can be resumed.
+    """
     print("="*50)
     print("STARTING STUDENT PERFORMANCE DATA ANALYSIS WORKFLOW")
     print("="*50)
+    print(f"Stages: {' → '.join(stages)}")
     
-    # Stage 1: Ingest
-    print("\n" + "="*50)
-    print("STAGE 1: DATA INGESTION")
+    # Work out which stages are unchanged before touching any data
+    cache = StageCache(cache_dir, enabled=use_cache)
+    raw_paths = raw_inputs(source)
+    keys = {}
+    keys['ingest'] = cache.stage_key('ingest', stage_paths['ingest'],
+                                     inputs=raw_paths,
+                                     params={'chunksize': chunksize,
+                                             'source': None if source is None else raw_paths})
+    keys['process'] = cache.stage_key('process', stage_paths['process'],
+                                      upstream_key=keys['ingest'], params={'export_csv': export_csv})
+    keys['visualize'] = cache.stage_key('visualize', stage_paths['visualize'],
+                                        upstream_key=keys['process'],
+                                        params={'facets': list(facets), 'resamples': resamples,
+                                                'render': render, 'vector': vector})
+    hits = {stage: cache.is_hit(stage, keys[stage]) for stage in stages}
+    
+    # A selected stage has to produce its output if it is the last one asked
+    # for, or if the next stage runs and needs it as input
+    needed = {}
+    feeds_next = {}
+    next_runs = False
+    for stage in reversed(stages):
+        feeds_next[stage] = next_runs
+        needed[stage] = stage == stages[-1] or next_runs
+        next_runs = needed[stage] and not hits[stage]
+    
+    # Stages whose upstream stage is not selected read its artifact from disk
+    if needed.get('visualize') and not hits['visualize'] and 'process' not in stages:
+        check_artifact(processed_data_path, raw_paths + [stage_paths['process']])
+    
+    completed = []
+    save_run_state(stages, completed, 'running')
+    current = None
+    try:
+        raw_df = None
+        processed_df = None
+        
+        # Stage 1: Ingest
+        if 'ingest' in stages:
+            current = 'ingest'
+            print_banner("STAGE 1: DATA INGESTION")
+            start_time = time.time()
+            with profiling.step('ingest') as record:
+                if not needed['ingest']:
+                    print("Skipped - not needed by the cached downstream stages")
+                    cache.record('ingest', 'skipped')
+                elif hits['ingest']:
+                    print("Cache hit - reusing stored raw data")
+                    if feeds_next['ingest']:
+                        raw_df = cache.load_frame('ingest')
+                    cache.record('ingest', 'hit')
+                else:
+                    raw_df = load_stage('ingest').ingest_data(chunksize=chunksize, source=source)
+                    cache.save('ingest', keys['ingest'], frame=raw_df)
+                    cache.record('ingest', 'miss')
+                record['rows_out'] = frame_rows(raw_df)
+                record['cache'] = cache.status['ingest']
+            print(f"Completed in {time.time() - start_time:.2f} seconds")
+            completed.append('ingest')
+            save_run_state(stages, completed, 'running')
+        
+        # Stage 2: Process
+        if 'process' in stages:
+            current = 'process'
+            print_banner("STAGE 2: DATA PROCESSING")
+            start_time = time.time()
+            with profiling.step('process', rows_in=frame_rows(raw_df)) as record:
+                if not needed['process']:
+                    print("Skipped - not needed by the cached downstream stages")
+                    cache.record('process', 'skipped')
+                elif hits['process']:
+                    print("Cache hit - reusing stored processed data")
+                    if feeds_next['process']:
+                        processed_df = cache.load_frame('process')
+                    cache.record('process', 'hit')
+                else:
+                    process_module = load_stage('process')
+                    processed_df = process_module.process_data(raw_df, export_csv=export_csv,
+                                                              workers=workers, chunksize=chunksize,
+                                                              source=source)
+                    artifacts = [process_module.cube_path]
+                    if export_csv:
+                        artifacts.append(process_module.processed_csv_path)
+                    cache.save('process', keys['process'], frame_path=process_module.processed_data_path,
+                               artifacts=artifacts)
+                    cache.record('process', 'miss')
+                record['rows_out'] = frame_rows(processed_df)
+                record['cache'] = cache.status['process']
+            print(f"Completed in {time.time() - start_time:.2f} seconds")
+            completed.append('process')
+            save_run_state(stages, completed, 'running')
+        
+        # Stage 3: Visualize
+        if 'visualize' in stages:
+            current = 'visualize'
+            print_banner("STAGE 3: DATA VISUALIZATION")
+            start_time = time.time()
+            with profiling.step('visualize', rows_in=frame_rows(processed_df)) as record:
+                if hits['visualize']:
+                    print("Cache hit - visualizations are up to date")
+                    cache.record('visualize', 'hit')
+                else:
+                    visualize_module = load_stage('visualize')
+                    findings = visualize_module.visualize_data(processed_df, workers=workers, facets=facets,
+                                                               force=not use_cache, resamples=resamples,
+                                                               render=render, vector=vector)
+                    figures = glob.glob(os.path.join(visualize_module.reports_path, 'V*.png'))
+                    figures.append(visualize_module.fits_path)
+                    if vector:
+                        figures += glob.glob(os.path.join(visualize_module.reports_path, f'V*.{vector}'))
+                    if facets:
+                        figures.append(visualize_module.facet_manifest_path)
+                    if resamples:
+                        figures.append(visualize_module.significance_path)
+                    cache.save('visualize', keys['visualize'], artifacts=sorted(figures))
+                    cache.record('visualize', 'miss')
+                record['cache'] = cache.status['visualize']
+            print(f"Completed in {time.time() - start_time:.2f} seconds")
+            completed.append('visualize')
+    except BaseException:
+        save_run_state(stages, completed, 'failed')
+        print(f"\nWorkflow failed during the {current} stage; "
+              f"rerun with --resume to continue from there")
+        raise
+    save_run_state(stages, completed, 'completed')
+    
+    # Report completion
+    print_banner("WORKFLOW COMPLETED SUCCESSFULLY")
+    if 'visualize' in stages:
+        print(f"Visualizations saved to the reports directory")
+        print(f"Created 5 visualizations")
+    print(cache.report())
+    if show_imports:
+        print_import_report()
+    
+    return True
+
+def run_append(append_path, workers=1, show_imports=False, facets=(), resamples=0,
+               render='production', vector=None):
+    """Add a file of new raw records to the raw data, the processed store and the charts.
+
+    Only the new rows are ingested and processed (as a new part of the
+    processed store); the fill statistics and the per-group sums are updated
+    from them instead of being recomputed over the history. The charts are
+    then redrawn from the whole store, and only the facets that received new
+    rows are re-rendered. The stage cache is not used: the raw
+    data changed, so the next full run rebuilds every stage.
+    """
+    print("="*50)
+    print("APPENDING TO THE STUDENT PERFORMANCE DATA ANALYSIS WORKFLOW")
     print("="*50)
+    print(f"New records: {append_path}")
+    check_artifact(processed_data_path, [stage_paths['process']])
+    
+    print_banner("STAGE 1: DATA INGESTION")
     start_time = time.time()
-    ingest_data()
+    with profiling.step('ingest') as record:
+        new_df = load_stage('ingest').ingest_data(append_path=append_path)
+        record['rows_out'] = len(new_df)
     print(f"Completed in {time.time() - start_time:.2f} seconds")
     
-    # Stage 2: Process
-    print("\n" + "="*50)
-    print("STAGE 2: DATA PROCESSING")
-    print("="*50)
+    print_banner("STAGE 2: DATA PROCESSING")
     start_time = time.time()
-    process_data()
+    with profiling.step('process', rows_in=len(new_df)) as record:
+        processed_df = load_stage('process').process_data(new_df, append=True, append_path=append_path)
+        record['rows_out'] = len(processed_df)
     print(f"Completed in {time.time() - start_time:.2f} seconds")
     
-    # Stage 3: Visualize
-    print("\n" + "="*50)
-    print("STAGE 3: DATA VISUALIZATION")
-    print("="*50)
+    print_banner("STAGE 3: DATA VISUALIZATION")
     start_time = time.time()
-    findings = visualize_data()
+    with profiling.step('visualize', rows_in=len(processed_df)):
+        load_stage('visualize').visualize_data(processed_df, workers=workers, facets=facets, append=True,
+                                                 resamples=resamples, render=render, vector=vector)
     print(f"Completed in {time.time() - start_time:.2f} seconds")
     
-    # Report completion
-    print("\n" + "="*50)
-    print("WORKFLOW COMPLETED SUCCESSFULLY")
-    print("="*50)
+    print_banner("APPEND COMPLETED SUCCESSFULLY")
     print(f"Visualizations saved to the reports directory")
-    print(f"Created 5 visualizations")
+    if show_imports:
+        print_import_report()
     
     return True
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--export-csv', action='store_true',
+                        help='also write the processed data as CSV')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='rerun every stage instead of reusing cached outputs')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream the raw file through ingest and processing in chunks of this many rows')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes for processing, rendering and resampling (0 = one per CPU)')
+    parser.add_argument('--resamples', type=int, default=0,
+                        help='bootstrap/permutation resamples behind reports/significance.md (default 0 = none)')
+    parser.add_argument('--facet', action='append', default=[], metavar='COLUMN',
+                        help='also render the visualizations and findings for every value of COLUMN '
+                             '(repeatable: every combination of the columns) into reports/facets/')
+    parser.add_argument('--render', choices=['production', 'preview'], default='production',
+                        help='chart render profile: 300 DPI print quality, or fast low-resolution previews')
+    parser.add_argument('--vector', choices=['svg', 'pdf'],
+                        help='also save every chart in this vector format')
+    parser.add_argument('--import-report', action='store_true',
+                        help='print how long each stage module took to import and what it loaded')
+    parser.add_argument('--from', dest='start', choices=STAGES,
+                        help='first stage to run')
+    parser.add_argument('--to', dest='stop', choices=STAGES,
+                        help='last stage to run')
+    parser.add_argument('--only', choices=STAGES,
+                        help='run just this stage')
+    parser.add_argument('--resume', action='store_true',
+                        help='rerun the stages a failed previous run did not complete')
+    parser.add_argument('--raw', metavar='SOURCE',
+                        help='read the raw data from a directory or glob of CSV files with the same columns instead of data/raw')
+    parser.add_argument('--append', metavar='CSV',
+                        help='add a file of new raw records and update the outputs from it')
+    parser.add_argument('--profile', action='store_true',
+                        help='record per-step timings, memory and I/O in reports/profile/metrics.jsonl')
+    parser.add_argument('--cprofile', action='append', default=[], choices=STAGES, metavar='STAGE',
+                        help='run STAGE under cProfile (repeatable; implies --profile)')
+    parser.add_argument('--tracemalloc', action='append', default=[], choices=STAGES, metavar='STAGE',
+                        help='trace STAGE\'s allocations with tracemalloc (repeatable; implies --profile)')
+    args = parser.parse_args(argv)
+    if args.only and (args.start or args.stop):
+        parser.error("--only cannot be combined with --from/--to")
+    if args.resume and (args.only or args.start or args.stop):
+        parser.error("--resume cannot be combined with --from/--to/--only")
+    if args.append and (args.resume or args.only or args.start or args.stop):
+        parser.error("--append cannot be combined with --resume/--from/--to/--only")
+    if args.append and args.raw:
+        parser.error("--append cannot be combined with --raw")
+    return args
+
 if __name__ == "__main__":
-    run_workflow()
+    args = parse_args()
+    if args.append:
+        stages = None
+    elif args.resume:
+        stages = resume_stages()
+        if not stages:
+            print("The last run did not fail - nothing to resume")
+            sys.exit(0)
+    else:
+        stages = select_stages(args.start, args.stop, args.only)
+    if args.profile or args.cprofile or args.tracemalloc:
+        profiler = profiling.enable(metrics_path=os.path.join(profile_dir, 'metrics.jsonl'),
+                                    output_dir=profile_dir, cprofile_stages=args.cprofile,
+                                    tracemalloc_stages=args.tracemalloc)
+    if args.append:
+        run_append(args.append, workers=args.workers, show_imports=args.import_report,
+                   facets=args.facet, resamples=args.resamples, render=args.render, vector=args.vector)
+    else:
+        run_workflow(export_csv=args.export_csv, use_cache=not args.no_cache,
+                     chunksize=args.chunksize, workers=args.workers,
+                     show_imports=args.import_report, stages=stages, facets=args.facet,
+                     resamples=args.resamples, render=args.render, vector=args.vector,
+                     source=args.raw)
+    if args.profile or args.cprofile or args.tracemalloc:
+        print(f"Profile metrics appended to {profiler.metrics_path} (run {profiler.run_id})")
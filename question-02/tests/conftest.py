@@ -0,0 +1,40 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_dir = os.path.join(project_dir, 'src')
+sys.path.insert(0, src_dir)
+sys.path.insert(0, os.path.join(os.path.dirname(project_dir), 'common'))
+
+HEADER = ('"gender","race/ethnicity","parental level of education","lunch",'
+          '"test preparation course","math score","reading score","writing score"\n')
+
+
+def write_raw(path, rows):
+    """Write rows (tuples of the eight raw values, '' for missing) as a raw CSV."""
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for row in rows:
+            f.write(','.join(f'"{value}"' for value in row) + '\n')
+    return str(path)
+
+
+@pytest.fixture
+def process(tmp_path):
+    """A fresh 2_process module whose raw and processed paths are under tmp_path."""
+    spec = importlib.util.spec_from_file_location('process', os.path.join(src_dir, '2_process.py'))
+    module = importlib.util.module_from_spec(spec)
+    # Registered like the runner does, so worker processes can unpickle its functions
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    processed = tmp_path / 'processed'
+    module.raw_data_path = str(tmp_path / 'raw.csv')
+    module.processed_data_path = str(processed / 'students_processed.parquet')
+    module.processed_csv_path = str(processed / 'students_processed.csv')
+    module.appends_path = str(processed / 'students_appends')
+    module.statistics_path = str(processed / 'students_fill_statistics.pkl')
+    module.cube_path = str(processed / 'students_cube_statistics.pkl')
+    return module
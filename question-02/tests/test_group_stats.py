@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from group_stats import AggregateCube, GroupStats, GroupSums
+
+
+def students():
+    rng = np.random.default_rng(0)
+    n = 200
+    df = pd.DataFrame({
+        'gender': pd.Categorical(rng.choice(['female', 'male'], n)),
+        'lunch': pd.Categorical(rng.choice(['free/reduced', 'standard'], n)),
+        'math_score': rng.integers(0, 101, n).astype(np.uint8),
+        'reading_score': rng.integers(0, 101, n).astype(np.uint8),
+    })
+    df['overall_avg'] = (df['math_score'] + df['reading_score']) / 2
+    return df
+
+
+def test_saved_statistics_of_other_rows_are_ignored():
+    df = students()
+    cube, sums = AggregateCube.of(df), GroupSums.of(df)
+    subset = df[df['lunch'] == 'standard']
+
+    stats = GroupStats(subset, sums=sums, cube=cube)
+
+    assert stats.cube is not cube and stats.sums is not sums
+    assert stats.cube.count() == len(subset)
+    assert np.isclose(stats.mean('gender', 'male', 'math_score'),
+                      subset.loc[subset['gender'] == 'male', 'math_score'].mean())
+
+
+def test_saved_statistics_of_the_same_rows_are_used():
+    df = students()
+    cube, sums = AggregateCube.of(df), GroupSums.of(df)
+
+    stats = GroupStats(df, sums=sums, cube=cube)
+
+    assert stats.cube is cube and stats.sums is sums
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import incremental
+from conftest import write_raw
+
+BASE_ROWS = [
+    ('female', 'group B', "bachelor's degree", 'standard', 'none', 72, 72, 74),
+    ('female', 'group C', 'some college', 'standard', 'completed', 69, 90, 88),
+    ('male', 'group A', 'high school', 'free/reduced', 'none', 47, 57, 44),
+    ('female', 'group B', 'some college', 'standard', 'none', 90, 95, 93),
+]
+
+
+def load_store(process):
+    files = incremental.processed_files(process.processed_data_path, process.appends_path)
+    return pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+
+
+def test_append_fills_missing_categorical(process):
+    write_raw(process.raw_data_path, BASE_ROWS)
+    process.process_data()
+    new_rows = [('', 'group C', "master's degree", 'standard', 'none', 70, 80, 75),
+                ('male', 'group A', '', 'free/reduced', 'completed', 60, 65, 62)]
+    new_path = write_raw(process.raw_data_path + '.new', new_rows)
+
+    appended = process.process_data(process.read_raw(new_path), append=True, append_path=new_path)
+
+    # The modes of all rows, which neither new row holds
+    assert appended['gender'].tolist() == ['female', 'male']
+    assert appended['parental_level_of_education'].tolist() == ["master's degree", 'some college']
+    store = load_store(process)
+    assert len(store) == 6
+    assert store['gender'].notna().all()
+    assert len(pd.read_csv(process.raw_data_path)) == 6
+
+
+def test_failed_append_leaves_raw_and_store_unchanged(process, monkeypatch):
+    write_raw(process.raw_data_path, BASE_ROWS)
+    process.process_data(export_csv=True)
+    new_path = write_raw(process.raw_data_path + '.new', [BASE_ROWS[2]])
+    before = {path: open(path, 'rb').read() for path in (process.raw_data_path, process.processed_csv_path)}
+
+    def fail(raw_path, new_path):
+        with open(raw_path, 'a') as f:
+            f.write('"male","gro')
+        raise OSError("disk full")
+    monkeypatch.setattr(incremental, 'append_raw', fail)
+    with pytest.raises(OSError):
+        process.process_data(process.read_raw(new_path), append=True, append_path=new_path)
+    assert {path: open(path, 'rb').read() for path in before} == before
+    assert len(load_store(process)) == 4
+
+    # A retry appends the rows once
+    monkeypatch.undo()
+    process.process_data(process.read_raw(new_path), append=True, append_path=new_path)
+    assert len(pd.read_csv(process.raw_data_path)) == 5
+    assert len(load_store(process)) == 5
+
+
+def test_partitioned_fills_missing_values(process):
+    # The first of the three partitions holds the first three rows, without
+    # the gender it is filled with
+    male = ('male', 'group A', 'high school', 'standard', 'none', 50, 50, 50)
+    missing = ('', 'group A', 'high school', 'standard', 'none', 50, '', 50)
+    female = ('female', 'group B', 'some college', 'standard', 'none', 60, 60, 60)
+    rows = [male, male, missing, female, female, female]
+    write_raw(process.raw_data_path, rows)
+    serial = process.process_data()
+
+    partitioned = process.process_data(workers=3)
+
+    assert partitioned['gender'].tolist() == ['male', 'male'] + ['female'] * 4
+    assert partitioned['reading_score'][2] == 60
+    pd.testing.assert_frame_equal(partitioned, serial)
+
+
+def test_compact_dtypes_of_empty_columns(process):
+    df = pd.DataFrame({col: pd.Series([], dtype=np.float64) for col in process.SCORE_COLUMNS})
+
+    compact = process.compact_dtypes(df)
+
+    assert (compact.dtypes == np.uint8).all()
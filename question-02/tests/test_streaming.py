@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from streaming import StreamingProfile
+
+
+def test_leading_all_missing_chunk():
+    df = pd.DataFrame({
+        'lunch': [None, None, 'standard', 'free/reduced', 'standard'],
+        'math_score': [np.nan, np.nan, 72, 69, 90],
+        'reading_score': [np.nan, np.nan, np.nan, np.nan, np.nan],
+    })
+    chunks = [df.iloc[:2].copy(), df.iloc[2:].copy()]
+    chunks[0]['lunch'] = chunks[0]['lunch'].astype('float64')
+    chunks[1]['math_score'] = chunks[1]['math_score'].astype('int64')
+
+    profile = StreamingProfile()
+    for chunk in chunks:
+        profile.update(chunk)
+
+    summary = profile.numeric_summary()
+    assert list(summary.columns) == ['math_score', 'reading_score']
+    assert summary['math_score'].to_dict() == {
+        'count': 3, 'mean': df['math_score'].mean(), 'std': df['math_score'].std(),
+        'min': 69.0, 'max': 90.0}
+    assert summary['reading_score'].isna().drop('count').all()
+    assert summary.loc['count', 'reading_score'] == 0
+    assert profile.value_counts('lunch').to_dict() == {'standard': 2, 'free/reduced': 1}
+    assert profile.dtypes_series().to_dict() == {
+        'lunch': chunks[1]['lunch'].dtype, 'math_score': np.dtype('float64'),
+        'reading_score': np.dtype('float64')}
+    assert profile.missing.to_dict() == {'lunch': 2, 'math_score': 2, 'reading_score': 5}